@@ -0,0 +1 @@
+# 性能基准脚本（python -m app.benchmarks.<name> 运行）
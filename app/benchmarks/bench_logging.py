@@ -0,0 +1,85 @@
+"""日志开销基准：对比旧的 print(json.dumps(..., indent=...)) 与新的队列日志在事件循环线程上的耗时。
+
+模拟一次 Gemini 请求的日志：payload、上游 body 与上游响应文本。只统计调用线程（即事件循环）上的时间，
+新方案在 DEBUG 级别下的序列化/写出发生在后台线程。
+
+用法：
+    python -m app.benchmarks.bench_logging [--messages 200] [--chars 2000] [--runs 50]
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import statistics
+import time
+
+from app.config import settings
+from app.utils import log as app_log
+
+
+def _fake_request(messages: int, chars: int):
+    payload = {
+        "model": "gemini-2.5-pro",
+        "stream": False,
+        "messages": [
+            {"role": "user" if i % 2 == 0 else "assistant", "content": ("x" * chars)}
+            for i in range(messages)
+        ],
+    }
+    body = ["models/gemini-2.5-pro", [[[[None, m["content"]]], m["role"]] for m in payload["messages"]]]
+    upstream_text = json.dumps([[[[[[None, "y" * chars]], "model"]]] for _ in range(messages // 4 or 1)])
+    return payload, body, upstream_text
+
+
+def _old_style(payload, body, text, sink):
+    with contextlib.redirect_stdout(sink):
+        print(f'send_conversation| payload:{json.dumps(payload, indent=2)}')
+        print(json.dumps(body, indent=4))
+        print(text)
+
+
+def _new_style(logger, payload, body, text):
+    if logger.isEnabledFor(logging.DEBUG) and app_log.sampled():
+        logger.debug("send_conversation payload=%s", app_log.LazyJson(payload))
+    if logger.isEnabledFor(logging.DEBUG) and app_log.sampled():
+        logger.debug("upstream body=%s", app_log.LazyJson(body))
+    logger.debug("upstream response status=%s body=%s", 200, app_log.LazyText(text))
+
+
+def _median_us(fn, runs: int) -> float:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return round(statistics.median(samples) * 1e6, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--chars", type=int, default=2000)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    payload, body, text = _fake_request(args.messages, args.chars)
+    logger = logging.getLogger("app.services.gemini_reverse_2")
+
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        old_us = _median_us(lambda: _old_style(payload, body, text, devnull), args.runs)
+
+        report = {"messages": args.messages, "chars_per_message": args.chars, "old_print_us": old_us}
+        for level in ("INFO", "DEBUG"):
+            settings._config["log_level"] = level
+            with contextlib.redirect_stderr(io.StringIO()):
+                app_log.setup_logging(force=True)
+                report[f"new_{level.lower()}_us"] = _median_us(lambda: _new_style(logger, payload, body, text), args.runs)
+                app_log.shutdown_logging()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""离线回放基准：用录制的 fixture（见 app/utils/fixtures）测量帧解析、答案提取、JS 包改写与 SSE 编码，不需要网络与浏览器。
+
+- copilot：帧 -> CopilotReverse._handle_frame -> 流式队列 -> SSE 块
+- gemini：GeminiReverse2.send_conversation 全流程（准备、checksum、构造请求体、解析响应、提取答案、SSE），
+  以及单独的 json 解析 + extract_final_answer
+- bundle：JSObfuscatedProcessor 改写 m=_b JS 包（没有 bundle fixture 时使用仓库中的 app/services/m=_b-76282a03.js）
+
+用法：
+    python -m app.benchmarks.bench_replay [--fixtures app/benchmarks/fixtures] [--n 50] [--output report.json]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import time
+from pathlib import Path
+
+from app.services.copilot_reverse import CopilotPageState, CopilotReverse
+from app.utils import fixtures
+from app.utils.JSObfuscatedProcessor import JSObfuscatedProcessor
+
+HERE = Path(__file__).resolve().parent
+REPO_BUNDLE = HERE.parent / "services" / "m=_b-76282a03.js"
+
+
+def _timings(samples) -> dict:
+    ordered = sorted(samples)
+    return {
+        "n": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 4),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 4),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 4),
+    }
+
+
+async def _copilot_once(reverser: CopilotReverse, fixture: dict) -> int:
+    state = CopilotPageState()
+    reverser._reset_state(state, stream_mode=True)
+    await fixtures.replay_frames(reverser, state, fixture)
+    size = 0
+    while True:
+        chunk = state.stream_queue.get_nowait()
+        done = chunk == "__DONE__"
+        async for s in reverser._convert_to_openai_stream_copilot_single(
+                None if done else chunk, done=done, default_id="chatcmpl-replay", default_created=1):
+            size += len(s)
+        if done:
+            return size
+
+
+async def bench_copilot(fixture_list, n: int) -> dict:
+    reverser = CopilotReverse()
+    report = {}
+    for fixture in fixture_list:
+        await _copilot_once(reverser, fixture)
+        samples = []
+        for _ in range(n):
+            started = time.perf_counter()
+            sse_bytes = await _copilot_once(reverser, fixture)
+            samples.append(time.perf_counter() - started)
+        frames = len(fixture.get("events", ()))
+        report[fixture["id"]] = dict(_timings(samples), frames=frames, sse_bytes=sse_bytes,
+                                     per_frame_us=round(statistics.fmean(samples) / max(frames, 1) * 1e6, 3))
+    return report
+
+
+async def bench_gemini(fixture_list, n: int) -> dict:
+    reverser = fixtures.replay_gemini(fixture_list)
+    extractor = fixtures.replay_gemini(fixture_list)
+    report = {}
+    for fixture in fixture_list:
+        payload = dict(fixture["request"]["payload"], stream=True)
+        end_to_end, extract = [], []
+        for i in range(n + 1):
+            started = time.perf_counter()
+            stream = await reverser.send_conversation(payload=payload)
+            async for _ in stream:
+                pass
+            elapsed = time.perf_counter() - started
+            text = fixture["response"]["text"]
+            started = time.perf_counter()
+            answer = extractor.extract_final_answer(json.loads(text))
+            if i:
+                # 第一次为预热
+                end_to_end.append(elapsed)
+                extract.append(time.perf_counter() - started)
+        report[fixture["id"]] = {"end_to_end": _timings(end_to_end), "parse_extract": _timings(extract),
+                                 "response_bytes": len(text), "answer_chars": len(answer)}
+    return report
+
+
+def bench_bundle(fixture_list, n: int) -> dict:
+    bundles = [(f["id"], fixtures.bundle_code(f)) for f in fixture_list]
+    if not bundles and REPO_BUNDLE.exists():
+        bundles = [(REPO_BUNDLE.name, REPO_BUNDLE.read_text(encoding="utf-8"))]
+    report = {}
+    processor = JSObfuscatedProcessor()
+    for name, code in bundles:
+        samples = []
+        captured = None
+        for _ in range(max(1, n // 10)):
+            started = time.perf_counter()
+            _, captured = processor.process_and_get_modified_string(code)
+            samples.append(time.perf_counter() - started)
+        report[name] = dict(_timings(samples), bytes=len(code), captured=captured)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fixtures", default=str(HERE / "fixtures"), help="fixture directory (<dir>/<kind>/*.json)")
+    parser.add_argument("--n", type=int, default=50, help="iterations per fixture")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    # 改写 JS 包时的 info 日志会淹没报告
+    logging.getLogger("app").setLevel(logging.WARNING)
+
+    loaded = {kind: list(fixtures.iter_fixtures(args.fixtures, kind)) for kind in fixtures.KINDS}
+    report = {
+        "fixtures": args.fixtures,
+        "fixture_version": fixtures.FIXTURE_VERSION,
+        "copilot": asyncio.run(bench_copilot(loaded["copilot"], args.n)),
+        "gemini": asyncio.run(bench_gemini(loaded["gemini"], args.n)) if loaded["gemini"] else {},
+        "bundle": bench_bundle(loaded["bundle"], args.n),
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
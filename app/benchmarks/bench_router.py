@@ -0,0 +1,66 @@
+"""模型路由基准：对比旧的逐请求子串查找 + 未编译正则与编译后的路由表（缓存命中/未命中）。
+
+用法：
+    python -m app.benchmarks.bench_router [--n 200000]
+"""
+import argparse
+import json
+import re
+import time
+
+from app.config.model_mode_map import EXACT_MAP, PATTERN_MAP
+from app.services import backend_registry
+from app.services.model_router import router
+
+MODELS = ("copilot-chat", "gpt-5-chat-latest", "gemini-2.5-pro", "o3-mini", "my-fast-model", "unknown-model")
+
+
+def _legacy_resolve(model: str):
+    """旧实现：注册表子串匹配 + 每次 re.search 未编译的 PATTERN_MAP。"""
+    backend = backend_registry.default_backend_name()
+    for spec in backend_registry.list_backends():
+        if model in spec.models:
+            backend = spec.name
+            break
+    else:
+        lowered = model.lower()
+        for spec in backend_registry.list_backends():
+            if any(m in lowered for m in spec.match):
+                backend = spec.name
+                break
+    title = EXACT_MAP.get(model)
+    if title is None:
+        for pattern, t in PATTERN_MAP:
+            if re.search(pattern, model):
+                title = t
+                break
+    return backend, title
+
+
+def _per_call_ns(fn, n: int) -> float:
+    started = time.perf_counter_ns()
+    for i in range(n):
+        fn(MODELS[i % len(MODELS)])
+    return (time.perf_counter_ns() - started) / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--n", type=int, default=200000)
+    args = parser.parse_args()
+
+    router.load()
+    table = router._current()
+    report = {
+        "n": args.n,
+        "legacy_ns": round(_per_call_ns(_legacy_resolve, args.n), 1),
+        # 绕过缓存，测量编译后规则表本身的解析开销（缓存未命中的代价）
+        "compiled_uncached_ns": round(_per_call_ns(table._resolve, args.n), 1),
+        "router_cached_ns": round(_per_call_ns(router.resolve, args.n), 1),
+        "cache": router.cache_info()._asdict(),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""启动耗时基准：对比 `import app.main` 与“立即加载所有后端实现”的导入时间。
+
+每次测量都在独立的子进程中完成，避免模块缓存影响结果。
+
+用法：
+    python -m app.benchmarks.bench_startup [--runs 5]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+
+# 懒加载：仅导入应用本身
+LAZY_SNIPPET = """
+import time, sys
+t0 = time.perf_counter()
+import app.main
+t1 = time.perf_counter()
+heavy = [m for m in ("playwright", "aiohttp", "httpx") if m in sys.modules]
+print(repr((t1 - t0, heavy)))
+"""
+
+# 急加载：导入应用后立刻加载全部后端实现类（等价于重构前 reverse_factory 的行为）
+EAGER_SNIPPET = """
+import time, sys
+t0 = time.perf_counter()
+import app.main
+from app.services import backend_registry
+errors = []
+for spec in backend_registry.list_backends():
+    try:
+        spec.load_class()
+    except Exception as e:
+        errors.append(f"{spec.name}: {e.__class__.__name__}: {e}")
+t1 = time.perf_counter()
+heavy = [m for m in ("playwright", "aiohttp", "httpx") if m in sys.modules]
+print(repr((t1 - t0, heavy, errors)))
+"""
+
+
+def _measure(snippet: str, runs: int):
+    timings = []
+    last = None
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", snippet],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip().splitlines()[-1]
+        last = eval(out)
+        timings.append(last[0])
+    return timings, last
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    lazy, lazy_last = _measure(LAZY_SNIPPET, args.runs)
+    eager, eager_last = _measure(EAGER_SNIPPET, args.runs)
+
+    lazy_ms = statistics.median(lazy) * 1000
+    eager_ms = statistics.median(eager) * 1000
+    report = {
+        "runs": args.runs,
+        "lazy_import_ms": round(lazy_ms, 2),
+        "lazy_heavy_modules": lazy_last[1],
+        "eager_import_ms": round(eager_ms, 2),
+        "eager_heavy_modules": eager_last[1],
+        "eager_load_errors": eager_last[2],
+        "saved_ms": round(eager_ms - lazy_ms, 2),
+        "speedup": round(eager_ms / lazy_ms, 2) if lazy_ms else None,
+    }
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
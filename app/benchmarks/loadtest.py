@@ -0,0 +1,447 @@
+"""/v1/chat/completions 压测工具：按并发/阶段发起混合请求，输出吞吐、延迟分位数、首 token 时间与错误率（JSON）。
+
+目标：
+- 默认在进程内通过 ASGI 直接调用 app（不经过网络，不运行启动/关闭事件；需要预热真实后端时加 --lifespan）
+- --target http://127.0.0.1:5005 压测运行中的实例
+
+请求组合：
+- 命令行：--models a,b --stream-ratio 0.5 --prompt-tokens 16,256,2048
+- 或 --mix mix.json：[{"weight": 3, "model": "copilot-chat", "stream": true, "prompt_tokens": 256}, ...]
+  每项可带 "payload" 字段，合并进请求体
+- --mock 在每个请求中加入 use_mock（完全离线）；--extra '{"backend": "..."}' 合并任意字段
+- --models sim-chat 使用模拟后端（有限页面容量与真实的延迟分布，同样离线，见 app/services/sim_backend.py）
+
+负载曲线：
+- --concurrency N --duration S：恒定并发
+- --stages "10:4,30:16,10:0"：k6 风格阶段（秒:目标并发），阶段内线性变化
+
+基线对比：
+- --save-baseline base.json 保存本次报告
+- --baseline base.json 与已保存报告对比，p95 延迟 / 首 token、吞吐或错误率超出 --tolerance 时标记 regression 并以退出码 1 结束
+
+用法：
+    python -m app.benchmarks.loadtest --mock --concurrency 8 --duration 10
+    python -m app.benchmarks.loadtest --target http://127.0.0.1:5005 --stages "10:4,30:16" --baseline base.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+PATH = "/v1/chat/completions"
+
+# 生成指定 token 数的提示词：常见英文单词大约各占 1 个 token
+_WORDS = ("the", "system", "request", "model", "latency", "page", "browser", "stream", "token", "answer",
+          "question", "capacity", "queue", "backend", "proxy", "time", "first", "load", "test", "data")
+
+
+# ---- 传输 ----
+
+class ResponseInterrupted(Exception):
+    """响应在发送完成之前中断（流式响应中途出错）。"""
+
+
+class _AsgiClient:
+    """进程内调用 ASGI app；响应体按 send 的顺序逐块交给调用方，流式首 token 时间与网络无关。"""
+
+    def __init__(self, app, lifespan: bool = False):
+        self.app = app
+        self.lifespan = lifespan
+        self._lifespan_task = None
+        self._lifespan_in: Optional[asyncio.Queue] = None
+        self._lifespan_out: Optional[asyncio.Queue] = None
+
+    async def start(self):
+        if not self.lifespan:
+            return
+        self._lifespan_in = asyncio.Queue()
+        self._lifespan_out = asyncio.Queue()
+
+        async def send(message):
+            self._lifespan_out.put_nowait(message)
+
+        self._lifespan_task = asyncio.ensure_future(
+            self.app({"type": "lifespan", "asgi": {"version": "3.0"}}, self._lifespan_in.get, send))
+        self._lifespan_in.put_nowait({"type": "lifespan.startup"})
+        message = await self._lifespan_out.get()
+        if message["type"] != "lifespan.startup.complete":
+            raise RuntimeError(f"app startup failed: {message.get('message')}")
+
+    async def close(self):
+        if self._lifespan_task is None:
+            return
+        self._lifespan_in.put_nowait({"type": "lifespan.shutdown"})
+        await self._lifespan_out.get()
+        await self._lifespan_task
+
+    async def post(self, path: str, body: bytes) -> Tuple[int, AsyncIterator[bytes]]:
+        chunks: asyncio.Queue = asyncio.Queue()
+        status = asyncio.get_running_loop().create_future()
+        finished = asyncio.Event()
+        body_sent = False
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # 请求体读完后只在响应结束（或压测取消）时返回断开
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        complete = False
+
+        async def send(message):
+            nonlocal complete
+            if message["type"] == "http.response.start":
+                status.set_result(message["status"])
+            elif message["type"] == "http.response.body":
+                if message.get("body"):
+                    chunks.put_nowait(message["body"])
+                if not message.get("more_body", False):
+                    complete = True
+                    chunks.put_nowait(None)
+
+        scope = {
+            "type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "http_version": "1.1",
+            "method": "POST", "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+            "root_path": "", "headers": [(b"content-type", b"application/json"), (b"host", b"loadtest")],
+            "client": ("127.0.0.1", 0), "server": ("loadtest", 80),
+        }
+        task = asyncio.ensure_future(self.app(scope, receive, send))
+        task.add_done_callback(lambda t: chunks.put_nowait(None))
+
+        async def body_iter():
+            try:
+                while True:
+                    chunk = await chunks.get()
+                    if chunk is None:
+                        break
+                    yield chunk
+                # 与真实服务器一致：app 在响应发送完之前抛出异常时，客户端只会看到被截断的响应
+                if not complete:
+                    raise ResponseInterrupted()
+            finally:
+                finished.set()
+                # app 的异常已体现为 500 或截断的响应，这里只回收任务
+                await asyncio.gather(task, return_exceptions=True)
+
+        waiter = asyncio.ensure_future(status)
+        await asyncio.wait((waiter, task), return_when=asyncio.FIRST_COMPLETED)
+        if not waiter.done():
+            finished.set()
+            await asyncio.gather(task, return_exceptions=True)
+            raise ResponseInterrupted()
+        return waiter.result(), body_iter()
+
+
+class _HttpClient:
+    """压测运行中的实例。"""
+
+    def __init__(self, base_url: str, limit: int):
+        self.base_url = base_url.rstrip("/")
+        self.limit = limit
+        self._session = None
+
+    async def start(self):
+        import aiohttp
+
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.limit),
+            timeout=aiohttp.ClientTimeout(total=None),
+        )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def post(self, path: str, body: bytes) -> Tuple[int, AsyncIterator[bytes]]:
+        import aiohttp
+
+        response = await self._session.post(self.base_url + path, data=body,
+                                            headers={"Content-Type": "application/json"})
+
+        async def body_iter():
+            try:
+                async for chunk in response.content.iter_any():
+                    yield chunk
+            except aiohttp.ClientPayloadError:
+                raise ResponseInterrupted() from None
+            finally:
+                response.release()
+
+        return response.status, body_iter()
+
+
+# ---- 请求组合与负载曲线 ----
+
+def _prompt(rng: random.Random, tokens: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(max(1, tokens)))
+
+
+def _build_mix(args) -> List[dict]:
+    if args.mix:
+        mix = json.loads(Path(args.mix).read_text(encoding="utf-8"))
+        if not isinstance(mix, list) or not mix:
+            raise SystemExit("--mix must be a non-empty JSON list")
+        return mix
+    models = [m for m in args.models.split(",") if m]
+    sizes = [int(s) for s in args.prompt_tokens.split(",") if s]
+    mix = []
+    for model in models:
+        for size in sizes:
+            if args.stream_ratio > 0:
+                mix.append({"weight": args.stream_ratio, "model": model, "stream": True, "prompt_tokens": size})
+            if args.stream_ratio < 1:
+                mix.append({"weight": 1 - args.stream_ratio, "model": model, "stream": False, "prompt_tokens": size})
+    return mix
+
+
+def _scenario_name(item: dict) -> str:
+    return item.get("name") or f"{item.get('model', 'copilot-chat')}/{'stream' if item.get('stream') else 'sync'}/{item.get('prompt_tokens', 16)}"
+
+
+def _parse_stages(spec: Optional[str], concurrency: int, duration: float) -> List[Tuple[float, int]]:
+    if not spec:
+        return [(0.0, concurrency), (duration, concurrency)]
+    points = [(0.0, 0)]
+    elapsed = 0.0
+    for part in spec.split(","):
+        seconds, _, target = part.partition(":")
+        elapsed += float(seconds)
+        points.append((elapsed, int(target)))
+    return points
+
+
+def _target_at(points: List[Tuple[float, int]], t: float) -> int:
+    for (t0, c0), (t1, c1) in zip(points, points[1:]):
+        if t <= t1:
+            if t1 == t0:
+                return c1
+            return round(c0 + (c1 - c0) * (t - t0) / (t1 - t0))
+    return 0
+
+
+# ---- 执行 ----
+
+class _Result:
+    __slots__ = ("scenario", "status", "error", "started", "latency", "ttft", "chunks")
+
+    def __init__(self, scenario: str, started: float):
+        self.scenario = scenario
+        self.started = started
+        self.status = 0
+        self.error: Optional[str] = None
+        self.latency = 0.0
+        self.ttft: Optional[float] = None
+        self.chunks = 0
+
+
+async def _one(client, item: dict, payload: dict, timeout: Optional[float]) -> _Result:
+    result = _Result(_scenario_name(item), time.perf_counter())
+    stream = bool(payload.get("stream"))
+    try:
+        async def run():
+            status, body = await client.post(PATH, json.dumps(payload).encode("utf-8"))
+            result.status = status
+            buffer = b""
+            async for chunk in body:
+                buffer += chunk
+                if not stream:
+                    continue
+                while b"\n\n" in buffer:
+                    event, buffer = buffer.split(b"\n\n", 1)
+                    if not event.startswith(b"data: {"):
+                        continue
+                    if result.ttft is None:
+                        result.ttft = time.perf_counter() - result.started
+                    result.chunks += 1
+                    if b'"error"' in event and "error" in json.loads(event[6:]):
+                        result.error = "stream_error"
+            if status != 200:
+                result.error = f"http_{status}"
+            elif not stream:
+                body_obj = json.loads(buffer or b"{}")
+                if not body_obj.get("choices"):
+                    result.error = "empty_response"
+
+        await asyncio.wait_for(run(), timeout)
+    except asyncio.TimeoutError:
+        result.error = "client_timeout"
+    except Exception as e:
+        result.error = e.__class__.__name__
+    result.latency = time.perf_counter() - result.started
+    return result
+
+
+async def _run(client, args, mix: List[dict]) -> Tuple[List[_Result], float]:
+    rng = random.Random(args.seed)
+    weights = [float(item.get("weight", 1)) for item in mix]
+    extra = json.loads(args.extra) if args.extra else {}
+    if args.mock:
+        extra.setdefault("use_mock", True)
+    points = _parse_stages(args.stages, args.concurrency, args.duration)
+    total_time = points[-1][0]
+    max_workers = max(c for _, c in points)
+    results: List[_Result] = []
+    issued = 0
+    started = time.perf_counter()
+
+    def next_payload():
+        item = rng.choices(mix, weights)[0]
+        payload = {
+            "model": item.get("model", "copilot-chat"),
+            "stream": bool(item.get("stream")),
+            "messages": [{"role": "user", "content": _prompt(rng, int(item.get("prompt_tokens", 16)))}],
+        }
+        payload.update(extra)
+        payload.update(item.get("payload") or {})
+        return item, payload
+
+    async def worker(index: int):
+        nonlocal issued
+        while True:
+            elapsed = time.perf_counter() - started
+            if elapsed >= total_time or (args.requests and issued >= args.requests):
+                return
+            if index >= _target_at(points, elapsed):
+                # 当前阶段不需要这个 worker
+                await asyncio.sleep(0.05)
+                continue
+            issued += 1
+            item, payload = next_payload()
+            results.append(await _one(client, item, payload, args.timeout))
+
+    await asyncio.gather(*(worker(i) for i in range(max_workers)))
+    return results, time.perf_counter() - started
+
+
+# ---- 报告 ----
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def _summary(results: List[_Result], elapsed: float) -> dict:
+    ok = [r for r in results if r.error is None]
+    errors = Counter(r.error for r in results if r.error is not None)
+    latencies = [r.latency for r in ok]
+    ttfts = [r.ttft for r in ok if r.ttft is not None]
+
+    def ms(v):
+        return None if v is None else round(v * 1000, 2)
+
+    return {
+        "requests": len(results),
+        "ok": len(ok),
+        "errors": dict(errors),
+        "error_rate": round(len(results) and (len(results) - len(ok)) / len(results), 4),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {f"p{q}": ms(_percentile(latencies, q)) for q in (50, 95, 99)},
+        "ttft_ms": {f"p{q}": ms(_percentile(ttfts, q)) for q in (50, 95, 99)},
+    }
+
+
+def _report(results: List[_Result], elapsed: float, args) -> dict:
+    by_scenario: Dict[str, List[_Result]] = {}
+    for r in results:
+        by_scenario.setdefault(r.scenario, []).append(r)
+    return {
+        "target": args.target or "in-process",
+        "duration_s": round(elapsed, 2),
+        "seed": args.seed,
+        **_summary(results, elapsed),
+        "scenarios": {name: _summary(rs, elapsed) for name, rs in sorted(by_scenario.items())},
+    }
+
+
+def _compare(report: dict, baseline: dict, tolerance: float) -> dict:
+    """与基线对比：delta 为相对变化；延迟/首 token 变大、吞吐变小、错误率升高超过容差视为回退。"""
+    checks = {}
+
+    def check(name, current, base, higher_is_worse=True):
+        if current is None or base is None:
+            return
+        delta = (current - base) / base if base else 0.0
+        worse = delta > tolerance if higher_is_worse else delta < -tolerance
+        checks[name] = {"baseline": base, "current": current, "delta": round(delta, 4), "regression": worse}
+
+    check("latency_p95_ms", report["latency_ms"]["p95"], baseline.get("latency_ms", {}).get("p95"))
+    check("latency_p99_ms", report["latency_ms"]["p99"], baseline.get("latency_ms", {}).get("p99"))
+    check("ttft_p95_ms", report["ttft_ms"]["p95"], baseline.get("ttft_ms", {}).get("p95"))
+    check("throughput_rps", report["throughput_rps"], baseline.get("throughput_rps"), higher_is_worse=False)
+    base_errors = baseline.get("error_rate", 0.0)
+    checks["error_rate"] = {
+        "baseline": base_errors, "current": report["error_rate"],
+        "delta": round(report["error_rate"] - base_errors, 4),
+        "regression": report["error_rate"] - base_errors > tolerance,
+    }
+    return {"tolerance": tolerance, "checks": checks, "regression": any(c["regression"] for c in checks.values())}
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", help="base URL of a running instance; omit to run in-process")
+    parser.add_argument("--lifespan", action="store_true", help="in-process: run app startup/shutdown (warm-up)")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--stages", help='k6-style ramp "seconds:target,...", overrides --concurrency/--duration')
+    parser.add_argument("--requests", type=int, default=0, help="stop after this many requests (0 = unlimited)")
+    parser.add_argument("--timeout", type=float, default=300.0, help="client-side timeout per request")
+    parser.add_argument("--models", default="copilot-chat")
+    parser.add_argument("--stream-ratio", type=float, default=0.5)
+    parser.add_argument("--prompt-tokens", default="16,256")
+    parser.add_argument("--mix", help="JSON file with weighted request scenarios")
+    parser.add_argument("--mock", action="store_true", help="add use_mock to every request (offline)")
+    parser.add_argument("--extra", help="JSON object merged into every request body")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--baseline", help="compare against a saved report")
+    parser.add_argument("--save-baseline", help="save this report as a baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative regression (0.1 = 10%%)")
+    return parser.parse_args(argv)
+
+
+async def _main(args) -> dict:
+    mix = _build_mix(args)
+    if args.target:
+        client = _HttpClient(args.target, limit=max(args.concurrency, 1) * 2)
+    else:
+        from app.main import app
+
+        client = _AsgiClient(app, lifespan=args.lifespan)
+    await client.start()
+    try:
+        results, elapsed = await _run(client, args, mix)
+    finally:
+        await client.close()
+    return _report(results, elapsed, args)
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    # 先读取基线：文件有误时不必跑完整个压测才发现
+    baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8")) if args.baseline else None
+    report = asyncio.run(_main(args))
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps(report, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+    if baseline is not None:
+        report["comparison"] = _compare(report, baseline, args.tolerance)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    print(text)
+    sys.exit(1 if baseline is not None and report["comparison"]["regression"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,10 @@
 """Model -> mode_title 映射配置。
 
 提供可扩展、多对一的映射规则。优先使用精确映射，其次按正则模式顺序匹配。
-可以在这里扩展或从外部文件加载覆盖。
+这里是内置规则表；解析由 app.services.model_router 统一完成（规则在加载时编译与校验、结果缓存），
+覆盖或新增规则请写在 config.json 的 model_routes 中（支持热更新）。
 """
-from typing import Optional, Iterable, Tuple, List
-import re
+from typing import Optional, Tuple, List
 
 # 精确匹配字典（优先）
 EXACT_MAP = {
@@ -12,9 +12,9 @@ EXACT_MAP = {
     "gpt-5-chat-latest": "Smart (GPT-5)",
 }
 
-# 模式映射：按顺序匹配，支持正则（忽略大小写）
+# 模式映射：按顺序匹配，支持正则（忽略大小写）。不能匹配空串，否则会命中所有模型
 PATTERN_MAP: List[Tuple[str, str]] = [
-    (r"(?i)gpt[-_ ]?5|gpt5|smart|", "Smart (GPT-5)"),
+    (r"(?i)gpt[-_ ]?5|gpt5|smart", "Smart (GPT-5)"),
     (r"(?i)think|deeper|reasoning|o3|gpt-think", "Think Deeper"),
     (r"(?i)fast|quick|快速|gpt[-_ ]?4o|gpt4o", "快速响应"),
 ]
@@ -23,31 +23,37 @@ PATTERN_MAP: List[Tuple[str, str]] = [
 def get_mode_title_for_model(model_name: Optional[str]) -> Optional[str]:
     """根据 model 名称返回对应的 mode_title，找不到则返回 None。
 
-    支持精确匹配和模式匹配（按 PATTERN_MAP 顺序）。
+    支持精确匹配和模式匹配（按 PATTERN_MAP 顺序），config.json 的 model_routes 优先。
     """
+    from app.services.model_router import resolve
+
     if not model_name:
         return None
-    model_name = model_name.strip()
+    return resolve(model_name).mode
+
+
+def known_mode_titles() -> set:
+    """内置规则表与 config.json 的 model_routes 中出现过的全部 mode_title（由运维配置，数量有界）。"""
+    from app.config.settings import get_setting
+
+    titles = set(EXACT_MAP.values()) | {title for _, title in PATTERN_MAP}
+    routes = get_setting("model_routes", {}) or {}
+    if isinstance(routes, dict):
+        rules = list((routes.get("exact") or {}).values()) + list(routes.get("patterns") or [])
+        titles |= {rule["mode"] for rule in rules if isinstance(rule, dict) and isinstance(rule.get("mode"), str)}
+    return titles
 
-    # 精确匹配首选
-    if model_name in EXACT_MAP:
-        return EXACT_MAP[model_name]
 
-    # 模式匹配（按顺序）
-    for pattern, title in PATTERN_MAP:
-        try:
-            if re.search(pattern, model_name):
-                return title
-        except re.error:
-            # 忽略坏的正则
-            continue
+def _invalidate():
+    from app.services.model_router import router
 
-    return None
+    router.invalidate()
 
 
 def register_exact_mapping(model: str, title: str):
     """运行时注册精确映射（覆盖）。"""
     EXACT_MAP[model] = title
+    _invalidate()
 
 
 def register_pattern_mapping(pattern: str, title: str, at_start: bool = False):
@@ -56,3 +62,4 @@ def register_pattern_mapping(pattern: str, title: str, at_start: bool = False):
         PATTERN_MAP.insert(0, (pattern, title))
     else:
         PATTERN_MAP.append((pattern, title))
+    _invalidate()
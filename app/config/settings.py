@@ -1,9 +1,10 @@
 import os
 import json
+import logging
 from pathlib import Path
 
 # Load config.json if present; allow environment variable override for USER_DATA_DIR
-ROOT = Path(__file__).resolve().parents[1]
+ROOT = Path(__file__).resolve().parents[2]
 CONFIG_PATH = ROOT / "app" / "config" / "config.json"
 
 _config = {}
@@ -14,6 +15,48 @@ except Exception:
     _config = {}
 
 
+def _config_mtime():
+    try:
+        return CONFIG_PATH.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+_mtime = _config_mtime()
+# 每次重新加载配置后递增，缓存了配置派生数据的模块（如模型路由）据此判断是否需要重建
+_generation = 0
+
+
+def generation() -> int:
+    return _generation
+
+
+def reload_if_changed() -> bool:
+    """config.json 被修改后重新加载（热更新），返回是否重新加载。
+
+    文件无法解析时保留当前配置（编辑器保存到一半时常见），下次修改后再试。
+    只有每次调用 get_setting 读取的配置项会生效；启动时读取一次的项（如 workers）仍需重启。
+    """
+    global _mtime, _generation
+    mtime = _config_mtime()
+    if mtime == _mtime:
+        return False
+    try:
+        with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError("config.json must contain a JSON object")
+    except Exception as e:
+        logging.getLogger(__name__).error("config.json reload failed, keeping previous config: %s", e)
+        _mtime = mtime
+        return False
+    _mtime = mtime
+    _config.clear()
+    _config.update(data)
+    _generation += 1
+    return True
+
+
 def get_user_data_dir() -> str:
     # Priority: env COPILOT_USER_DATA_DIR > config.json user_data_dir > Desktop fallback
     env = os.environ.get("COPILOT_USER_DATA_DIR")
@@ -26,3 +69,9 @@ def get_user_data_dir() -> str:
     home = Path.home()
     desktop = home / "Desktop"
     return str(desktop / "copilot_chrome_data")
+
+
+def get_setting(key: str, default=None):
+    """Return a top-level value from config.json, or default when missing."""
+    value = _config.get(key)
+    return default if value is None else value
@@ -1,40 +1,91 @@
 # app/main.py
 from fastapi import FastAPI
-from app.routes import completions
-
-# 在启动时创建共享的 CopilotProxy（可选提前初始化浏览器），在关闭时优雅关闭
-from app.services.copilot_proxy import get_shared_proxy
+from app.routes import admin, batch, completions, health, jobs, metrics
+from app.services import broker_client
+from app.services.jobs import store as job_store
+from app.services.model_router import router as model_router
+from app.services.lifecycle import lifecycle
+from app.utils.log import setup_logging, shutdown_logging
 
 app = FastAPI()
 
 # 注册路由
 app.include_router(completions.router)
+app.include_router(batch.router)
+app.include_router(jobs.router)
+app.include_router(health.router)
+app.include_router(metrics.router)
+app.include_router(admin.router)
+# 按请求剖析（X-Profile 请求头）；未带该请求头时只做一次请求头扫描
+app.add_middleware(admin.ProfileMiddleware)
 
 
 @app.on_event("startup")
 async def startup_event():
-    # 触发创建共享代理（但不强制浏览器启动）。如果你希望在启动时就启动浏览器，
-    # 可以在此调用 await proxy.set_dynamic_data({}) 来触发 _init_browser_and_page。
-    try:
-        await get_shared_proxy()
-    except Exception:
-        # 忽略启动时的初始化错误，运行时会按需重试
-        pass
+    # 日志在后台线程中格式化与写出，避免在事件循环上做大对象序列化
+    setup_logging()
+    # 编译并校验模型路由规则：config.json 中的 model_routes 有误时启动即失败，而不是等到第一个请求
+    model_router.load()
+    # 在后台并发预热 config.json 中 warmup_backends 列出的后端（每个后端独立超时），
+    # 服务立即开始接收请求；预热完成前 /readyz 返回 503。预热失败的后端会在首次请求时重试。
+    # 使用 broker 时浏览器由 broker 进程预热，worker 只预热本地后端（通常为空）。
+    if broker_client.enabled():
+        lifecycle.start_warm_up(names=())
+    else:
+        lifecycle.start_warm_up()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    # 关闭共享代理中的浏览器/Playwright
-    try:
-        proxy = await get_shared_proxy()
-        # 直接调用底层关闭函数，如果不存在则忽略
-        if hasattr(proxy, "close_client"):
-            await proxy.close_client()
-    except Exception:
-        pass
+    # 取消仍在运行的异步任务，再停止接受新请求，等待页面归还后关闭页面、浏览器与 Playwright
+    await job_store.close()
+    await lifecycle.shutdown()
+    await broker_client.close_connection()
+    shutdown_logging()
+
+
+def _start_broker(address: str):
+    """启动 broker 子进程并等待其开始监听。"""
+    import socket
+    import subprocess
+    import sys
+    import time
+
+    from app.services import broker_protocol as bp
+
+    proc = subprocess.Popen([sys.executable, "-m", "app.services.broker_server", "--address", address])
+    kind, target = bp.parse_address(address)
+    deadline = time.time() + 30
+    while time.time() < deadline and proc.poll() is None:
+        try:
+            if kind == "unix":
+                with socket.socket(socket.AF_UNIX) as s:
+                    s.connect(target)
+            else:
+                socket.create_connection(target, timeout=1).close()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f"broker did not start listening on {address}")
 
 
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=5005)
+    from app.config.settings import get_setting
+
+    workers = int(get_setting("workers", 1))
+    broker_proc = None
+    if broker_client.enabled() and get_setting("broker_autostart", True):
+        broker_proc = _start_broker(broker_client.broker_address())
+    try:
+        if workers > 1:
+            # 多 worker 需要以导入字符串启动；浏览器状态只存在于 broker 进程
+            uvicorn.run("app.main:app", host="0.0.0.0", port=5005, workers=workers)
+        else:
+            uvicorn.run(app, host="0.0.0.0", port=5005)
+    finally:
+        if broker_proc is not None:
+            broker_proc.terminate()
+            broker_proc.wait(timeout=30)
@@ -0,0 +1,90 @@
+# app/routes/admin.py
+"""管理端点（剖析等）。需要 config.json 的 admin_token：请求头 Authorization: Bearer <token> 或 X-Admin-Token。
+未配置 admin_token 时管理端点一律返回 404。
+"""
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from app.config.settings import get_setting
+from app.utils import profiler
+from app.utils.auth import is_admin
+
+router = APIRouter()
+
+MAX_PROFILE_SECONDS = 300
+
+
+def require_admin(request: Request):
+    if not get_setting("admin_token"):
+        raise HTTPException(status_code=404)
+    if not is_admin(request.headers):
+        raise HTTPException(status_code=401, detail="admin token required")
+
+
+def _render(profile: profiler.Profile, fmt: str):
+    if fmt == "speedscope":
+        return JSONResponse(profile.speedscope(), headers={profiler.PROFILE_ID_HEADER: profile.profile_id})
+    if fmt == "collapsed":
+        return PlainTextResponse(profile.collapsed(), headers={profiler.PROFILE_ID_HEADER: profile.profile_id})
+    raise HTTPException(status_code=400, detail="format must be collapsed or speedscope")
+
+
+@router.get("/admin/profile")
+async def profile_process(request: Request, seconds: float = 10.0, interval_ms: float = 5.0,
+                          format: str = "collapsed", threads: str = "loop"):
+    """采样整个进程 seconds 秒，返回火焰图格式的剖析结果。"""
+    require_admin(request)
+    if not 0 < seconds <= MAX_PROFILE_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be in (0, {MAX_PROFILE_SECONDS}]")
+    if format not in ("collapsed", "speedscope"):
+        raise HTTPException(status_code=400, detail="format must be collapsed or speedscope")
+    profile = await profiler.profile_for(seconds, max(interval_ms, 1.0) / 1000.0, all_threads=threads == "all")
+    return _render(profile, format)
+
+
+@router.get("/admin/profiles")
+async def list_profiles(request: Request):
+    """最近的单请求剖析（X-Profile 请求头）。"""
+    require_admin(request)
+    return {"profiles": profiler.list_stored()}
+
+
+@router.get("/admin/profile/{profile_id}")
+async def get_profile(profile_id: str, request: Request, format: str = "collapsed"):
+    require_admin(request)
+    profile = profiler.stored(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="profile not found")
+    return _render(profile, format)
+
+
+class ProfileMiddleware:
+    """请求头 X-Profile: 1 且带管理员令牌时剖析该请求（流式响应剖析到响应结束），结果通过 X-Profile-Id 取回。"""
+
+    _header = profiler.PROFILE_HEADER.lower().encode()
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not any(k == self._header for k, _ in scope["headers"]):
+            return await self.app(scope, receive, send)
+        request = Request(scope)
+        if request.headers.get(profiler.PROFILE_HEADER, "").lower() not in ("1", "true", "on", "yes") \
+                or not is_admin(request.headers):
+            return await self.app(scope, receive, send)
+
+        profile = profiler.Profile(f"{scope['method']} {scope['path']}", profiler.DEFAULT_INTERVAL)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message = dict(message, headers=list(message.get("headers", [])) + [
+                    (profiler.PROFILE_ID_HEADER.lower().encode(), profile.profile_id.encode())])
+            await send(message)
+
+        profiler.sampler.start_request(profile)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            profiler.sampler.stop_request(profile)
+            profiler.store(profile)
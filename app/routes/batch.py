@@ -0,0 +1,224 @@
+# app/routes/batch.py
+"""/v1/batch：JSONL 批量补全。
+
+请求体每行一个请求，兼容 OpenAI Batch 输入格式：
+    {"custom_id": "req-1", "body": {"model": ..., "messages": [...]}}
+也接受把 custom_id 直接放在请求对象里：{"custom_id": "req-1", "model": ..., "messages": [...]}
+
+响应以 JSONL 流式返回，按完成顺序（不保证与输入顺序一致），每行：
+    {"custom_id": ..., "response": {"status_code": 200, "body": <chat.completion>}, "error": null}
+
+- 并发：最多 concurrency 个请求同时执行（查询参数，默认/上限取 config.json 的 batch_concurrency / batch_max_concurrency），
+  请求会分散到各后端的页面池上
+- 断点续跑：每个完成的结果追加写入 batch_dir/<batch_id>.jsonl（batch_id 取查询参数或 X-Batch-Id 头，
+  未提供时生成一个并在响应头 X-Batch-Id 中返回）；用相同 batch_id 重新提交时，已完成的 custom_id
+  会被跳过，其结果先行回放（replay=false 可关闭回放）。可重试的失败（5xx、超时、429）不算完成，续跑时重新执行
+"""
+import asyncio
+import json
+import logging
+import re
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+from app.config.settings import ROOT, get_setting
+from app.routes.completions import complete
+from app.services.circuit_breaker import CircuitOpenError
+from app.services.fanout import ChoicesRejected
+from app.services.reverse_base import UpstreamError
+from app.utils import deadline
+from app.utils.metrics import BATCH_ITEMS
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+BATCH_ID_HEADER = "X-Batch-Id"
+DEFAULT_CONCURRENCY = 4
+DEFAULT_MAX_CONCURRENCY = 32
+
+
+def _progress_path(batch_id: str) -> Path:
+    # batch_id 会成为文件名，只保留安全字符
+    safe = re.sub(r"[^A-Za-z0-9_-]", "", batch_id)[:128]
+    if not safe:
+        raise HTTPException(status_code=400, detail="invalid batch_id")
+    directory = Path(get_setting("batch_dir", "batches"))
+    if not directory.is_absolute():
+        directory = ROOT / directory
+    return directory / f"{safe}.jsonl"
+
+
+def _retryable(record: dict) -> bool:
+    # 故障或超时期间失败的请求续跑时重新执行；400 等由请求本身决定的错误重跑也不会成功
+    status = ((record.get("response") or {}).get("status_code")) or 0
+    return status >= 500 or status == 429
+
+
+def _load_progress(path: Path) -> Dict[str, str]:
+    """custom_id -> 已完成的结果行（可重试的失败不计入）。崩溃时可能留下半行，解析失败的行忽略。"""
+    done: Dict[str, str] = {}
+    if not path.exists():
+        return done
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and record.get("custom_id") is not None and not _retryable(record):
+                done[str(record["custom_id"])] = line.rstrip("\n")
+    return done
+
+
+class _ProgressWriter:
+    """结果行追加写入进度文件；写文件在线程池中完成，不阻塞事件循环。"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = None
+        self._lock = asyncio.Lock()
+
+    def _write(self, line: str):
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = self.path.open("a", encoding="utf-8")
+        self._file.write(line + "\n")
+        self._file.flush()
+
+    async def write(self, line: str):
+        async with self._lock:
+            await asyncio.get_running_loop().run_in_executor(None, self._write, line)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+async def _read_lines(request: Request) -> List[str]:
+    """在返回响应之前读完请求体：响应开始后 Starlette 会在同一个 receive 通道上监听断开，不能再读取请求体。"""
+    buffer = b""
+    lines: List[str] = []
+    async for chunk in request.stream():
+        buffer += chunk
+        *complete_lines, buffer = buffer.split(b"\n")
+        lines.extend(line.decode("utf-8") for line in complete_lines if line.strip())
+    if buffer.strip():
+        lines.append(buffer.decode("utf-8"))
+    return lines
+
+
+def _error_record(custom_id: str, status_code: int, message: str, error_type: str) -> dict:
+    return {
+        "custom_id": custom_id,
+        "response": {"status_code": status_code, "body": None},
+        "error": {"message": message, "type": error_type},
+    }
+
+
+async def _run_item(custom_id: str, body: dict) -> dict:
+    deadline.activate(deadline.from_request({}, body))
+    try:
+        result = await complete(body)
+    except deadline.DeadlineExceeded as e:
+        BATCH_ITEMS.labels("timeout").inc()
+        return _error_record(custom_id, 504, str(e), "timeout")
+    except CircuitOpenError as e:
+        BATCH_ITEMS.labels("error").inc()
+        return _error_record(custom_id, 503, str(e), "unavailable")
+    except ChoicesRejected as e:
+        BATCH_ITEMS.labels("error").inc()
+        return _error_record(custom_id, 400, str(e), "invalid_request")
+    except UpstreamError as e:
+        BATCH_ITEMS.labels("error").inc()
+        return _error_record(custom_id, e.http_status, str(e), "upstream_error")
+    except Exception as e:
+        BATCH_ITEMS.labels("error").inc()
+        return _error_record(custom_id, 500, f"{e.__class__.__name__}: {e}", "upstream_error")
+    BATCH_ITEMS.labels("ok").inc()
+    return {"custom_id": custom_id, "response": {"status_code": 200, "body": result}, "error": None}
+
+
+def _parse_item(line: str, index: int):
+    """返回 (custom_id, body)；无法解析时 body 为 None。"""
+    try:
+        item = json.loads(line)
+    except ValueError:
+        return f"line-{index}", None
+    if not isinstance(item, dict):
+        return f"line-{index}", None
+    custom_id = str(item.get("custom_id") or f"line-{index}")
+    body = item.get("body") if isinstance(item.get("body"), dict) else {k: v for k, v in item.items() if k != "custom_id"}
+    return custom_id, body
+
+
+@router.post("/v1/batch")
+async def batch(request: Request, concurrency: Optional[int] = None, batch_id: Optional[str] = None,
+                replay: bool = True):
+    """Run a JSONL batch of chat completion requests and stream JSONL results as they finish."""
+    limit = int(get_setting("batch_max_concurrency", DEFAULT_MAX_CONCURRENCY))
+    concurrency = max(1, min(concurrency or int(get_setting("batch_concurrency", DEFAULT_CONCURRENCY)), limit))
+    batch_id = batch_id or request.headers.get(BATCH_ID_HEADER) or f"batch-{uuid.uuid4().hex[:12]}"
+    path = _progress_path(batch_id)
+    done = await asyncio.get_running_loop().run_in_executor(None, _load_progress, path)
+    lines = await _read_lines(request)
+
+    async def results():
+        writer = _ProgressWriter(path)
+        out: asyncio.Queue = asyncio.Queue()
+        slots = asyncio.Semaphore(concurrency)
+        tasks = set()
+
+        async def run(custom_id: str, body: dict):
+            try:
+                record = await _run_item(custom_id, body)
+                line = json.dumps(record, ensure_ascii=False)
+                await writer.write(line)
+                out.put_nowait(line)
+            finally:
+                slots.release()
+
+        async def produce():
+            for index, line in enumerate(lines, 1):
+                custom_id, body = _parse_item(line, index)
+                if custom_id in done:
+                    BATCH_ITEMS.labels("skipped").inc()
+                    continue
+                if body is None:
+                    BATCH_ITEMS.labels("error").inc()
+                    out.put_nowait(json.dumps(_error_record(custom_id, 400, "invalid JSON line", "invalid_request")))
+                    continue
+                # 控制在途数量，避免一次性为上万行创建任务
+                await slots.acquire()
+                task = asyncio.ensure_future(run(custom_id, body))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*list(tasks), return_exceptions=True)
+
+        producer = asyncio.ensure_future(produce())
+        producer.add_done_callback(lambda _: out.put_nowait(None))
+        try:
+            if replay:
+                for line in done.values():
+                    yield line + "\n"
+            while True:
+                line = await out.get()
+                if line is None:
+                    break
+                yield line + "\n"
+            if producer.exception() is not None:
+                logger.warning("batch %s stopped: %s", batch_id, producer.exception())
+        finally:
+            # 客户端断开或出错：取消剩余请求（取消会传播到上游并归还页面）
+            producer.cancel()
+            for task in list(tasks):
+                task.cancel()
+            await asyncio.gather(producer, *tasks, return_exceptions=True)
+            writer.close()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson", headers={BATCH_ID_HEADER: batch_id})
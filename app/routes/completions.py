@@ -1,13 +1,206 @@
 # app/routes/completions.py
 from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 import asyncio
+import json
 import time
 
+from app.services import auto_router, fanout
 from app.services.reverse_factory import get_reverser
+from app.services.circuit_breaker import CircuitOpenError
+from app.services.copilot_sessions import SESSION_HEADER
+from app.services.reverse_base import UpstreamError
+from app.services.backend_registry import list_models, resolve_backend_name, is_declared_model
+from app.utils.metrics import (
+    DEADLINE_EXCEEDED, REQUESTS, REQUEST_LATENCY, STREAM_TTFT, STREAM_INTER_TOKEN, TOKENS,
+)
+from app.utils.tokens import (
+    StreamUsage, count_completion_tokens, count_prompt_tokens, family_for, usage_dict,
+)
+from app.utils import deadline, tracing
 router = APIRouter()
 
 
+def _model_label(model: str) -> str:
+    # 只有注册表中声明过的模型才作为指标标签，避免客户端随意传入的 model 造成标签基数爆炸
+    return model if is_declared_model(model) else "other"
+
+
+class ClientDisconnected(Exception):
+    """客户端在响应完成前断开。"""
+
+
+async def _watch_disconnect(request: Request):
+    """请求体读完后 receive() 只会在客户端断开时返回 http.disconnect。"""
+    while True:
+        message = await request.receive()
+        if message.get("type") == "http.disconnect":
+            return
+
+
+async def _until_disconnect(aw, disconnect: asyncio.Future):
+    """等待 aw；客户端先断开时取消 aw（取消会传播到上游：Copilot 停止生成、aiohttp 中止请求）并抛出 ClientDisconnected。"""
+    task = asyncio.ensure_future(aw)
+    try:
+        await asyncio.wait((task, disconnect), return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    if task.done():
+        return task.result()
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    raise ClientDisconnected()
+
+
+def _deadline_error(e: deadline.DeadlineExceeded) -> dict:
+    return {"error": {"message": str(e), "type": "timeout", "code": "deadline_exceeded", "stage": e.stage}}
+
+
+def _circuit_error(e: CircuitOpenError) -> dict:
+    return {"error": {"message": str(e), "type": "unavailable", "code": "circuit_open"}}
+
+
+def _circuit_response(e: CircuitOpenError, headers: dict = None) -> JSONResponse:
+    headers = dict(headers or {}, **{"Retry-After": str(max(1, int(e.retry_after + 0.5)))})
+    return JSONResponse(_circuit_error(e), status_code=503, headers=headers)
+
+
+def _choices_response(e: fanout.ChoicesRejected, headers: dict = None) -> JSONResponse:
+    body = {"error": {"message": str(e), "type": "invalid_request_error", "param": "n", "code": "n_exceeds_limit"}}
+    return JSONResponse(body, status_code=400, headers=headers)
+
+
+def _upstream_error(e: UpstreamError) -> dict:
+    code = "upstream_unavailable" if e.http_status == 503 else "bad_gateway"
+    return {"error": {"message": str(e), "type": "upstream_error", "code": code, "upstream_status": e.status}}
+
+
+def _check_result(backend: str, result):
+    """后端必须返回 dict（n > 1 时为 dict 列表）；否则按上游错误处理，而不是在组装响应时 500。"""
+    if not all(isinstance(r, dict) for r in (result if isinstance(result, list) else [result])):
+        raise UpstreamError(backend, None, "returned no result")
+    return result
+
+
+def _send(reverser, payload: dict, n: int):
+    """n == 1 时直接调用后端；否则并发运行 n 个生成（见 app/services/fanout）。"""
+    if n == 1:
+        return reverser.send_conversation(payload=payload)
+    if payload.get("stream"):
+        return fanout.stream_choices(reverser, payload, n)
+    return fanout.complete_choices(reverser, payload, n)
+
+
+def _record_tokens(model_label: str, backend: str, usage: dict):
+    TOKENS.labels(model_label, backend, "prompt").inc(usage["prompt_tokens"])
+    TOKENS.labels(model_label, backend, "completion").inc(usage["completion_tokens"])
+
+
+async def _observe_stream(stream, model_label: str, backend: str, started: float, trace=None,
+                          prompt_task=None, family: str = "gpt", include_usage: bool = False,
+                          disconnect: asyncio.Future = None, request_deadline: deadline.Deadline = None):
+    """透传 SSE 块，同时记录首 token 时间、token 间隔与整体耗时，增量统计补全 token，结束时导出 trace。
+
+    include_usage=True（请求中 stream_options.include_usage）时，在 [DONE] 之前追加一个 usage 块。
+    disconnect 完成（客户端断开）时立即取消上游生成，不再等待下一个块。
+    超过请求 deadline 时，已发送的内容作为部分结果保留，再追加一个 error 块与 [DONE]。
+    """
+    # 响应体在另一个任务中迭代，重新绑定当前请求的 trace 与 deadline
+    tracing.activate(trace)
+    deadline.activate(request_deadline)
+    ttft = STREAM_TTFT.labels(model_label, backend)
+    gap = STREAM_INTER_TOKEN.labels(model_label, backend)
+    usage = StreamUsage(family)
+    status = "ok"
+    last = None
+    last_obj = None
+    chunks = 0
+    finished = False
+    try:
+        while True:
+            try:
+                if disconnect is None:
+                    chunk = await stream.__anext__()
+                else:
+                    chunk = await _until_disconnect(stream.__anext__(), disconnect)
+            except StopAsyncIteration:
+                finished = True
+                break
+            if chunk.startswith("data: [DONE]"):
+                if include_usage:
+                    prompt_tokens = await prompt_task if prompt_task is not None else 0
+                    final = {
+                        "id": (last_obj or {}).get("id", "chatcmpl-usage"),
+                        "object": "chat.completion.chunk",
+                        "created": (last_obj or {}).get("created", int(time.time())),
+                        "model": (last_obj or {}).get("model", model_label),
+                        "choices": [],
+                        "usage": usage_dict(prompt_tokens, usage.completion_tokens),
+                    }
+                    yield f"data: {json.dumps(final)}\n\n"
+            else:
+                now = time.perf_counter()
+                if last is None:
+                    ttft.observe(now - started)
+                    if trace is not None:
+                        trace.instant("first_chunk")
+                else:
+                    gap.observe(now - last)
+                last = now
+                chunks += 1
+                if chunk.startswith("data: {"):
+                    try:
+                        last_obj = json.loads(chunk[6:])
+                        for choice in last_obj.get("choices") or ():
+                            usage.feed((choice.get("delta") or {}).get("content"))
+                    except Exception:
+                        pass
+            yield chunk
+    except ClientDisconnected:
+        finished = True
+        status = "cancelled"
+    except deadline.DeadlineExceeded as e:
+        finished = True
+        status = "timeout"
+        DEADLINE_EXCEEDED.labels(backend, e.stage).inc()
+        yield f"data: {json.dumps(_deadline_error(e))}\n\n"
+        yield "data: [DONE]\n\n"
+    except CircuitOpenError as e:
+        # 响应头已发出，无法再返回 503：以 error 块结束流
+        finished = True
+        status = "unavailable"
+        yield f"data: {json.dumps(_circuit_error(e))}\n\n"
+        yield "data: [DONE]\n\n"
+    except UpstreamError as e:
+        finished = True
+        status = "upstream_error"
+        yield f"data: {json.dumps(_upstream_error(e))}\n\n"
+        yield "data: [DONE]\n\n"
+    except (asyncio.CancelledError, GeneratorExit):
+        status = "cancelled"
+        raise
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        if disconnect is not None:
+            disconnect.cancel()
+        if not finished:
+            # 被 Starlette 关闭（发送失败）时显式关闭上游生成器，让其 finally 立即归还页面
+            try:
+                await stream.aclose()
+            except Exception:
+                pass
+        REQUESTS.labels(model_label, backend, "true", status).inc()
+        REQUEST_LATENCY.labels(model_label, backend, "true").observe(time.perf_counter() - started)
+        tracing.finish_trace(trace, status=status, chunks=chunks, model=model_label, backend=backend)
+        if prompt_task is not None and prompt_task.done() and not prompt_task.cancelled() and prompt_task.exception() is None:
+            _record_tokens(model_label, backend, usage_dict(prompt_task.result(), usage.completion_tokens))
+        elif prompt_task is not None:
+            prompt_task.cancel()
+
+
 @router.post("/v1/chat/completions")
 async def chat_completions(request: Request):
     """OpenAI Chat Completions compatible endpoint.
@@ -15,92 +208,218 @@ async def chat_completions(request: Request):
     Accepts JSON with at least `model` and `messages` (list of {role, content}).
     Supports `stream: true` to return SSE of delta chunks.
     """
-    payload = await request.json()
-    reverser = await get_reverser(payload)
+    started = time.perf_counter()
+    trace = tracing.start_trace(request.headers, name="chat.completions")
+    trace_headers = {tracing.TRACE_ID_HEADER: trace.trace_id} if trace else None
+    with tracing.span("parse_body"):
+        payload = await request.json()
+    # 会话亲和：允许用请求头指定会话 id（等价于请求体的 session_id）
+    if isinstance(payload, dict) and not payload.get("session_id") and request.headers.get(SESSION_HEADER):
+        payload["session_id"] = request.headers[SESSION_HEADER]
+    # 截止时间覆盖租用页面、模式切换、发送、首 token 与完成的全部等待
+    request_deadline = deadline.from_request(request.headers, payload)
+    deadline.activate(request_deadline)
+    # model 为自动路由组（如 "auto"）时按预期延迟选择后端与模型
+    auto_router.route(payload)
+    backend = resolve_backend_name(payload) if isinstance(payload, dict) else "unknown"
+    model_label = _model_label(payload.get("model", "copilot-chat") if isinstance(payload, dict) else "")
+    try:
+        with tracing.span("get_reverser", backend=backend):
+            reverser = await get_reverser(payload)
+    except CircuitOpenError as e:
+        # 后端熔断且没有可用的备用后端：立即失败，不再等待超时
+        REQUESTS.labels(model_label, backend, "true" if payload.get("stream") else "false", "unavailable").inc()
+        tracing.finish_trace(trace, status="unavailable", model=model_label, backend=backend)
+        return _circuit_response(e, trace_headers)
+    # 熔断转移会改写 payload 的 backend 与 model：指标与 trace 按实际使用的后端记录
+    backend = resolve_backend_name(payload)
+    model_label = _model_label(payload.get("model", "copilot-chat"))
+    try:
+        n = fanout.admit(reverser, payload)
+    except fanout.ChoicesRejected as e:
+        REQUESTS.labels(model_label, backend, "true" if payload.get("stream") else "false", "rejected").inc()
+        tracing.finish_trace(trace, status="rejected", model=model_label, backend=backend)
+        return _choices_response(e, trace_headers)
+    # prompt token 在线程池中计数，与上游生成并行进行
+    family = family_for(backend, payload.get("model"))
+    prompt_task = asyncio.ensure_future(count_prompt_tokens(payload.get("messages"), family))
+    disconnect = asyncio.ensure_future(_watch_disconnect(request))
 
 
     if payload.get("stream"):
         async def gen():
-            stream = await reverser.send_conversation(payload=payload)
+            stream = await _send(reverser, payload, n)
             async for chunk in stream:
                 # chunk already in SSE data: ... but ensure OpenAI-style deltas if needed
                 yield chunk
 
-        return StreamingResponse(gen(), media_type="text/event-stream")
+        include_usage = bool((payload.get("stream_options") or {}).get("include_usage"))
+        return StreamingResponse(_observe_stream(gen(), model_label, backend, started, trace,
+                                                 prompt_task=prompt_task, family=family, include_usage=include_usage,
+                                                 disconnect=disconnect, request_deadline=request_deadline),
+                                 media_type="text/event-stream", headers=trace_headers)
     else:
-        result = await reverser.send_conversation(payload=payload)
-        # Map to OpenAI chat completion schema
-        # 封装为 OpenAI Chat Completions 响应
-        resp = {
-            "id": result.get("id",'chatcmpl-unknown') or "chatcmpl-unknown",
-            "object": "chat.completion",
-            "created": int(time.time()),
-            "model": payload.get("model", "copilot-chat"),
-            "choices": [
-                {
-                    "index": 0,
-                    "message": {"role": "assistant", "content": result.get("answer", "")},
-                    "finish_reason": "stop"
-                }
-            ],
-            "usage": {
-                "prompt_tokens": result.get("prompt_tokens", 10),
-                "completion_tokens": result.get("completion_tokens", 10),
-                "total_tokens": result.get("total_tokens", 1110)
-            }
-        }
+        status = "ok"
+        try:
+            with tracing.span("send_conversation", backend=backend):
+                result = _check_result(backend, await _until_disconnect(_send(reverser, payload, n), disconnect))
+        except ClientDisconnected:
+            status = "cancelled"
+            prompt_task.cancel()
+            # 客户端已断开，响应不会被读取
+            return Response(status_code=499)
+        except deadline.DeadlineExceeded as e:
+            status = "timeout"
+            prompt_task.cancel()
+            DEADLINE_EXCEEDED.labels(backend, e.stage).inc()
+            return JSONResponse(_deadline_error(e), status_code=504, headers=trace_headers)
+        except CircuitOpenError as e:
+            status = "unavailable"
+            prompt_task.cancel()
+            return _circuit_response(e, trace_headers)
+        except UpstreamError as e:
+            status = "upstream_error"
+            prompt_task.cancel()
+            return JSONResponse(_upstream_error(e), status_code=e.http_status, headers=trace_headers)
+        except BaseException:
+            status = "error"
+            prompt_task.cancel()
+            raise
+        finally:
+            disconnect.cancel()
+            REQUESTS.labels(model_label, backend, "false", status).inc()
+            REQUEST_LATENCY.labels(model_label, backend, "false").observe(time.perf_counter() - started)
+            tracing.finish_trace(trace, status=status, model=model_label, backend=backend)
+        usage = await _usage_for(result, prompt_task, family)
+        _record_tokens(model_label, backend, usage)
+        return JSONResponse(_completion_body(payload, result, usage), headers=trace_headers)
 
-        return JSONResponse(resp)
 
-@router.get("/v1/models")
-async def models():
+async def _usage_for(result, prompt_task, family: str) -> dict:
+    # 后端给出的真实用量优先，否则使用本地计数；n > 1 时 prompt 只计一次，补全 token 为各 choice 之和
+    results = result if isinstance(result, list) else [result]
+    completion = 0
+    for r in results:
+        completion += r.get("completion_tokens") or await count_completion_tokens(r.get("answer", ""), family)
+    return usage_dict(results[0].get("prompt_tokens") or await prompt_task, completion)
+
+
+def _completion_body(payload: dict, result, usage: dict) -> dict:
+    # Map to OpenAI chat completion schema
+    # 封装为 OpenAI Chat Completions 响应；result 为列表时（n > 1）每个结果一个 choice
+    results = result if isinstance(result, list) else [result]
     return {
-    "object": "list",
-    "data": [
-        {
-                "id": "gemini-2.5-pro",
-                "object": "model",
-                "owned_by": "custom",
-                "permission": [
-                    {
-                        "id": "perm-gemini-pro",
-                        "object": "model_permission",
-                        "allow_create_engine": True,
-                        "allow_sampling": True,
-                        "allow_logprobs": True,
-                        "allow_search_indices": False,
-                        "allow_view": True,
-                        "allow_fine_tuning": False,
-                        "organization": "*",
-                        "group": None,
-                        "is_blocking": False
-                    }
-                ],
-                "root": "gemini-2.5-pro",
-                "parent": None
-            },
+        "id": results[0].get("id",'chatcmpl-unknown') or "chatcmpl-unknown",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": payload.get("model", "copilot-chat"),
+        "choices": [
             {
-                "id": "gemini-2.5-flash",
-                "object": "model",
-                "owned_by": "custom",
-                "permission": [
-                    {
-                        "id": "perm-gemini-flash",
-                        "object": "model_permission",
-                        "allow_create_engine": True,
-                        "allow_sampling": True,
-                        "allow_logprobs": True,
-                        "allow_search_indices": False,
-                        "allow_view": True,
-                        "allow_fine_tuning": False,
-                        "organization": "*",
-                        "group": None,
-                        "is_blocking": False
-                    }
-                ],
-                "root": "gemini-2.5-flash",
-                "parent": None
+                "index": i,
+                "message": {"role": "assistant", "content": r.get("answer", "")},
+                "finish_reason": "stop"
             }
-        ]
+            for i, r in enumerate(results)
+        ],
+        "usage": usage
     }
 
+
+async def complete(payload: dict) -> dict:
+    """执行一次非流式补全，返回 OpenAI chat.completion dict（供 /v1/batch 等内部调用）。
+
+    截止时间由调用方通过 deadline.activate 设置；失败时异常向上抛出（超时为 DeadlineExceeded）。
+    """
+    payload = auto_router.route(dict(payload, stream=False))
+    started = time.perf_counter()
+    backend = resolve_backend_name(payload)
+    model_label = _model_label(payload.get("model", "copilot-chat"))
+    family = family_for(backend, payload.get("model"))
+    prompt_task = asyncio.ensure_future(count_prompt_tokens(payload.get("messages"), family))
+    status = "ok"
+    try:
+        reverser = await get_reverser(payload)
+        backend = resolve_backend_name(payload)
+        model_label = _model_label(payload.get("model", "copilot-chat"))
+        family = family_for(backend, payload.get("model"))
+        result = _check_result(backend, await _send(reverser, payload, fanout.admit(reverser, payload)))
+    except deadline.DeadlineExceeded as e:
+        status = "timeout"
+        prompt_task.cancel()
+        DEADLINE_EXCEEDED.labels(backend, e.stage).inc()
+        raise
+    except CircuitOpenError:
+        status = "unavailable"
+        prompt_task.cancel()
+        raise
+    except fanout.ChoicesRejected:
+        status = "rejected"
+        prompt_task.cancel()
+        raise
+    except UpstreamError:
+        status = "upstream_error"
+        prompt_task.cancel()
+        raise
+    except asyncio.CancelledError:
+        status = "cancelled"
+        prompt_task.cancel()
+        raise
+    except BaseException:
+        status = "error"
+        prompt_task.cancel()
+        raise
+    finally:
+        REQUESTS.labels(model_label, backend, "false", status).inc()
+        REQUEST_LATENCY.labels(model_label, backend, "false").observe(time.perf_counter() - started)
+    usage = await _usage_for(result, prompt_task, family)
+    _record_tokens(model_label, backend, usage)
+    return _completion_body(payload, result, usage)
+
+
+async def stream(payload: dict):
+    """执行一次流式补全，产出 SSE 块（供 /v1/jobs 等内部调用），末尾带 usage 块。
+
+    截止时间与 trace 由调用方的上下文提供；指标与 /v1/chat/completions 的流式请求相同。
+    """
+    payload = auto_router.route(dict(payload, stream=True, stream_options={"include_usage": True}))
+    started = time.perf_counter()
+    backend = resolve_backend_name(payload)
+    model_label = _model_label(payload.get("model", "copilot-chat"))
+    try:
+        reverser = await get_reverser(payload)
+        backend = resolve_backend_name(payload)
+        model_label = _model_label(payload.get("model", "copilot-chat"))
+        n = fanout.admit(reverser, payload)
+    except CircuitOpenError:
+        REQUESTS.labels(model_label, backend, "true", "unavailable").inc()
+        raise
+    except fanout.ChoicesRejected:
+        REQUESTS.labels(model_label, backend, "true", "rejected").inc()
+        raise
+    family = family_for(backend, payload.get("model"))
+    prompt_task = asyncio.ensure_future(count_prompt_tokens(payload.get("messages"), family))
+
+    async def gen():
+        upstream = await _send(reverser, payload, n)
+        async for chunk in upstream:
+            yield chunk
+
+    observed = _observe_stream(gen(), model_label, backend, started, tracing.current(), prompt_task=prompt_task,
+                               family=family, include_usage=True, request_deadline=deadline.current())
+    try:
+        async for chunk in observed:
+            yield chunk
+    finally:
+        await observed.aclose()
+
+
+@router.get("/v1/models")
+async def models():
+    # 由后端注册表生成并缓存，新增后端时自动出现在列表中；自动路由组追加在后面（不修改缓存）
+    listing = list_models()
+    groups = auto_router.models()
+    if not groups:
+        return listing
+    created = int(time.time())
+    extra = [{"id": name, "object": "model", "created": created, "owned_by": "auto"} for name in groups]
+    return dict(listing, data=listing["data"] + extra)
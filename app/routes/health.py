@@ -0,0 +1,45 @@
+# app/routes/health.py
+import sys
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.services import auto_router, broker_client, circuit_breaker, hedging, jobs
+from app.services.lifecycle import lifecycle
+
+router = APIRouter()
+
+
+def _browser_manager():
+    """已启动的 BrowserManager；浏览器模块尚未加载时返回 None（不为了健康检查而导入 Playwright）。"""
+    bm = sys.modules.get("app.services.browser_manager")
+    return None if bm is None else bm.BrowserManager._instance
+
+
+@router.get("/healthz")
+async def healthz():
+    """Liveness: the process and event loop are responsive. Includes per-backend state."""
+    return {**lifecycle.health(), "circuits": circuit_breaker.stats(), "hedging": hedging.stats(),
+            "jobs": jobs.store.stats(), "auto_routing": auto_router.stats()}
+
+
+@router.get("/healthz/browser")
+async def browser_telemetry():
+    """Per-page and per-browser CDP telemetry (JS heap, DOM nodes, CPU time, network bytes)."""
+    if broker_client.enabled():
+        return JSONResponse({"error": "browser runs in the broker process"}, status_code=404)
+    manager = _browser_manager()
+    if manager is None:
+        return JSONResponse({"error": "browser not started"}, status_code=404)
+    return manager.telemetry()
+
+
+@router.get("/readyz")
+async def readyz():
+    """Readiness: 200 once every warm-up backend is ready, 503 otherwise."""
+    if broker_client.enabled():
+        # 浏览器后端运行在 broker 进程中，就绪状态以 broker 为准
+        ready, body = await broker_client.readiness()
+    else:
+        ready, body = lifecycle.readiness()
+    return JSONResponse(body, status_code=200 if ready else 503)
@@ -0,0 +1,81 @@
+# app/routes/jobs.py
+"""/v1/jobs：异步补全任务（见 app/services/jobs），生成时间长于代理空闲超时的请求用它代替长连接。
+
+- POST /v1/jobs：请求体同 /v1/chat/completions，立即返回 202 与任务 id
+- GET /v1/jobs/{id}?wait=秒：查询状态；wait > 0 时长轮询到任务结束或超时（上限 jobs_max_wait，默认 60）
+- GET /v1/jobs/{id}/events?offset=N：从第 N 个事件开始的 SSE 流（每个事件带 id: 偏移量），
+  断线后用 offset 或 Last-Event-ID 请求头续读；任务仍在运行时持续推送新事件
+- DELETE /v1/jobs/{id}：取消任务
+"""
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from app.config.settings import get_setting
+from app.routes.completions import stream as completion_stream
+from app.services import fanout, jobs
+from app.utils import deadline
+
+router = APIRouter()
+
+DEFAULT_MAX_WAIT = 60.0
+
+
+def _job_or_404(job_id: str) -> jobs.Job:
+    job = jobs.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found or expired")
+    return job
+
+
+@router.post("/v1/jobs")
+async def submit_job(request: Request):
+    payload = await request.json()
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="request body must be a JSON object")
+    try:
+        # 页面池大小在任务运行时再检查，这里只做不需要后端的预检
+        fanout.admit(None, payload)
+    except fanout.ChoicesRejected as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # 任务在当前上下文的副本中运行，继承请求的截止时间
+    deadline.activate(deadline.from_request(request.headers, payload))
+    try:
+        job = jobs.store.submit(payload, completion_stream)
+    except jobs.JobStoreFull as e:
+        return JSONResponse({"error": {"message": str(e), "type": "rate_limit_error", "code": "jobs_full"}},
+                            status_code=429, headers={"Retry-After": "5"})
+    return JSONResponse(job.as_dict(), status_code=202, headers={"Location": f"/v1/jobs/{job.job_id}"})
+
+
+@router.get("/v1/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0.0):
+    job = _job_or_404(job_id)
+    if wait > 0 and not job.finished:
+        await job.wait_finished(min(wait, float(get_setting("jobs_max_wait", DEFAULT_MAX_WAIT))))
+    return job.as_dict()
+
+
+@router.get("/v1/jobs/{job_id}/events")
+async def job_events(job_id: str, request: Request, offset: Optional[int] = None):
+    job = _job_or_404(job_id)
+    if offset is None:
+        last_event_id = request.headers.get("Last-Event-ID")
+        offset = int(last_event_id) + 1 if last_event_id and last_event_id.isdigit() else 0
+    offset = max(0, offset)
+
+    async def events():
+        # 客户端断开只结束这次读取，任务继续运行
+        async for index, data in job.follow(offset):
+            yield f"id: {index}\ndata: {data}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"X-Job-Status": job.status})
+
+
+@router.delete("/v1/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    job = await jobs.store.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found or expired")
+    return job.as_dict()
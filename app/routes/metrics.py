@@ -0,0 +1,13 @@
+# app/routes/metrics.py
+from fastapi import APIRouter
+from fastapi.responses import Response
+
+from app.utils.metrics import CONTENT_TYPE_LATEST, render_latest
+
+router = APIRouter()
+
+
+@router.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint."""
+    return Response(render_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,149 @@
+"""自动路由：请求 model 为别名组（如 "auto"）时，按当前的预期延迟在组内允许的后端中选择一个。
+
+- 延迟统计：每个后端成功请求的首 token 时间与完成时间的指数加权移动平均（EWMA，系数 alpha），
+  由 circuit_breaker.GuardedReverse 在每次请求结束时记录；同时记录在途请求数作为排队深度
+- 预期延迟：流式请求取首 token EWMA，非流式取完成时间 EWMA，再加排队等待估计：
+  在途请求数超出容量（页面池大小，无页面池时为 capacity 配置，默认 4）时，每超出一个“容量”等待一个完成时间
+- 允许列表：只有别名组中列出的 (后端, 模型) 参与选择（最低质量要求），熔断打开的后端被跳过
+- 还没有样本的后端预期延迟记为 0，保证会被尝试；explore 比例的请求随机选择，让各后端的统计保持新鲜
+- 页面/账号的选择仍由各后端的页面池完成（优先空闲页面）
+
+config.json 的 auto_routing：
+    {"alpha": 0.2, "explore": 0.05, "capacity": {"gemini": 4},
+     "groups": {"auto": [{"backend": "copilot", "model": "copilot-chat"}, {"backend": "gemini", "model": "gemini-2.5-pro"}]}}
+选中后请求的 backend 与 model 被改写为选中的候选，原始别名保存在 requested_model 中。
+"""
+import logging
+import random
+from typing import Dict, List, Optional, Tuple
+
+from app.config.settings import get_setting
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ALPHA = 0.2
+DEFAULT_EXPLORE = 0.05
+DEFAULT_CAPACITY = 4
+
+
+def _config() -> dict:
+    return get_setting("auto_routing", {}) or {}
+
+
+def groups() -> Dict[str, List[dict]]:
+    return _config().get("groups") or {}
+
+
+class BackendLatency:
+    def __init__(self):
+        self.ttft: Optional[float] = None
+        self.completion: Optional[float] = None
+        self.samples = 0
+        self.inflight = 0
+
+    @staticmethod
+    def _ewma(current: Optional[float], value: float, alpha: float) -> float:
+        return value if current is None else current + alpha * (value - current)
+
+    def observe(self, ttft: Optional[float], completion: Optional[float]):
+        alpha = float(_config().get("alpha", DEFAULT_ALPHA))
+        if ttft is not None:
+            self.ttft = self._ewma(self.ttft, ttft, alpha)
+        if completion is not None:
+            self.completion = self._ewma(self.completion, completion, alpha)
+        self.samples += 1
+
+    def expected(self, stream: bool, capacity: int) -> float:
+        base = self.ttft if stream else self.completion
+        if base is None:
+            # 流式还没有首 token 样本时退回完成时间（反之亦然），都没有时为 0（优先尝试）
+            base = self.completion if stream else self.ttft
+        base = base or 0.0
+        over = self.inflight - capacity + 1
+        if over > 0:
+            base += over / capacity * (self.completion or 0.0)
+        return base
+
+    def as_dict(self) -> dict:
+        return {"ttft_ewma": None if self.ttft is None else round(self.ttft, 3),
+                "completion_ewma": None if self.completion is None else round(self.completion, 3),
+                "samples": self.samples, "inflight": self.inflight}
+
+
+_latency: Dict[str, BackendLatency] = {}
+
+
+def _get(backend: str) -> BackendLatency:
+    latency = _latency.get(backend)
+    if latency is None:
+        latency = _latency[backend] = BackendLatency()
+    return latency
+
+
+def begin(backend: str):
+    _get(backend).inflight += 1
+
+
+def end(backend: str, ttft: Optional[float] = None, completion: Optional[float] = None):
+    """请求结束：成功时传入首 token / 完成耗时，失败或取消时只减少在途数。"""
+    latency = _get(backend)
+    latency.inflight = max(0, latency.inflight - 1)
+    if ttft is not None or completion is not None:
+        latency.observe(ttft, completion)
+
+
+def _capacity(backend: str) -> int:
+    from .lifecycle import lifecycle
+
+    configured = (_config().get("capacity") or {}).get(backend)
+    if configured:
+        return max(1, int(configured))
+    instance = lifecycle.peek(backend)
+    pool = ((instance.stats() if instance is not None else None) or {}).get("pool") or {}
+    return max(1, int(pool.get("size") or DEFAULT_CAPACITY))
+
+
+def choose(candidates: List[dict], stream: bool) -> Tuple[str, Optional[str], float]:
+    """返回 (后端, 模型, 预期延迟)；所有候选都熔断时返回第一个候选（由熔断器决定失败转移或拒绝）。"""
+    from . import backend_registry, circuit_breaker
+
+    registered = {spec.name for spec in backend_registry.list_backends()}
+    eligible = [c for c in candidates
+                if c.get("backend") in registered
+                and circuit_breaker.get(f"backend:{c['backend']}").available()]
+    if not eligible:
+        first = candidates[0]
+        return first["backend"], first.get("model"), 0.0
+    if len(eligible) > 1 and random.random() < float(_config().get("explore", DEFAULT_EXPLORE)):
+        pick = random.choice(eligible)
+        return pick["backend"], pick.get("model"), _get(pick["backend"]).expected(stream, _capacity(pick["backend"]))
+    scored = [(_get(c["backend"]).expected(stream, _capacity(c["backend"])), i, c) for i, c in enumerate(eligible)]
+    expected, _, best = min(scored)
+    return best["backend"], best.get("model"), expected
+
+
+def route(payload: dict) -> dict:
+    """model 为别名组时改写 payload 的 backend 与 model（原地修改并返回）；其它请求原样返回。
+
+    已经路由过（带 requested_model）或显式指定了 backend 的请求不再改写。
+    """
+    if not isinstance(payload, dict) or "requested_model" in payload or payload.get("backend"):
+        return payload
+    candidates = groups().get(payload.get("model"))
+    if not candidates:
+        return payload
+    backend, model, expected = choose(candidates, bool(payload.get("stream")))
+    logger.debug("auto route %s -> %s/%s (expected %.3fs)", payload.get("model"), backend, model, expected)
+    payload["requested_model"] = payload.get("model")
+    payload["backend"] = backend
+    if model:
+        payload["model"] = model
+    return payload
+
+
+def models() -> List[str]:
+    return list(groups())
+
+
+def stats() -> dict:
+    return {name: latency.as_dict() for name, latency in sorted(_latency.items())}
@@ -0,0 +1,195 @@
+"""后端注册表：以声明方式登记逆向后端，实现模块在首次使用时才导入。
+
+每个后端声明：
+- name: 后端名（如 "copilot" / "gemini" / "mock"）
+- target: 实现类路径，格式 "module.path:ClassName"
+- models: 对外公布的模型 id（同时作为精确路由）
+- match: 模型名包含这些子串时路由到该后端（忽略大小写）
+
+models/match 作为内置路由规则编译进 model_router（config.json 的 model_routes 可覆盖）。
+reverse_factory 与 /v1/models 都从这里读取，因此启动时不会加载 Playwright / aiohttp 等重依赖。
+"""
+import importlib
+import sys
+import time
+from typing import Dict, Iterable, List, Optional
+
+
+class BackendSpec:
+    """单个后端的声明信息，实现类按需加载并缓存。"""
+
+    def __init__(
+        self,
+        name: str,
+        target: str,
+        models: Iterable[str] = (),
+        match: Iterable[str] = (),
+        shared: bool = True,
+        owned_by: str = "custom",
+    ):
+        self.name = name
+        self.target = target
+        self.models = tuple(models)
+        self.match = tuple(m.lower() for m in match)
+        # shared=True 表示进程内单例（由 lifecycle 持有）；False 表示每个请求新建实例（如 mock）
+        self.shared = shared
+        self.owned_by = owned_by
+        self._cls = None
+
+    def load_class(self):
+        """导入并返回实现类（只在第一次调用时真正 import）。"""
+        if self._cls is None:
+            module_path, _, attr = self.target.partition(":")
+            module = importlib.import_module(module_path)
+            self._cls = getattr(module, attr)
+        return self._cls
+
+    @property
+    def loaded(self) -> bool:
+        return self._cls is not None
+
+
+_BACKENDS: Dict[str, BackendSpec] = {}
+_DEFAULT_BACKEND = "copilot"
+
+# /v1/models 响应缓存；注册新后端时失效
+_models_cache: Optional[dict] = None
+
+
+def register_backend(
+    name: str,
+    target: str,
+    models: Iterable[str] = (),
+    match: Iterable[str] = (),
+    shared: bool = True,
+    owned_by: str = "custom",
+    default: bool = False,
+) -> BackendSpec:
+    """注册（或覆盖）一个后端。default=True 时设为未命中任何规则时的默认后端。"""
+    global _DEFAULT_BACKEND, _models_cache
+    spec = BackendSpec(name, target, models=models, match=match, shared=shared, owned_by=owned_by)
+    _BACKENDS[name] = spec
+    if default:
+        _DEFAULT_BACKEND = name
+    _models_cache = None
+    _invalidate_routes()
+    return spec
+
+
+def _invalidate_routes():
+    # 内置后端在 model_router 导入之前注册，此时还没有需要失效的路由表
+    # （先导入 model_router 时，它在模块初始化中途导入本模块，此时 router 也尚未创建）
+    router = getattr(sys.modules.get("app.services.model_router"), "router", None)
+    if router is not None:
+        router.invalidate()
+
+
+def get_backend(name: str) -> BackendSpec:
+    try:
+        return _BACKENDS[name]
+    except KeyError:
+        raise KeyError(f"unknown backend: {name}") from None
+
+
+def list_backends() -> List[BackendSpec]:
+    return list(_BACKENDS.values())
+
+
+def default_backend_name() -> str:
+    return _DEFAULT_BACKEND
+
+
+def is_declared_model(model: Optional[str]) -> bool:
+    """模型名是否被某个后端显式声明（用于 /v1/models 与指标标签）。"""
+    return bool(model) and any(model in spec.models for spec in _BACKENDS.values())
+
+
+def backend_for_model(model: Optional[str]) -> str:
+    """根据模型名返回后端名：由 model_router 解析（精确规则、预编译模式，结果缓存），未命中时为默认后端。"""
+    from app.services.model_router import resolve
+
+    return resolve(model).backend
+
+
+def resolve_backend_name(data: dict) -> str:
+    """根据请求数据选择后端名。
+
+    优先级：
+    - 显式 backend 字段（必须是已注册的后端）
+    - use_mock -> mock
+    - use_gemini -> gemini
+    - 按 model 名查表
+    """
+    backend = data.get("backend")
+    if backend and backend in _BACKENDS:
+        return backend
+    if data.get("use_mock"):
+        return "mock"
+    if data.get("use_gemini"):
+        return "gemini"
+    return backend_for_model(data.get("model"))
+
+
+def list_models() -> dict:
+    """生成 OpenAI 风格的 /v1/models 响应，结果缓存到下一次注册为止。"""
+    global _models_cache
+    if _models_cache is not None:
+        return _models_cache
+
+    created = int(time.time())
+    data = []
+    for spec in _BACKENDS.values():
+        for model in spec.models:
+            data.append({
+                "id": model,
+                "object": "model",
+                "created": created,
+                "owned_by": spec.owned_by,
+                "permission": [
+                    {
+                        "id": f"perm-{model}",
+                        "object": "model_permission",
+                        "allow_create_engine": True,
+                        "allow_sampling": True,
+                        "allow_logprobs": True,
+                        "allow_search_indices": False,
+                        "allow_view": True,
+                        "allow_fine_tuning": False,
+                        "organization": "*",
+                        "group": None,
+                        "is_blocking": False
+                    }
+                ],
+                "root": model,
+                "parent": None,
+                "backend": spec.name,
+            })
+    _models_cache = {"object": "list", "data": data}
+    return _models_cache
+
+
+# ---- 内置后端 ----
+register_backend(
+    "copilot",
+    "app.services.copilot_reverse:CopilotReverse",
+    models=("copilot-chat", "gpt-5-chat-latest"),
+    default=True,
+)
+register_backend(
+    "gemini",
+    "app.services.gemini_reverse_2:GeminiReverse2",
+    models=("gemini-2.5-pro", "gemini-2.5-flash"),
+    match=("gemini",),
+)
+register_backend(
+    "mock",
+    "app.services.mock_copilot:MockCopilotProxy",
+    shared=False,
+)
+# 容量规划用的模拟后端：共享实例，页面容量与延迟分布见 config.json 的 sim_backend
+register_backend(
+    "sim",
+    "app.services.sim_backend:SimulatedBackend",
+    models=("sim-chat",),
+    owned_by="simulation",
+)
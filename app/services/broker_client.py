@@ -0,0 +1,285 @@
+"""API worker 侧的 broker 客户端：把共享后端的请求转发到 broker 进程并流式取回结果。
+
+config.json 设置 broker_address 后，reverse_factory 对 shared 后端（copilot / gemini）返回 BrokerReverse，
+worker 进程本身不再启动浏览器，因此可以用多个 uvicorn worker 处理 HTTP。
+"""
+import asyncio
+import contextlib
+import itertools
+import logging
+import time
+from typing import Dict, Optional
+
+from app.config.settings import get_setting
+from app.services import broker_protocol as bp
+from app.services.circuit_breaker import CircuitOpenError
+from app.services.reverse_base import ReverseBase
+from app.utils import deadline
+
+logger = logging.getLogger(__name__)
+
+
+class BrokerError(RuntimeError):
+    """broker 返回的错误或连接中断。"""
+
+
+_in_broker = False
+
+
+def broker_address() -> Optional[str]:
+    return get_setting("broker_address")
+
+
+def enabled() -> bool:
+    """当前进程是否应把共享后端转发给 broker（broker 进程自身始终在本地执行）。"""
+    return bool(broker_address()) and not _in_broker
+
+
+def mark_broker_process():
+    global _in_broker
+    _in_broker = True
+
+
+# BrokerReverse.stats() 使用的 broker 状态最多过期这么多秒
+STATUS_MAX_AGE = 5.0
+
+
+class BrokerConnection:
+    """单条多路复用连接：一个读任务按 stream_id 把帧分发到各请求的队列。"""
+
+    def __init__(self, address: str):
+        self.address = address
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._read_task: Optional[asyncio.Task] = None
+        self._streams: Dict[int, asyncio.Queue] = {}
+        self._ids = itertools.count(1)
+        self._connect_lock = asyncio.Lock()
+        self._write_lock = asyncio.Lock()
+        # broker 最近一次 STATUS 回复（各后端的页面池等，供同步的 stats() 使用）
+        self.last_status: Optional[dict] = None
+        self._status_at = 0.0
+        self._status_task: Optional[asyncio.Task] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self):
+        if self.connected:
+            return
+        async with self._connect_lock:
+            if self.connected:
+                return
+            self._reader, self._writer = await bp.open_connection(self.address)
+            self._read_task = asyncio.create_task(self._read_loop())
+
+    async def _read_loop(self):
+        try:
+            while True:
+                ftype, sid, body = await bp.read_frame(self._reader)
+                queue = self._streams.get(sid)
+                if queue is not None:
+                    queue.put_nowait((ftype, body))
+        except (asyncio.IncompleteReadError, ConnectionError, bp.ProtocolError) as e:
+            logger.warning("broker connection lost: %s", e)
+        finally:
+            writer, self._writer = self._writer, None
+            if writer is not None:
+                writer.close()
+            lost = bp.encode_json({"error": "BrokerError", "message": "broker connection lost"})
+            for queue in self._streams.values():
+                queue.put_nowait((bp.ERROR, lost))
+
+    async def _send(self, ftype: int, sid: int, body: bytes = b""):
+        async with self._write_lock:
+            if not self.connected:
+                raise BrokerError("broker not connected")
+            self._writer.write(bp.encode_frame(ftype, sid, body))
+            await self._writer.drain()
+
+    async def open_stream(self, ftype: int, body: bytes) -> tuple:
+        await self.connect()
+        sid = next(self._ids)
+        queue: asyncio.Queue = asyncio.Queue()
+        self._streams[sid] = queue
+        try:
+            await self._send(ftype, sid, body)
+        except Exception:
+            self._streams.pop(sid, None)
+            raise
+        return sid, queue
+
+    def close_stream(self, sid: int):
+        self._streams.pop(sid, None)
+
+    async def cancel(self, sid: int):
+        self.close_stream(sid)
+        with contextlib.suppress(Exception):
+            await self._send(bp.CANCEL, sid)
+
+    async def status(self, timeout: float = 2.0) -> dict:
+        sid, queue = await self.open_stream(bp.STATUS, b"")
+        try:
+            ftype, body = await asyncio.wait_for(queue.get(), timeout)
+        finally:
+            self.close_stream(sid)
+        if ftype != bp.STATUS:
+            raise BrokerError((bp.decode_json(body) or {}).get("message", "unexpected reply"))
+        status = bp.decode_json(body)
+        self.last_status, self._status_at = status, time.monotonic()
+        return status
+
+    def refresh_status(self, max_age: float = STATUS_MAX_AGE):
+        """last_status 过期时在后台请求一次 STATUS（同一时间最多一个）；没有运行中的事件循环时不做任何事。"""
+        if time.monotonic() - self._status_at < max_age or (self._status_task and not self._status_task.done()):
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+
+        async def refresh():
+            with contextlib.suppress(Exception):
+                await self.status()
+
+        self._status_at = time.monotonic()
+        self._status_task = loop.create_task(refresh())
+
+    async def close(self):
+        if self._read_task is not None:
+            self._read_task.cancel()
+            await asyncio.gather(self._read_task, return_exceptions=True)
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+_connection: Optional[BrokerConnection] = None
+_reversers: Dict[str, "BrokerReverse"] = {}
+
+
+def get_connection() -> BrokerConnection:
+    global _connection
+    if _connection is None:
+        _connection = BrokerConnection(broker_address())
+    return _connection
+
+
+async def close_connection():
+    global _connection
+    conn, _connection = _connection, None
+    if conn is not None:
+        await conn.close()
+
+
+def get_reverser(backend: str) -> "BrokerReverse":
+    reverser = _reversers.get(backend)
+    if reverser is None:
+        reverser = _reversers[backend] = BrokerReverse(backend)
+    return reverser
+
+
+async def readiness() -> tuple:
+    """返回 (ready, body)，body 为 broker 进程的 readiness 信息。"""
+    try:
+        body = await get_connection().status()
+    except Exception as e:
+        return False, {"ready": False, "broker": broker_address(), "error": f"{e.__class__.__name__}: {e}"}
+    body["broker"] = broker_address()
+    return bool(body.get("ready")), body
+
+
+def _raise_error(body: bytes):
+    info = bp.decode_json(body) or {}
+    if info.get("error") == "DeadlineExceeded":
+        raise deadline.DeadlineExceeded(info.get("stage", "unknown"), float(info.get("timeout") or 0))
+    if info.get("error") == "CircuitOpenError":
+        raise CircuitOpenError(info.get("circuit", "broker"), float(info.get("retry_after") or 0))
+    raise BrokerError(f"{info.get('error', 'Error')}: {info.get('message', '')}")
+
+
+class BrokerReverse(ReverseBase):
+    """把请求转发给 broker 中同名后端的 reverser；接口与本地 reverser 一致。"""
+
+    def __init__(self, backend: str):
+        self.backend = backend
+
+    async def set_dynamic_data(self, data: dict):
+        return
+
+    async def prepare_send_conversation(self):
+        return
+
+    def stats(self) -> dict:
+        """broker 中同名后端的页面池（n 的上限、对冲等按池大小决策）；取自最近一次 STATUS 回复。"""
+        conn = get_connection()
+        conn.refresh_status()
+        info = ((conn.last_status or {}).get("backends") or {}).get(self.backend) or {}
+        return {"pool": info["pool"]} if info.get("pool") else {}
+
+    @staticmethod
+    async def _open(conn: "BrokerConnection", payload: dict) -> tuple:
+        request_deadline = deadline.current()
+        if request_deadline is not None:
+            # 已经没有剩余时间时在本地失败：0 会被 broker 当作“未设置”
+            request_deadline.check(deadline.SEND)
+            # broker 按剩余时间重建 deadline，各阶段的超时在 broker 中生效
+            payload = dict(payload, timeout=max(request_deadline.remaining(), 0.001))
+        return await conn.open_stream(bp.REQUEST, bp.encode_json({"payload": payload}))
+
+    async def send_conversation(self, text: Optional[any] = None, payload: Optional[dict] = None):
+        payload = dict(payload or {})
+        payload["backend"] = self.backend
+        conn = get_connection()
+
+        if payload.get("stream"):
+            async def stream_gen():
+                # 首次迭代时才向 broker 发出请求：没有被迭代就被丢弃的流（对冲落败、n > 1 出错）
+                # 不会在 broker 中占用页面
+                sid, queue = await self._open(conn, payload)
+                finished = False
+                stage = deadline.FIRST_TOKEN
+                try:
+                    while True:
+                        ftype, body = await deadline.wait(queue.get(), stage)
+                        stage = deadline.COMPLETION
+                        if ftype == bp.CHUNK:
+                            yield body.decode("utf-8")
+                        elif ftype == bp.END:
+                            finished = True
+                            return
+                        elif ftype == bp.ERROR:
+                            finished = True
+                            _raise_error(body)
+                finally:
+                    if finished:
+                        conn.close_stream(sid)
+                    else:
+                        # 客户端提前断开：通知 broker 取消上游生成并归还页面
+                        await conn.cancel(sid)
+
+            return stream_gen()
+
+        sid, queue = await self._open(conn, payload)
+        finished = False
+        try:
+            result = None
+            while True:
+                ftype, body = await deadline.wait(queue.get(), deadline.COMPLETION)
+                if ftype == bp.RESULT:
+                    result = bp.decode_json(body)
+                elif ftype == bp.END:
+                    finished = True
+                    return result
+                elif ftype == bp.ERROR:
+                    finished = True
+                    _raise_error(body)
+        finally:
+            if finished:
+                conn.close_stream(sid)
+            else:
+                await conn.cancel(sid)
+
+    async def close_client(self):
+        return
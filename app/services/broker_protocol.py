@@ -0,0 +1,76 @@
+"""浏览器 broker 与 API worker 之间的帧协议。
+
+一条连接上多路复用多个请求（stream_id）。每帧 = 9 字节头 + body：
+    type (1 byte) | stream_id (uint32, big-endian) | length (uint32, big-endian)
+
+body 编码：
+- REQUEST / RESULT / ERROR / STATUS：紧凑 JSON（UTF-8）
+- CHUNK：原始 SSE 文本（UTF-8），不再包一层 JSON，减少编码开销
+- END / CANCEL：空
+"""
+import asyncio
+import json
+import struct
+from typing import Any, Tuple
+
+REQUEST = 1   # worker -> broker：{"payload": {...}}
+CHUNK = 2     # broker -> worker：一个 SSE 块
+RESULT = 3    # broker -> worker：非流式结果 dict
+ERROR = 4     # broker -> worker：{"error": 异常类名, "message": ...}
+END = 5       # broker -> worker：该 stream 结束
+CANCEL = 6    # worker -> broker：客户端断开/超时，取消上游生成
+STATUS = 7    # 双向：worker 请求 / broker 返回 {"ready": bool, ...}
+
+HEADER = struct.Struct(">BII")
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+
+class ProtocolError(RuntimeError):
+    pass
+
+
+def encode_frame(ftype: int, stream_id: int, body: bytes = b"") -> bytes:
+    return HEADER.pack(ftype, stream_id, len(body)) + body
+
+
+def encode_json(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def decode_json(body: bytes) -> Any:
+    return json.loads(body.decode("utf-8")) if body else None
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[int, int, bytes]:
+    """读取一帧；连接关闭时抛出 asyncio.IncompleteReadError。"""
+    header = await reader.readexactly(HEADER.size)
+    ftype, stream_id, length = HEADER.unpack(header)
+    if length > MAX_FRAME_BYTES:
+        raise ProtocolError(f"frame too large: {length} bytes")
+    body = await reader.readexactly(length) if length else b""
+    return ftype, stream_id, body
+
+
+def parse_address(address: str) -> Tuple[str, Any]:
+    """解析 broker 地址："unix:/path/to.sock" 或 "tcp:127.0.0.1:5006"。"""
+    kind, _, rest = address.partition(":")
+    if kind == "unix" and rest:
+        return "unix", rest
+    if kind == "tcp" and rest:
+        host, _, port = rest.rpartition(":")
+        return "tcp", (host or "127.0.0.1", int(port))
+    raise ValueError(f"invalid broker address: {address!r} (expected unix:/path or tcp:host:port)")
+
+
+async def open_connection(address: str):
+    kind, target = parse_address(address)
+    if kind == "unix":
+        return await asyncio.open_unix_connection(target)
+    return await asyncio.open_connection(*target)
+
+
+async def start_server(handler, address: str):
+    kind, target = parse_address(address)
+    if kind == "unix":
+        return await asyncio.start_unix_server(handler, path=target)
+    return await asyncio.start_server(handler, host=target[0], port=target[1])
@@ -0,0 +1,155 @@
+"""浏览器 broker 进程：独占浏览器、页面池与凭据状态，通过本地 IPC 为多个 API worker 提供补全。
+
+运行：
+    python -m app.services.broker_server [--address unix:/tmp/chat2api-broker.sock]
+
+地址默认取 config.json 的 broker_address。broker 内部复用 lifecycle / reverse_factory，
+因此页面池、预热、关闭流程与单进程模式完全一致；熔断与对冲只在 worker 侧生效。
+"""
+import argparse
+import asyncio
+import contextlib
+import logging
+import os
+import signal
+
+from app.config.settings import get_setting
+from app.services import broker_client, broker_protocol as bp
+from app.services.circuit_breaker import CircuitOpenError
+from app.services.lifecycle import lifecycle
+from app.services.reverse_factory import get_local_reverser
+from app.utils import deadline
+from app.utils.log import setup_logging, shutdown_logging
+
+logger = logging.getLogger(__name__)
+
+
+class BrokerServer:
+    def __init__(self, address: str):
+        self.address = address
+        self._server = None
+        self._connections = {}
+
+    async def start(self):
+        kind, target = bp.parse_address(self.address)
+        if kind == "unix" and os.path.exists(target):
+            # 上一次异常退出遗留的 socket 文件
+            os.unlink(target)
+        self._server = await bp.start_server(self._handle_connection, self.address)
+        logger.info("broker listening on %s", self.address)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        # 关闭连接而不是取消处理任务：读循环收到 EOF 后会取消在途请求并正常退出
+        connections = dict(self._connections)
+        for writer in connections.values():
+            writer.close()
+        await asyncio.gather(*connections, return_exceptions=True)
+        kind, target = bp.parse_address(self.address)
+        if kind == "unix":
+            with contextlib.suppress(OSError):
+                os.unlink(target)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections[asyncio.current_task()] = writer
+        tasks = {}
+        write_lock = asyncio.Lock()
+
+        async def send(ftype: int, sid: int, body: bytes = b""):
+            async with write_lock:
+                writer.write(bp.encode_frame(ftype, sid, body))
+                await writer.drain()
+
+        async def run(sid: int, payload: dict):
+            if payload.get("timeout") is not None:
+                # worker 转发的剩余时间；不足 1ms 也按已设置处理，不能当作“没有截止时间”
+                deadline.activate(deadline.Deadline(max(float(payload["timeout"]), 0.001)))
+            try:
+                # worker 已按熔断 / 对冲选定后端（payload["backend"]），这里直接使用原始实例
+                reverser = await get_local_reverser(payload)
+                result = await reverser.send_conversation(payload=payload)
+                if payload.get("stream"):
+                    async with contextlib.aclosing(result):
+                        async for chunk in result:
+                            await send(bp.CHUNK, sid, chunk.encode("utf-8"))
+                else:
+                    await send(bp.RESULT, sid, bp.encode_json(result))
+                await send(bp.END, sid)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("broker request %s failed: %s", sid, e)
+                error = {"error": e.__class__.__name__, "message": str(e)}
+                if isinstance(e, deadline.DeadlineExceeded):
+                    error.update(stage=e.stage, timeout=e.timeout)
+                elif isinstance(e, CircuitOpenError):
+                    error.update(circuit=e.name, retry_after=e.retry_after)
+                with contextlib.suppress(Exception):
+                    await send(bp.ERROR, sid, bp.encode_json(error))
+            finally:
+                tasks.pop(sid, None)
+
+        try:
+            while True:
+                ftype, sid, body = await bp.read_frame(reader)
+                if ftype == bp.REQUEST:
+                    request = bp.decode_json(body) or {}
+                    tasks[sid] = asyncio.create_task(run(sid, request.get("payload") or {}))
+                elif ftype == bp.CANCEL:
+                    task = tasks.get(sid)
+                    if task is not None:
+                        task.cancel()
+                elif ftype == bp.STATUS:
+                    ready, status = lifecycle.readiness()
+                    await send(bp.STATUS, sid, bp.encode_json(status))
+                else:
+                    logger.warning("broker: unexpected frame type %s", ftype)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except bp.ProtocolError as e:
+            logger.warning("broker: dropping connection: %s", e)
+        finally:
+            # worker 断开：取消它的全部在途请求，页面立即归还
+            for task in list(tasks.values()):
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            writer.close()
+            with contextlib.suppress(Exception):
+                await writer.wait_closed()
+            self._connections.pop(asyncio.current_task(), None)
+
+
+async def serve(address: str):
+    broker_client.mark_broker_process()
+    setup_logging()
+    server = BrokerServer(address)
+    await server.start()
+    lifecycle.start_warm_up()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with contextlib.suppress(NotImplementedError, RuntimeError):
+            loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        await server.close()
+        await lifecycle.shutdown()
+        shutdown_logging()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="chat2api browser broker")
+    parser.add_argument("--address", default=get_setting("broker_address"))
+    args = parser.parse_args()
+    if not args.address:
+        parser.error("no broker address: pass --address or set broker_address in config.json")
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(serve(args.address))
+
+
+if __name__ == "__main__":
+    main()
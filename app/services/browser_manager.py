@@ -1,13 +1,92 @@
 import asyncio
+import logging
 import os
 import subprocess
-from typing import Optional
+import time
+from typing import Dict, List, Optional
 from playwright.async_api import async_playwright
-from app.config.settings import get_user_data_dir
+from app.config.settings import get_setting, get_user_data_dir
+from app.utils.metrics import GaugeCallback
+
+logger = logging.getLogger(__name__)
 
 # sensible defaults
 DEFAULT_CHROME_PATH = r"C:\Program Files\Google\Chrome\Application\chrome.exe"
 DEFAULT_DEBUG_PORT = "9999"
+DEFAULT_TELEMETRY_INTERVAL = 15.0
+
+# Performance.getMetrics 中采集的指标 -> 遥测字段
+_PERF_FIELDS = {
+    "JSHeapUsedSize": "js_heap_used_bytes",
+    "JSHeapTotalSize": "js_heap_total_bytes",
+    "Nodes": "dom_nodes",
+    "Documents": "documents",
+    "JSEventListeners": "js_event_listeners",
+    "TaskDuration": "cpu_seconds",
+}
+
+
+class PageTelemetry:
+    """单个页面的 CDP 遥测：定期采样 Performance.getMetrics，并按 Network 事件累计收发字节数。"""
+
+    def __init__(self, page, label: str):
+        self.page = page
+        self.label = label
+        self.session = None
+        self.created_at = time.time()
+        self.sample: Dict[str, float] = {}
+        self.sampled_at: Optional[float] = None
+        self.cpu_percent: Optional[float] = None
+        self.network_rx_bytes = 0
+        self.ws_rx_bytes = 0
+        self.ws_tx_bytes = 0
+
+    async def attach(self, context, network: bool):
+        self.session = await context.new_cdp_session(self.page)
+        await self.session.send("Performance.enable", {"timeDomain": "threadTicks"})
+        if network:
+            self.session.on("Network.loadingFinished", self._on_loading_finished)
+            self.session.on("Network.webSocketFrameReceived", self._on_ws_received)
+            self.session.on("Network.webSocketFrameSent", self._on_ws_sent)
+            await self.session.send("Network.enable")
+
+    def _on_loading_finished(self, event):
+        self.network_rx_bytes += int(event.get("encodedDataLength") or 0)
+
+    def _on_ws_received(self, event):
+        self.ws_rx_bytes += len((event.get("response") or {}).get("payloadData") or "")
+
+    def _on_ws_sent(self, event):
+        self.ws_tx_bytes += len((event.get("response") or {}).get("payloadData") or "")
+
+    async def collect(self):
+        result = await self.session.send("Performance.getMetrics")
+        values = {m["name"]: m["value"] for m in result.get("metrics", ())}
+        now = time.monotonic()
+        sample = {field: values[name] for name, field in _PERF_FIELDS.items() if name in values}
+        previous_cpu, previous_at = self.sample.get("cpu_seconds"), self.sampled_at
+        if previous_cpu is not None and previous_at is not None and "cpu_seconds" in sample and now > previous_at:
+            self.cpu_percent = 100.0 * (sample["cpu_seconds"] - previous_cpu) / (now - previous_at)
+        self.sample = sample
+        self.sampled_at = now
+
+    async def detach(self):
+        if self.session is not None:
+            try:
+                await self.session.detach()
+            except Exception:
+                pass
+            self.session = None
+
+    def as_dict(self) -> dict:
+        info = {"label": self.label, **self.sample}
+        if self.cpu_percent is not None:
+            info["cpu_percent"] = round(self.cpu_percent, 2)
+        info.update(network_rx_bytes=self.network_rx_bytes, ws_rx_bytes=self.ws_rx_bytes, ws_tx_bytes=self.ws_tx_bytes)
+        if self.sampled_at is not None:
+            info["sample_age_seconds"] = round(time.monotonic() - self.sampled_at, 1)
+        info["age_seconds"] = round(time.time() - self.created_at, 1)
+        return info
 
 
 class BrowserManager:
@@ -38,6 +117,13 @@ class BrowserManager:
         self._initialized = False
         self._init_lock = asyncio.Lock()
 
+        # CDP 遥测：按页面采样（见 track_page），以及整个浏览器（shard）的进程 CPU 时间
+        self._pages: Dict[int, PageTelemetry] = {}
+        self._browser_session = None
+        self._processes: List[dict] = []
+        self._telemetry_task: Optional[asyncio.Task] = None
+        self._telemetry_interval = float(get_setting("browser_telemetry_interval", DEFAULT_TELEMETRY_INTERVAL))
+
     @classmethod
     async def get_instance(cls, chrome_path: Optional[str] = None, debug_port: Optional[str] = None, user_data_dir: Optional[str] = None):
         """Get or create the global BrowserManager singleton.
@@ -100,17 +186,23 @@ class BrowserManager:
                 self.context = await self.browser.new_context()
 
             self._initialized = True
+            if self._telemetry_interval > 0:
+                self._telemetry_task = asyncio.create_task(self._telemetry_loop())
 
-    async def new_page(self, url: Optional[str] = None, route_overrides: Optional[list] = None):
+    async def new_page(self, url: Optional[str] = None, route_overrides: Optional[list] = None,
+                       label: Optional[str] = None):
         """Create a new page bound to the shared context. Optionally navigate to url.
 
         route_overrides: list of callables that receive a Playwright page and register
         route handlers on it. This allows callers to inject request/response interception
         logic when the page is created.
+        label: 遥测中显示的页面名（如 "copilot:0"），提供时该页面纳入 CDP 遥测采样。
         """
         if not self._initialized:
             await self._ensure_started()
         page = await self.context.new_page()
+        if label:
+            await self.track_page(page, label)
 
         # apply any provided route override functions
         if route_overrides:
@@ -139,8 +231,88 @@ class BrowserManager:
             await self._ensure_started()
         return self.context
 
+    async def track_page(self, page, label: str):
+        """把页面纳入 CDP 遥测（附加 CDP 会话失败时只记录日志，不影响页面使用）。页面关闭后自动移除。"""
+        if self._telemetry_interval <= 0:
+            return
+        telemetry = PageTelemetry(page, label)
+        try:
+            await telemetry.attach(self.context, bool(get_setting("browser_telemetry_network", True)))
+        except Exception as e:
+            logger.warning("telemetry attach failed for page %s: %s", label, e)
+            return
+        self._pages[id(page)] = telemetry
+        page.on("close", lambda _: self._pages.pop(id(page), None))
+
+    def page_telemetry(self, page) -> Optional[dict]:
+        """页面最近一次采样（供页面池回收等决策使用）；未纳入遥测或尚未采样时返回 None。"""
+        telemetry = self._pages.get(id(page))
+        if telemetry is None or telemetry.sampled_at is None:
+            return None
+        return telemetry.as_dict()
+
+    async def sample_page(self, page):
+        """立即重新采样单个页面（如页面被重新加载后）。"""
+        telemetry = self._pages.get(id(page))
+        if telemetry is not None:
+            await asyncio.wait_for(telemetry.collect(), 5)
+
+    async def sample_telemetry(self):
+        """立即采样一次所有页面与浏览器进程。"""
+        pages = list(self._pages.values())
+        results = await asyncio.gather(*(asyncio.wait_for(t.collect(), 5) for t in pages), return_exceptions=True)
+        for telemetry, result in zip(pages, results):
+            if isinstance(result, Exception):
+                logger.debug("telemetry sample failed for page %s: %s", telemetry.label, result)
+        try:
+            if self._browser_session is None:
+                self._browser_session = await self.browser.new_browser_cdp_session()
+            info = await asyncio.wait_for(self._browser_session.send("SystemInfo.getProcessInfo"), 5)
+            self._processes = info.get("processInfo") or []
+        except Exception as e:
+            logger.debug("browser process info unavailable: %s", e)
+
+    async def _telemetry_loop(self):
+        while True:
+            await asyncio.sleep(self._telemetry_interval)
+            try:
+                await self.sample_telemetry()
+            except Exception as e:
+                logger.warning("browser telemetry sampling failed: %s", e)
+
+    def telemetry(self) -> dict:
+        """按页面与按浏览器（shard）汇总的遥测；pools 为按页面名前缀（如 copilot）的合计，便于评估池大小。"""
+        pages = [t.as_dict() for t in self._pages.values()]
+        pools: Dict[str, dict] = {}
+        for info in pages:
+            pool = pools.setdefault(info["label"].split(":", 1)[0], {"pages": 0})
+            pool["pages"] += 1
+            for key in ("js_heap_used_bytes", "dom_nodes", "cpu_seconds", "network_rx_bytes", "ws_rx_bytes"):
+                if key in info:
+                    pool[key] = pool.get(key, 0) + info[key]
+        processes: Dict[str, dict] = {}
+        for proc in self._processes:
+            entry = processes.setdefault(proc.get("type", "other"), {"count": 0, "cpu_seconds": 0.0})
+            entry["count"] += 1
+            entry["cpu_seconds"] += float(proc.get("cpuTime") or 0.0)
+        return {
+            "shard": self.CDP_URL,
+            "interval_seconds": self._telemetry_interval,
+            "processes": processes,
+            "pools": pools,
+            "pages": pages,
+        }
+
     async def close(self):
         """Stop playwright and try to terminate the chrome process. This will shut down the shared browser."""
+        if self._telemetry_task is not None:
+            self._telemetry_task.cancel()
+            await asyncio.gather(self._telemetry_task, return_exceptions=True)
+            self._telemetry_task = None
+        for telemetry in list(self._pages.values()):
+            await telemetry.detach()
+        self._pages.clear()
+        self._browser_session = None
         try:
             if self.playwright:
                 await self.playwright.stop()
@@ -154,3 +326,50 @@ class BrowserManager:
             pass
 
         self._initialized = False
+
+    @classmethod
+    async def shutdown(cls):
+        """Close the shared singleton (if any) and forget it so a later get_instance() starts afresh."""
+        async with cls._instance_lock:
+            mgr, cls._instance = cls._instance, None
+        if mgr is not None:
+            await mgr.close()
+
+
+def _current_telemetry() -> Optional[dict]:
+    mgr = BrowserManager._instance
+    return mgr.telemetry() if mgr is not None else None
+
+
+def _page_samples(field: str):
+    def samples():
+        telemetry = _current_telemetry()
+        for page in (telemetry or {}).get("pages", ()):
+            if field in page:
+                yield (page["label"],), page[field]
+    return samples
+
+
+def _network_samples():
+    telemetry = _current_telemetry()
+    for page in (telemetry or {}).get("pages", ()):
+        yield (page["label"], "http_rx"), page["network_rx_bytes"]
+        yield (page["label"], "ws_rx"), page["ws_rx_bytes"]
+        yield (page["label"], "ws_tx"), page["ws_tx_bytes"]
+
+
+def _process_samples():
+    telemetry = _current_telemetry()
+    for kind, entry in ((telemetry or {}).get("processes") or {}).items():
+        yield (telemetry["shard"], kind), entry["cpu_seconds"]
+
+
+GaugeCallback("chat2api_browser_page_js_heap_bytes", "JS heap used per pooled page (CDP Performance.getMetrics).",
+              ("page",), _page_samples("js_heap_used_bytes"))
+GaugeCallback("chat2api_browser_page_dom_nodes", "DOM node count per pooled page.", ("page",), _page_samples("dom_nodes"))
+GaugeCallback("chat2api_browser_page_cpu_seconds", "Renderer main-thread task time per pooled page.",
+              ("page",), _page_samples("cpu_seconds"))
+GaugeCallback("chat2api_browser_page_network_bytes", "Bytes transferred per pooled page by kind (http_rx, ws_rx, ws_tx).",
+              ("page", "kind"), _network_samples)
+GaugeCallback("chat2api_browser_process_cpu_seconds", "Cumulative CPU time of browser processes by shard and process type.",
+              ("shard", "type"), _process_samples)
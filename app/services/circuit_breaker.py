@@ -0,0 +1,312 @@
+"""熔断器：按后端、按页面统计最近的失败率（及慢调用），超过阈值后打开，请求立即失败或转移到备用后端。
+
+状态：
+- closed：正常放行，记录 window_seconds 内的结果；请求数 ≥ min_requests 且失败率 ≥ failure_rate 时打开
+- open：直接拒绝（CircuitOpenError，路由返回 503 + Retry-After），open_seconds 后进入 half-open
+- half-open：最多放行 half_open_probes 个探测请求；探测全部成功则关闭，任一失败则重新打开
+
+慢调用（耗时超过 slow_call_seconds，null 表示不启用）按失败计算。请求被取消（客户端断开、对冲落败）
+以及客户端造成的错误（截止时间到期、参数不合法，见 outcome_of）不计入结果。
+
+config.json 的 circuit_breaker：
+    {"enabled": true, "window_seconds": 60, "min_requests": 5, "failure_rate": 0.5, "slow_call_seconds": null,
+     "open_seconds": 30, "half_open_probes": 1,
+     "failover": {"copilot": [{"backend": "gemini", "model": "gemini-2.5-pro"}]}}
+
+failover 的每一项是 (backend, model)：转移时请求的 model 一并改写（省略 model 则保留原值），
+原始 model 保存在 requested_model 中。
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from app.config.settings import get_setting
+from app.utils import deadline
+from app.utils.metrics import CIRCUIT_REJECTED, GaugeCallback
+from . import auto_router
+from .fanout import ChoicesRejected
+from .reverse_base import ReverseBase, UpstreamError
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_STATE_VALUES = {CLOSED: 0, OPEN: 1, HALF_OPEN: 2}
+
+
+class CircuitOpenError(RuntimeError):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"circuit {name} is open, retry after {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, config: Optional[dict] = None):
+        config = config if config is not None else (get_setting("circuit_breaker", {}) or {})
+        self.name = name
+        self.enabled = bool(config.get("enabled", True))
+        self.window_seconds = float(config.get("window_seconds", 60))
+        self.min_requests = int(config.get("min_requests", 5))
+        self.failure_rate = float(config.get("failure_rate", 0.5))
+        slow = config.get("slow_call_seconds")
+        self.slow_call_seconds = float(slow) if slow else None
+        self.open_seconds = float(config.get("open_seconds", 30))
+        self.half_open_probes = max(1, int(config.get("half_open_probes", 1)))
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._outcomes: deque = deque()
+        self._probes = 0
+        self._probe_successes = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probes = 0
+            self._probe_successes = 0
+            logger.info("circuit %s half-open, probing", self.name)
+        return self._state
+
+    def available(self) -> bool:
+        """是否会放行一个请求（不占用探测名额）。"""
+        if not self.enabled:
+            return True
+        state = self.state
+        return state == CLOSED or (state == HALF_OPEN and self._probes < self.half_open_probes)
+
+    def retry_after(self) -> float:
+        return max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+    def before(self):
+        """请求开始前调用：不放行时抛出 CircuitOpenError；half-open 时占用一个探测名额。"""
+        if not self.available():
+            CIRCUIT_REJECTED.labels(self.name).inc()
+            raise CircuitOpenError(self.name, self.retry_after())
+        if self.enabled and self._state == HALF_OPEN:
+            self._probes += 1
+
+    def release(self):
+        """请求被取消、没有结果：归还探测名额。"""
+        if self.enabled and self._state == HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def record(self, ok: bool, latency: Optional[float] = None):
+        if not self.enabled:
+            return
+        if ok and self.slow_call_seconds is not None and latency is not None and latency > self.slow_call_seconds:
+            ok = False
+        now = time.monotonic()
+        state = self.state
+        if state == HALF_OPEN:
+            self._probes = max(0, self._probes - 1)
+            if not ok:
+                self._open(now, "probe failed")
+                return
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_probes:
+                self._state = CLOSED
+                self._outcomes.clear()
+                logger.info("circuit %s closed", self.name)
+            return
+        if state == OPEN:
+            # 打开之前已放行的请求陆续返回，不影响状态
+            return
+        self._outcomes.append((now, ok))
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            self._outcomes.popleft()
+        total = len(self._outcomes)
+        failures = sum(1 for _, success in self._outcomes if not success)
+        if total >= self.min_requests and failures / total >= self.failure_rate:
+            self._open(now, f"{failures}/{total} failed in {self.window_seconds:g}s")
+
+    def _open(self, now: float, reason: str):
+        self._state = OPEN
+        self._opened_at = now
+        self._outcomes.clear()
+        logger.warning("circuit %s opened: %s", self.name, reason)
+
+    def stats(self) -> dict:
+        info = {"state": self.state}
+        if self._state == OPEN:
+            info["retry_after"] = round(self.retry_after(), 1)
+        elif self._state == CLOSED and self._outcomes:
+            info["recent"] = len(self._outcomes)
+            info["failures"] = sum(1 for _, ok in self._outcomes if not ok)
+        return info
+
+
+def outcome_of(exc: BaseException) -> Optional[bool]:
+    """异常对应的熔断结果：False 计为失败；None 不计入（只归还探测名额）。
+
+    只有上游或基础设施的错误计为失败。客户端造成的错误不计入：
+    - 客户端设置的截止时间到期（X-Request-Timeout / timeout）
+    - 参数不合法（n 超限）
+    - 下游熔断器已打开
+    - 上游以 4xx 拒绝了请求本身（401 / 403 凭据失效与 429 限流除外）
+    否则几个 timeout=0.001 的请求就能让整个后端熔断。
+    """
+    if isinstance(exc, (asyncio.CancelledError, deadline.DeadlineExceeded, ChoicesRejected, CircuitOpenError)):
+        return None
+    if isinstance(exc, UpstreamError) and exc.status is not None and 400 <= exc.status < 500 \
+            and exc.status not in (401, 403, 429):
+        return None
+    return False
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get(name: str) -> CircuitBreaker:
+    breaker = _breakers.get(name)
+    if breaker is None:
+        breaker = _breakers[name] = CircuitBreaker(name)
+    return breaker
+
+
+def failover_targets(name: str) -> List[dict]:
+    """name 的备用 {"backend", "model"} 列表（按配置顺序）。"""
+    entries = ((get_setting("circuit_breaker", {}) or {}).get("failover") or {}).get(name) or ()
+    return [entry for entry in entries if isinstance(entry, dict) and entry.get("backend")]
+
+
+def select_backend(name: str, payload: Optional[dict] = None) -> str:
+    """返回本次请求使用的后端：name 的熔断器打开时转移到 failover 中第一个可用的后端，都不可用时抛出 CircuitOpenError。
+
+    转移时原地改写 payload 的 backend 与 model（原始 model 保存在 requested_model 中），
+    调用方之后用 resolve_backend_name(payload) 得到实际使用的后端。
+    """
+    breaker = get(f"backend:{name}")
+    if breaker.available():
+        return name
+    for alternate in failover_targets(name):
+        backend = alternate["backend"]
+        if get(f"backend:{backend}").available():
+            logger.info("circuit backend:%s open, failing over to %s/%s", name, backend, alternate.get("model"))
+            if payload is not None:
+                payload.setdefault("requested_model", payload.get("model"))
+                payload["backend"] = backend
+                if alternate.get("model"):
+                    payload["model"] = alternate["model"]
+            return backend
+    CIRCUIT_REJECTED.labels(breaker.name).inc()
+    raise CircuitOpenError(breaker.name, breaker.retry_after())
+
+
+def stats() -> dict:
+    return {name: breaker.stats() for name, breaker in sorted(_breakers.items())}
+
+
+class GuardedReverse(ReverseBase):
+    """包装共享后端实例：把每次请求（流式则为整个流）的结果记入后端熔断器，
+    并把在途数与成功请求的首 token / 完成耗时记入自动路由的延迟统计。"""
+
+    def __init__(self, backend: str, reverser: ReverseBase):
+        self.backend = backend
+        self.reverser = reverser
+        self.breaker = get(f"backend:{backend}")
+
+    async def set_dynamic_data(self, data: dict):
+        return
+
+    async def prepare_send_conversation(self):
+        return
+
+    async def close_client(self):
+        return
+
+    def stats(self) -> dict:
+        return self.reverser.stats()
+
+    async def send_conversation(self, text=None, payload=None):
+        self.breaker.before()
+        auto_router.begin(self.backend)
+        started = time.perf_counter()
+        try:
+            result = await self.reverser.send_conversation(payload=payload)
+        except asyncio.CancelledError:
+            self._settle(None, started)
+            raise
+        except Exception as e:
+            self._settle(outcome_of(e), started)
+            raise
+        if not hasattr(result, "__aiter__"):
+            self._settle(True, started)
+            return result
+        return _GuardedStream(self, result, started)
+
+    def _settle(self, outcome: Optional[bool], started: float, first: Optional[float] = None):
+        """一次请求结束：outcome 为 None（取消、客户端造成的错误）时只归还探测名额与在途计数。"""
+        elapsed = time.perf_counter() - started
+        if outcome:
+            auto_router.end(self.backend, ttft=None if first is None else first - started, completion=elapsed)
+        else:
+            auto_router.end(self.backend)
+        if outcome is None:
+            self.breaker.release()
+        else:
+            self.breaker.record(outcome, elapsed)
+
+
+class _GuardedStream:
+    """GuardedReverse 返回的流：迭代结束时记录结果。
+
+    被关闭、迭代中被取消或从未迭代就被丢弃（对冲落败、n > 1 出错）时同样结算，
+    不会一直占用 half-open 探测名额和自动路由的在途计数。
+    """
+
+    def __init__(self, guard: GuardedReverse, stream, started: float):
+        self._guard = guard
+        self._stream = stream
+        self._started = started
+        self._first: Optional[float] = None
+        self._settled = False
+
+    def _settle(self, outcome: Optional[bool]):
+        if not self._settled:
+            self._settled = True
+            self._guard._settle(outcome, self._started, self._first)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._settled:
+            raise StopAsyncIteration
+        try:
+            chunk = await self._stream.__anext__()
+        except StopAsyncIteration:
+            self._settle(True)
+            raise
+        except asyncio.CancelledError:
+            self._settle(None)
+            raise
+        except Exception as e:
+            self._settle(outcome_of(e))
+            raise
+        if self._first is None:
+            self._first = time.perf_counter()
+        return chunk
+
+    async def aclose(self):
+        if not self._settled:
+            self._settle(None)
+            # 被关闭（客户端断开 / 对冲落败）时显式关闭上游流，让后端立即停止生成
+            await self._stream.aclose()
+
+    def __del__(self):
+        # 没有被关闭就被丢弃：上游异步生成器由事件循环负责关闭，这里只结算计数
+        if not self._settled:
+            self._settle(None)
+
+
+def _state_samples():
+    for name, breaker in list(_breakers.items()):
+        yield (name,), _STATE_VALUES[breaker.state]
+
+
+GaugeCallback("chat2api_circuit_state", "Circuit breaker state (0 closed, 1 open, 2 half-open).", ("breaker",), _state_samples)
@@ -1,25 +1,18 @@
-import asyncio
 from typing import Optional
 
 # 使用仓库内模块化的 core 实现，彻底移除对根目录 copilot.py 的依赖
 from app.services import copilot_reverse as RootCopilotReverse
 from app.services.reverse_factory import get_reverser
 from app.services.reverse_base import ReverseBase
-
-
-# module-level shared proxy and lock (保留以便其他模块复用)
-_shared_proxy: Optional[RootCopilotReverse.CopilotReverse] = None
-_shared_lock = asyncio.Lock()
+from app.services.lifecycle import lifecycle
 
 
 async def get_shared_proxy() -> RootCopilotReverse.CopilotReverse:
-    """返回或创建一个共享的 CopilotReverse 实例（异步安全）。"""
-    global _shared_proxy
-    if _shared_proxy is None:
-        async with _shared_lock:
-            if _shared_proxy is None:
-                _shared_proxy = RootCopilotReverse.CopilotReverse()
-    return _shared_proxy
+    """返回共享的 CopilotReverse 实例（异步安全）。
+
+    实例由 lifecycle 统一持有，与 reverse_factory 服务请求的是同一个单例。
+    """
+    return await lifecycle.get("copilot")
 
 
 class AsyncCopilotAdapter:
@@ -1,4 +1,5 @@
 import asyncio
+import logging
 import os
 import json
 import random
@@ -7,14 +8,45 @@ import time
 from typing import Optional
 from .reverse_base import ReverseBase
 from playwright.async_api import expect
-from app.config.settings import get_user_data_dir
+from app.config.settings import get_setting
 from .browser_manager import BrowserManager
+from .circuit_breaker import outcome_of
+from .page_pool import PagePool, PageSlot
+from .copilot_sessions import SessionKeys, SessionStore, content_text
+from app.utils.metrics import MODE_SWITCH
+from app.utils import deadline, fixtures, tracing
 try:
-    from app.config.model_mode_map import get_mode_title_for_model
+    from app.config.model_mode_map import get_mode_title_for_model, known_mode_titles as _known_mode_titles
 except Exception:
     # optional module; fallback will use built-in mapping
     get_mode_title_for_model = None
 
+    def _known_mode_titles() -> set:
+        return set()
+
+logger = logging.getLogger(__name__)
+
+
+class CopilotPageState:
+    """与单个 Copilot 页面绑定的流式状态（每个页面槽位一份）。"""
+
+    def __init__(self):
+        self.text = ""
+        self.stream_queue: Optional[asyncio.Queue] = None
+        self.answer_event: Optional[asyncio.Event] = None
+        self.stream_mode = False
+        # 页面当前所处的聊天模式，用于跳过重复的模式切换
+        self.mode_title: Optional[str] = None
+        # 当前请求的 trace（websocket 回调不在请求的上下文中执行，需要显式持有）
+        self.trace: Optional[tracing.Trace] = None
+        # 已提交问题、尚未收到 done 帧：页面仍在生成
+        self.generating = False
+        # 当前请求的帧录制（fixture_recording 开启时，见 app/utils/fixtures）
+        self.recording: Optional[fixtures.Recording] = None
+        # 页面聊天当前持有的会话（见 copilot_sessions）；clean 表示页面处于空白的新聊天
+        self.session_key: Optional[str] = None
+        self.clean = False
+
 
 class CopilotReverse(ReverseBase):
     """精简并模块化的 Copilot 逆向代理核心。
@@ -30,50 +62,70 @@ class CopilotReverse(ReverseBase):
 
         # 使用与原始实现相同的默认聊天路径以确保页面结构一致
         self.TARGET_URL = "https://copilot.microsoft.com/chats/JLDP8MzTohjW4As65Vv9W"
+        self.STOP_BUTTON = 'button[data-testid="stop-button"]'
+        self.NEW_CHAT_URL = "https://copilot.microsoft.com/"
 
         self.data = None
         self.model = None
         self.question = None
 
-        # Playwright related state (page only; browser lifecycle is managed by BrowserManager)
-        self.page = None
+        # Playwright related state (pages live in the pool; browser lifecycle is managed by BrowserManager)
         self._browser_manager = None
-
-        # streaming buffer
-        self.ws_message_buffer = {"text": ""}
-        self.answer_event: Optional[asyncio.Event] = None
+        self._pool: Optional[PagePool] = None
         self._initialized = False
-        self._stream_mode = False
+        self._init_lock = asyncio.Lock()
+        # 客户端断开后在后台停止生成并复位页面的任务
+        self._aborts = set()
+        # 会话亲和：多轮对话固定在同一页面，后续轮次只发送新增消息
+        self._affinity = bool(get_setting("copilot_session_affinity", True))
+        self._sessions = SessionStore()
+
+    async def init(self):
+        """启动共享浏览器并创建页面池（由 lifecycle 在预热或首次使用时调用）。"""
+        async with self._init_lock:
+            # 并发的首次请求只有一个执行初始化，其余等待它完成
+            if self._initialized:
+                return
+            self._browser_manager = await BrowserManager.get_instance()
+            pool = PagePool("copilot", get_setting("copilot_pool_size", 1), self._create_page)
+            await pool.start()
+            self._pool = pool
+            self._initialized = True
+
+    async def _create_page(self, slot: PageSlot):
+        page = await self._browser_manager.new_page(label=f"copilot:{slot.slot_id}")
+        slot.state = CopilotPageState()
+        # attach websocket listener before navigating so the chat socket is captured
+        self._attach_ws_listener(page, slot.state)
+        await page.goto(self.TARGET_URL)
+        return page
 
     async def set_dynamic_data(self, data: dict):
         self.data = data or {}
         await self.set_model()
         if not self._initialized:
-            # initialize shared browser (singleton) and create a page for this Copilot instance
-            self._browser_manager = await BrowserManager.get_instance()
-            # create a page and navigate to target url
-            self.page = await self._browser_manager.new_page(self.TARGET_URL)
-            # attach websocket listener on the new page
-            self._attach_ws_listener()
-            self._initialized = True
-        # 尝试根据传入数据自动切换聊天模式（优先使用显式提供的 mode_title）
-        try:
-            mode_title = self.data.get("mode_title") if isinstance(self.data, dict) else None
-            if mode_title:
-                await self._select_mode_by_title(mode_title)
-            else:
-                mapped = self._map_model_to_title(self.model)
-                if mapped:
-                    await self._select_mode_by_title(mapped)
-        except Exception:
-            pass
+            await self.init()
 
     async def set_model(self):
         self.model = (self.data or {}).get("model", "copilot-chat")
 
     async def prepare_send_conversation(self):
+        self.question = self._build_question(self.data)
+        return self.question
+
+    def _build_transcript(self, messages: list) -> str:
+        """把若干条消息拼成一次发送的文本；只有一条 user 消息时原样发送。"""
+        if len(messages) == 1 and messages[0].get("role") == "user":
+            return content_text(messages[0].get("content"))
+        labels = {"system": "System", "user": "User", "assistant": "Assistant"}
+        return "\n\n".join(
+            f"[{labels.get(m.get('role'), str(m.get('role', '')).title())}]\n{content_text(m.get('content'))}"
+            for m in messages
+        )
+
+    def _build_question(self, data: dict) -> str:
         # 按 OpenAI 风格消息构造最终问题
-        messages = self.data.get("messages", []) if isinstance(self.data, dict) else []
+        messages = data.get("messages", []) if isinstance(data, dict) else []
         system = None
         user = None
         for m in messages:
@@ -86,96 +138,276 @@ class CopilotReverse(ReverseBase):
             user = ""
 
         if system:
-            self.question = f"[System]\n{system}\n\n[User]\n{user}"
-        else:
-            self.question = user
-
-        return self.question
+            return f"[System]\n{system}\n\n[User]\n{user}"
+        return user
 
     async def send_conversation(self, text: Optional[any] = None,payload:Optional[dict] = None):
-        await  self.set_dynamic_data(payload)
-        await self.prepare_send_conversation()
-        self._stream_mode = bool(self.data.get("stream", False))
+        # 共享实例会被并发请求复用：本次请求的状态只保存在局部变量和租到的页面槽位上，
+        # 不经过 self.data / self.model（首次请求在 init 中等待时，并发请求会覆盖它们）
+        data = payload or {}
+        model = data.get("model", "copilot-chat")
+        question = self._build_question(data)
+        if not self._initialized:
+            await self.init()
+        # 尝试根据传入数据自动切换聊天模式（优先使用显式提供的 mode_title）
+        mode_title = data.get("mode_title") or self._map_model_to_title(model)
+        keys = SessionKeys(data.get("messages") or [], data.get("session_id")) if self._affinity else None
 
-        if self._stream_mode:
+        if bool(data.get("stream", False)):
             async def stream_gen():
-                await self._send_and_start_streaming()
-                while True:
-                    chunk = await self._stream_queue.get()
-                    if chunk == "__DONE__":
-                        break
-                    # yield SSE formatted chunks
-                    async for s in self._convert_to_openai_stream_copilot_single(chunk):
-                        yield s
-                async for s in self._convert_to_openai_stream_copilot_single(None, done=True):
+                chat_id = f"chatcmpl-{''.join(random.choices(string.ascii_letters + string.digits, k=29))}"
+                slot = await self._lease(keys)
+                ok = None
+                try:
+                    turn = await self._prepare_slot(slot, keys, question)
+                    await self._ensure_mode(slot, mode_title)
+                    await self._send_and_start_streaming(slot, turn)
+                    stage = deadline.FIRST_TOKEN
+                    while True:
+                        chunk = await deadline.wait(slot.state.stream_queue.get(), stage)
+                        stage = deadline.COMPLETION
+                        if chunk == "__DONE__":
+                            break
+                        # yield SSE formatted chunks
+                        async for s in self._convert_to_openai_stream_copilot_single(chunk, model=model, default_id=chat_id):
+                            yield s
+                    self._commit_session(slot, keys)
+                    ok = True
+                except Exception as e:
+                    # 客户端造成的错误（如截止时间到期）按取消处理：停止页面上的生成，不计入页面熔断器
+                    ok = outcome_of(e)
+                    raise
+                finally:
+                    # 正常结束直接归还；客户端断开（取消 / aclose）时先停止页面上的生成
+                    self._release_or_abort(slot, ok)
+                async for s in self._convert_to_openai_stream_copilot_single(None, done=True, model=model, default_id=chat_id):
                     yield s
 
             return stream_gen()
 
-        else:
-            await self._send_and_wait_queue()
-            return {"question": self.question, "answer": self.ws_message_buffer.get("text", "")}
+        slot = await self._lease(keys)
+        ok = None
+        try:
+            turn = await self._prepare_slot(slot, keys, question)
+            await self._ensure_mode(slot, mode_title)
+            answer = await self._send_and_wait_queue(slot, turn)
+            self._commit_session(slot, keys)
+            ok = True
+        except Exception as e:
+            ok = outcome_of(e)
+            raise
+        finally:
+            self._release_or_abort(slot, ok)
+        return {"question": question, "answer": answer}
+
+    async def _lease(self, keys: Optional[SessionKeys] = None) -> PageSlot:
+        prefer = rank = None
+        if keys is not None:
+            # 已有会话优先回到持有它的页面；新会话优先使用空闲最久（或没有会话）的页面
+            slot_id = self._sessions.get(keys.lookup)
+            prefer = next((s for s in self._pool.slots if s.slot_id == slot_id), None)
+            rank = self._slot_rank
+        with tracing.span("copilot.lease", **self._pool.stats()):
+            return await deadline.wait(self._pool.acquire(prefer=prefer, rank=rank), deadline.LEASE)
+
+    def _slot_rank(self, slot: PageSlot):
+        last_used = self._sessions.last_used(slot.state.session_key)
+        return (0, 0.0) if last_used is None else (1, last_used)
+
+    async def _prepare_slot(self, slot: PageSlot, keys: Optional[SessionKeys], question: str) -> str:
+        """返回本次要在页面上发送的文本：命中会话时只发送新增轮次，否则在新聊天中发送完整历史。"""
+        if keys is None:
+            return question
+        state = slot.state
+        # 会话过期（TTL）后视为未命中，在新聊天中重新发送历史
+        if keys.lookup is not None and state.session_key == keys.lookup \
+                and self._sessions.get(keys.lookup) == slot.slot_id:
+            tracing.instant("copilot.session_hit")
+            self._sessions.put(keys.lookup, slot.slot_id)
+            return self._build_transcript(keys.new_turn)
+        # 没有历史的请求沿用页面当前聊天（与关闭会话亲和时相同），省去整页导航；
+        # 只有需要重放历史，或页面仍持有其他有效会话时才开新聊天
+        holds_other = state.session_key is not None and self._sessions.get(state.session_key) == slot.slot_id
+        if not state.clean and (keys.history or holds_other):
+            await self._new_chat(slot)
+        return self._build_transcript(keys.history + keys.new_turn)
+
+    def _commit_session(self, slot: PageSlot, keys: Optional[SessionKeys]):
+        if keys is None:
+            return
+        key = keys.after(slot.state.text)
+        slot.state.session_key = key
+        self._sessions.put(key, slot.slot_id)
+
+    async def _new_chat(self, slot: PageSlot):
+        with tracing.span("copilot.new_chat"):
+            await deadline.wait(slot.page.goto(self.NEW_CHAT_URL), deadline.SEND)
+        slot.state.clean = True
+        # 整页导航后不假定聊天模式仍然保留
+        slot.state.mode_title = None
+
+    def _release(self, slot: PageSlot, ok: Optional[bool] = None):
+        slot.state.trace = None
+        pool = self._pool
+        if pool is None:
+            # close() 已关闭页面池：在途生成器的 finally 不再归还
+            return
+        pool.release(slot, ok)
 
-    async def _init_browser_and_page(self):
-        # 浏览器初始化现在由 BrowserManager 管理；保留此方法以兼容历史调用
-        return
+    def _release_or_abort(self, slot: PageSlot, ok: Optional[bool] = None):
+        """同步调用（可在被取消的生成器 finally 中使用）：页面空闲则立即归还，否则后台中止后归还。
 
-    def _attach_ws_listener(self):
-        """Attach websocket frame listener to self.page (extracted from previous implementation)."""
-        if not self.page:
+        ok 为本次请求的结果（计入页面熔断器），None 表示被取消或客户端造成的错误（不计入）。
+        """
+        state = slot.state
+        state.stream_mode = False
+        if self._pool is None:
             return
+        if not state.generating:
+            if not self._needs_recycle(slot):
+                self._release(slot, ok)
+                return
+            task = asyncio.ensure_future(self._recycle(slot, ok))
+        else:
+            task = asyncio.ensure_future(self._abort(slot, ok))
+        self._aborts.add(task)
+        task.add_done_callback(self._aborts.discard)
+
+    async def _abort(self, slot: PageSlot, ok: Optional[bool] = None):
+        """点击停止按钮；若未等到 done 帧则重新加载页面，断开旧 websocket，避免残余帧串到下一个请求。"""
+        state = slot.state
+        state.trace = None
+        logger.info("copilot request abandoned, stopping generation on slot %s", slot.slot_id)
+        try:
+            try:
+                await slot.page.click(self.STOP_BUTTON, timeout=2000)
+                await asyncio.wait_for(state.answer_event.wait(), 3)
+            except Exception:
+                await slot.page.goto(self.TARGET_URL)
+                # 重新加载后页面回到默认模式
+                state.mode_title = None
+                state.clean = False
+        except Exception as e:
+            logger.warning("copilot abort failed on slot %s: %s", slot.slot_id, e)
+        finally:
+            state.generating = False
+            state.answer_event = None
+            state.stream_queue = None
+            if self._pool is not None:
+                self._pool.release(slot, ok)
+
+    def _needs_recycle(self, slot: PageSlot) -> bool:
+        """页面最近的遥测（见 BrowserManager.track_page）超过 copilot_recycle_heap_mb / copilot_recycle_dom_nodes 时需要回收。"""
+        if self._browser_manager is None:
+            return False
+        sample = self._browser_manager.page_telemetry(slot.page)
+        if not sample:
+            return False
+        heap_mb = get_setting("copilot_recycle_heap_mb")
+        dom_nodes = get_setting("copilot_recycle_dom_nodes")
+        return bool((heap_mb and sample.get("js_heap_used_bytes", 0) > heap_mb * 1024 * 1024)
+                    or (dom_nodes and sample.get("dom_nodes", 0) > dom_nodes))
+
+    async def _recycle(self, slot: PageSlot, ok: Optional[bool] = None):
+        """重新加载占用过多内存 / DOM 节点的页面后再归还；页面上的会话随之失效。"""
+        state = slot.state
+        state.trace = None
+        logger.info("copilot slot %s over telemetry limits, reloading page", slot.slot_id)
+        try:
+            await slot.page.goto(self.TARGET_URL)
+            state.mode_title = None
+            state.clean = False
+            state.session_key = None
+            # 旧的采样已不代表新页面，避免下次归还时重复回收
+            await self._browser_manager.sample_page(slot.page)
+        except Exception as e:
+            logger.warning("copilot recycle failed on slot %s: %s", slot.slot_id, e)
+        finally:
+            if self._pool is not None:
+                self._pool.release(slot, ok)
+
+    def _attach_ws_listener(self, page, state: CopilotPageState):
+        """Attach websocket frame listener to a pooled page; frames are routed into that page's state."""
 
         def on_ws(ws):
-            def handle_frame(frame):
-                try:
-                    data = json.loads(frame)
-                    if data.get("event") == "appendText":
-                        chunk = data.get("text", "")
-                        self.ws_message_buffer["text"] += chunk
-                        if hasattr(self, "_stream_queue") and self._stream_mode:
-                            try:
-                                self._stream_queue.put_nowait(chunk)
-                            except Exception:
-                                pass
-                    if data.get("event") == "done":
-                        if hasattr(self, "_stream_queue") and self._stream_mode:
-                            try:
-                                self._stream_queue.put_nowait("__DONE__")
-                            except Exception:
-                                pass
-                        if self.answer_event:
-                            self.answer_event.set()
-                except Exception:
-                    pass
-
-            ws.on("framereceived", handle_frame)
+            ws.on("framereceived", lambda frame: self._handle_frame(state, frame))
 
         try:
-            self.page.on("websocket", on_ws)
+            page.on("websocket", on_ws)
         except Exception:
             pass
-        # try to ensure page has navigated to target
+
+    def _handle_frame(self, state: CopilotPageState, frame):
+        """处理一帧 websocket 数据（也被 fixtures.replay_frames 用于离线回放）。"""
         try:
-            asyncio.create_task(self.page.goto(self.TARGET_URL))
+            if state.recording is not None:
+                state.recording.add(frame)
+            data = json.loads(frame)
+            if data.get("event") == "appendText":
+                chunk = data.get("text", "")
+                if state.trace is not None and not state.text:
+                    state.trace.instant("copilot.first_frame")
+                state.text += chunk
+                if state.stream_mode and state.stream_queue is not None:
+                    try:
+                        state.stream_queue.put_nowait(chunk)
+                    except Exception:
+                        pass
+            if data.get("event") == "done":
+                state.generating = False
+                if state.trace is not None:
+                    state.trace.instant("copilot.done", chars=len(state.text))
+                if state.recording is not None:
+                    state.recording.response = {"text": state.text}
+                    state.recording.save()
+                    state.recording = None
+                if state.stream_mode and state.stream_queue is not None:
+                    try:
+                        state.stream_queue.put_nowait("__DONE__")
+                    except Exception:
+                        pass
+                if state.answer_event:
+                    state.answer_event.set()
         except Exception:
             pass
 
-    async def _send_and_start_streaming(self):
-        self.answer_event = asyncio.Event()
-        self._stream_queue = asyncio.Queue()
-        self.ws_message_buffer["text"] = ""
-
-        await self.page.fill('textarea#userInput', self.question)
-        await self.page.click('button[data-testid="submit-button"]')
-
-    async def _send_and_wait_queue(self):
-        self.answer_event = asyncio.Event()
-        self._stream_queue = asyncio.Queue()
-        self.ws_message_buffer["text"] = ""
-
-        await self.page.fill('textarea#userInput', self.question)
-        await self.page.click('button[data-testid="submit-button"]')
-        await self.answer_event.wait()
+    def _reset_state(self, state: CopilotPageState, stream_mode: bool, question: Optional[str] = None):
+        state.answer_event = asyncio.Event()
+        state.stream_queue = asyncio.Queue()
+        state.stream_mode = stream_mode
+        state.text = ""
+        state.trace = tracing.current()
+        state.recording = fixtures.start("copilot", {"question": question, "stream": stream_mode},
+                                         mode=state.mode_title)
+
+    async def _submit(self, slot: PageSlot, question: str):
+        # 页面上的聊天即将改变：原会话失效，回答完成后由 _commit_session 重新登记
+        state = slot.state
+        self._sessions.discard(state.session_key)
+        state.session_key = None
+        state.clean = False
+        with tracing.span("copilot.fill", chars=len(question)):
+            await deadline.wait(slot.page.fill('textarea#userInput', question), deadline.SEND)
+        # 点击可能已生效但等待被截止时间打断：先标记为生成中，确保放弃时会停止/复位页面
+        slot.state.generating = True
+        with tracing.span("copilot.click"):
+            await deadline.wait(slot.page.click('button[data-testid="submit-button"]'), deadline.SEND)
+
+    async def _send_and_start_streaming(self, slot: PageSlot, question: str):
+        self._reset_state(slot.state, stream_mode=True, question=question)
+        await self._submit(slot, question)
+
+    async def _send_and_wait_queue(self, slot: PageSlot, question: str) -> str:
+        self._reset_state(slot.state, stream_mode=False, question=question)
+        await self._submit(slot, question)
+        with tracing.span("copilot.wait_done"):
+            try:
+                await deadline.wait(slot.state.answer_event.wait(), deadline.COMPLETION)
+            except deadline.DeadlineExceeded as e:
+                if not slot.state.text:
+                    e.stage = deadline.FIRST_TOKEN
+                raise
+        return slot.state.text
 
     async def _convert_to_openai_stream_copilot_single(self, text=None, done=False, model: str = "copilot-chat", default_id: Optional[str] = None, default_created: Optional[int] = None):
         chat_id = default_id or f"chatcmpl-{''.join(random.choices(string.ascii_letters + string.digits, k=29))}"
@@ -196,30 +428,53 @@ class CopilotReverse(ReverseBase):
             yield f"data: {json.dumps(base)}\n\n"
             yield "data: [DONE]\n\n"
 
+    async def _ensure_mode(self, slot: PageSlot, title: Optional[str]):
+        """切换槽位页面的聊天模式；页面已处于该模式时跳过 UI 操作。"""
+        if not title or slot.state.mode_title == title:
+            return
+        started = time.perf_counter()
+        ok = False
+        with tracing.span("copilot.mode_switch", mode=title) as sp:
+            try:
+                ok = await deadline.wait(
+                    self._select_mode_by_title(title, timeout=deadline.cap_ms(5000), page=slot.page),
+                    deadline.MODE_SWITCH,
+                )
+                if ok:
+                    slot.state.mode_title = title
+            except deadline.DeadlineExceeded:
+                raise
+            except Exception:
+                pass
+            sp.set(ok=ok)
+        # mode_title 可由客户端指定：只有已知的模式作为指标标签，其余归为 "other"，避免标签基数无界
+        label = title if title in _known_mode_titles() else "other"
+        MODE_SWITCH.labels(label, "ok" if ok else "failed").observe(time.perf_counter() - started)
+
     def _map_model_to_title(self, model_name: str):
         # 委托到配置模块进行映射
         return get_mode_title_for_model(model_name)
 
-    async def _select_mode_by_title(self, title: str, timeout: int = 5000) -> bool:
+    async def _select_mode_by_title(self, title: str, timeout: int = 5000, page=None) -> bool:
         """
         在页面中根据 title 切换聊天模式。
         返回 True 表示成功（或已处于目标模式），False 表示失败。
         """
-        if not title or not hasattr(self, "page") or self.page is None:
+        if not title or page is None:
             return False
 
         try:
-            print(f"[mode] try select mode: {title}")
-            switcher_button = self.page.locator('button[data-testid="chat-mode-switcher"]')
+            logger.debug("[mode] try select mode: %s", title)
+            switcher_button = page.locator('button[data-testid="chat-mode-switcher"]')
             await switcher_button.wait_for(state="visible", timeout=timeout)
 
             aria_expanded = await switcher_button.get_attribute("aria-expanded")
-            print(f"[mode] switcher aria-expanded={aria_expanded}")
+            logger.debug("[mode] switcher aria-expanded=%s", aria_expanded)
             if aria_expanded == "false":
                 await switcher_button.click()
                 await expect(switcher_button).to_have_attribute("aria-expanded", "true", timeout=timeout)
 
-            menu_container = self.page.locator('div[data-testid="composer-mode-menu"]')
+            menu_container = page.locator('div[data-testid="composer-mode-menu"]')
             await menu_container.wait_for(state="visible", timeout=2000)
 
             testid_map = {
@@ -230,20 +485,20 @@ class CopilotReverse(ReverseBase):
 
             target_testid = testid_map.get(title)
             if not target_testid:
-                print(f"[mode] no mapping for title: {title}")
+                logger.warning("[mode] no mapping for title: %s", title)
                 return False
 
-            mode_button = self.page.locator(f'button[data-testid="{target_testid}"]')
+            mode_button = page.locator(f'button[data-testid="{target_testid}"]')
             await mode_button.wait_for(state="visible", timeout=2000)
 
             aria_checked = await mode_button.get_attribute("aria-checked")
-            print(f"[mode] mode button aria-checked={aria_checked}")
+            logger.debug("[mode] mode button aria-checked=%s", aria_checked)
             if aria_checked == "true":
-                print(f"[mode] already selected: {title}")
+                logger.debug("[mode] already selected: %s", title)
                 return True
 
             await mode_button.click()
-            print(f"[mode] clicked mode button: {title}")
+            logger.info("[mode] clicked mode button: %s", title)
 
             try:
                 await expect(switcher_button).to_have_attribute("aria-expanded", "false", timeout=2000)
@@ -253,17 +508,28 @@ class CopilotReverse(ReverseBase):
             return True
 
         except Exception as e:
-            print(f"[mode] select error: {e}")
+            logger.warning("[mode] select error: %s", e)
             return False
 
+    def stats(self) -> dict:
+        if not self._pool:
+            return {}
+        info = {"pool": self._pool.stats()}
+        if self._browser_manager is not None:
+            pages = self._browser_manager.telemetry()["pools"].get("copilot")
+            if pages:
+                info["telemetry"] = pages
+        if self._affinity:
+            info["sessions"] = self._sessions.stats()
+        return info
+
     async def close_client(self):
-        # 关闭由 BrowserManager 管理的资源时建议调用 manager.close()（可选）
+        """关闭页面池（等待在途请求归还页面）。共享浏览器由 lifecycle 统一关闭。"""
+        pool, self._pool = self._pool, None
+        self._initialized = False
         try:
-            if self._browser_manager:
-                # Do not force-close shared browser here unless intended. If you want to close shared browser,
-                # uncomment the next line. For now we simply clear references.
-                # await self._browser_manager.close()
-                self._browser_manager = None
+            if pool:
+                await pool.close(drain_timeout=float(get_setting("drain_timeout", 10.0)))
         except Exception:
             pass
-
+        self._browser_manager = None
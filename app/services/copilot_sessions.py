@@ -0,0 +1,114 @@
+"""Copilot 会话亲和：把多轮对话固定到已持有该历史的页面上，后续轮次只发送新增消息。
+
+会话识别：
+- 客户端显式提供 session_id（请求体字段或 X-Session-Id 头）时直接使用
+- 否则对消息前缀做链式哈希：history = 最后一条 assistant 消息及其之前的全部消息，
+  本轮回答完成后登记 hash(history + 新消息 + 回答)，恰好等于下一轮请求的 history 哈希
+
+页面一次只持有一个会话（slot.state.session_key）；会话按 TTL 过期，新会话优先占用最久未使用的页面。
+"""
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+from app.config.settings import get_setting
+
+SESSION_HEADER = "X-Session-Id"
+
+DEFAULT_TTL = 1800.0
+DEFAULT_MAX_SESSIONS = 1024
+
+
+def content_text(content) -> str:
+    if isinstance(content, list):
+        return "".join(p.get("text", "") for p in content if isinstance(p, dict))
+    return "" if content is None else str(content)
+
+
+def chain_hash(messages: Iterable[dict], seed: bytes = b"") -> bytes:
+    digest = seed
+    for m in messages:
+        h = hashlib.blake2b(digest, digest_size=16)
+        h.update(str(m.get("role", "")).encode("utf-8"))
+        h.update(b"\x00")
+        # 客户端回传的 assistant 内容常被去掉首尾空白
+        h.update(content_text(m.get("content")).strip().encode("utf-8"))
+        digest = h.digest()
+    return digest
+
+
+def split_history(messages: List[dict]) -> Tuple[List[dict], List[dict]]:
+    """(history, new_turn)：history 截止到最后一条 assistant 消息（不含之后的内容）。"""
+    for i in range(len(messages) - 1, -1, -1):
+        if messages[i].get("role") == "assistant":
+            return messages[: i + 1], messages[i + 1:]
+    return [], list(messages)
+
+
+class SessionKeys:
+    """一次请求的会话键：lookup 用于查找已有会话，after(answer) 用于登记本轮之后的会话。"""
+
+    __slots__ = ("explicit", "lookup", "history", "new_turn", "_messages")
+
+    def __init__(self, messages: List[dict], session_id: Optional[str] = None):
+        messages = [m for m in messages or () if isinstance(m, dict)]
+        self.history, self.new_turn = split_history(messages)
+        self._messages = messages
+        self.explicit = bool(session_id)
+        if self.explicit:
+            self.lookup: Optional[str] = f"id:{session_id}"
+        else:
+            self.lookup = chain_hash(self.history).hex() if self.history else None
+
+    def after(self, answer: str) -> str:
+        if self.explicit:
+            return self.lookup
+        return chain_hash(self._messages + [{"role": "assistant", "content": answer}]).hex()
+
+
+class SessionStore:
+    """session key -> 页面槽位 id，LRU + TTL。只记录映射；页面是否仍持有该会话由 slot.state 判断。"""
+
+    def __init__(self, ttl: Optional[float] = None, max_sessions: Optional[int] = None):
+        self.ttl = float(ttl if ttl is not None else get_setting("copilot_session_ttl", DEFAULT_TTL))
+        self.max_sessions = int(max_sessions or get_setting("copilot_session_max", DEFAULT_MAX_SESSIONS))
+        self._entries: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+
+    def _expire(self, now: float):
+        while self._entries:
+            key, (_, last_used) = next(iter(self._entries.items()))
+            if now - last_used <= self.ttl:
+                break
+            self._entries.popitem(last=False)
+
+    def get(self, key: Optional[str]) -> Optional[int]:
+        if key is None:
+            return None
+        self._expire(time.monotonic())
+        entry = self._entries.get(key)
+        return entry[0] if entry else None
+
+    def put(self, key: str, slot_id: int):
+        now = time.monotonic()
+        self._entries[key] = (slot_id, now)
+        self._entries.move_to_end(key)
+        self._expire(now)
+        while len(self._entries) > self.max_sessions:
+            self._entries.popitem(last=False)
+
+    def discard(self, key: Optional[str]):
+        if key is not None:
+            self._entries.pop(key, None)
+
+    def last_used(self, key: Optional[str]) -> Optional[float]:
+        """会话最近使用时间；已过期或不存在时返回 None。"""
+        if key is None:
+            return None
+        self._expire(time.monotonic())
+        entry = self._entries.get(key)
+        return entry[1] if entry else None
+
+    def stats(self) -> dict:
+        self._expire(time.monotonic())
+        return {"sessions": len(self._entries), "ttl": self.ttl}
@@ -0,0 +1,124 @@
+"""n > 1：同一个请求的 n 个生成并发运行在不同的页面（账号）上，耗时约等于一次调用。
+
+- 准入：n 不超过 config.json 的 max_choices（默认 4），且对带页面池的后端不超过池大小
+  （超出的生成只能排队，best-of-N 就不再是一次调用的耗时）；超出时路由返回 400
+- 非流式：返回全部结果（按 choice 下标排列）
+- 流式：各生成的块按到达顺序交错输出，choices[].index 改写为各自的 choice 下标，id 统一为同一个；
+  各生成自己的 [DONE] 被合并为最后一个；任一生成出错时取消其余生成并抛出该异常
+"""
+import asyncio
+import json
+import random
+import string
+from typing import List, Optional
+
+from app.config.settings import get_setting
+from .reverse_base import ReverseBase
+
+DEFAULT_MAX_CHOICES = 4
+# 合并队列上限：客户端读取慢时让各生成的读取暂停，而不是在内存中无限堆积
+_QUEUE_SIZE = 64
+
+
+class ChoicesRejected(ValueError):
+    def __init__(self, n, limit: int):
+        super().__init__(f"n must be an integer between 1 and {limit}, got {n!r}")
+        self.limit = limit
+
+
+def choice_limit(reverser: Optional[ReverseBase]) -> int:
+    """reverser 为 None 时只检查 max_choices（后端尚未获取时的预检）。"""
+    limit = int(get_setting("max_choices", DEFAULT_MAX_CHOICES))
+    pool = ((reverser.stats() if reverser is not None else None) or {}).get("pool") or {}
+    if pool.get("size"):
+        limit = min(limit, int(pool["size"]))
+    return max(1, limit)
+
+
+def admit(reverser: Optional[ReverseBase], payload: dict) -> int:
+    """返回请求的 n（未指定时为 1）；不合法或超过准入上限时抛出 ChoicesRejected。"""
+    n = payload.get("n")
+    if n is None or n == 1:
+        return 1
+    limit = choice_limit(reverser)
+    if isinstance(n, bool) or not isinstance(n, int) or not 1 <= n <= limit:
+        raise ChoicesRejected(n, limit)
+    return n
+
+
+async def _start_all(reverser: ReverseBase, payload: dict, n: int) -> list:
+    single = dict(payload, n=1)
+    tasks = [asyncio.ensure_future(reverser.send_conversation(payload=single)) for _ in range(n)]
+    try:
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        # 已经开始的流也要关闭，让后端归还页面
+        for result in results:
+            if hasattr(result, "aclose"):
+                await result.aclose()
+        raise
+
+
+async def complete_choices(reverser: ReverseBase, payload: dict, n: int) -> List[dict]:
+    """非流式：并发运行 n 个生成，按 choice 下标返回结果。"""
+    return await _start_all(reverser, payload, n)
+
+
+async def stream_choices(reverser: ReverseBase, payload: dict, n: int):
+    """流式：并发启动 n 个生成，返回交错输出的 SSE 流。"""
+    streams = await _start_all(reverser, payload, n)
+    chat_id = "chatcmpl-" + "".join(random.choices(string.ascii_letters + string.digits, k=29))
+    return _interleave(streams, chat_id)
+
+
+def _relabel(chunk: str, index: int, chat_id: str) -> str:
+    if not chunk.startswith("data: {"):
+        return chunk
+    try:
+        obj = json.loads(chunk[6:])
+    except ValueError:
+        return chunk
+    if "choices" not in obj:
+        return chunk
+    obj["id"] = chat_id
+    for choice in obj["choices"]:
+        choice["index"] = index
+    return f"data: {json.dumps(obj)}\n\n"
+
+
+async def _interleave(streams: list, chat_id: str):
+    queue: asyncio.Queue = asyncio.Queue(_QUEUE_SIZE)
+
+    async def pump(index: int, stream):
+        try:
+            async for chunk in stream:
+                await queue.put((index, chunk))
+        except Exception as e:
+            await queue.put((index, e))
+            return
+        await queue.put((index, None))
+
+    tasks = [asyncio.ensure_future(pump(i, s)) for i, s in enumerate(streams)]
+    remaining = len(streams)
+    try:
+        while remaining:
+            index, chunk = await queue.get()
+            if chunk is None:
+                remaining -= 1
+            elif isinstance(chunk, Exception):
+                raise chunk
+            elif not chunk.startswith("data: [DONE]"):
+                yield _relabel(chunk, index, chat_id)
+        yield "data: [DONE]\n\n"
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for stream in streams:
+            try:
+                await stream.aclose()
+            except Exception:
+                pass
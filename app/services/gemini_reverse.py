@@ -1,5 +1,6 @@
 import asyncio
 import json
+import logging
 import random
 import string
 import time
@@ -7,6 +8,10 @@ from typing import Optional, AsyncGenerator
 
 from app.services.browser_manager import BrowserManager
 from app.services.reverse_base import ReverseBase
+from app.utils import deadline
+from app.utils.log import LazyJson, LazyText
+
+logger = logging.getLogger(__name__)
 
 
 class GeminiReverse(ReverseBase):
@@ -109,16 +114,18 @@ class GeminiReverse(ReverseBase):
 
         while True:
             try:
-                chunk = await asyncio.wait_for(self._stream_queue.get(), timeout=30.0)
+                chunk = await deadline.wait(self._stream_queue.get(), deadline.COMPLETION, default=30.0)
                 if chunk == "__DONE__":
                     break
                 # Convert to OpenAI streaming format
                 async for stream_chunk in self._convert_to_openai_stream(chunk):
                     yield stream_chunk
+            except deadline.DeadlineExceeded:
+                raise
             except asyncio.TimeoutError:
                 break
             except Exception as e:
-                print(f"[gemini_reverse] Stream error: {e}")
+                logger.warning("[gemini_reverse] Stream error: %s", e)
                 break
 
         # Send final done chunk
@@ -137,9 +144,11 @@ class GeminiReverse(ReverseBase):
 
         # Wait for response with timeout
         try:
-            await asyncio.wait_for(self.answer_event.wait(), timeout=60.0)
+            await deadline.wait(self.answer_event.wait(), deadline.COMPLETION, default=60.0)
+        except deadline.DeadlineExceeded:
+            raise
         except asyncio.TimeoutError:
-            print("[gemini_reverse] Response timeout")
+            logger.warning("[gemini_reverse] Response timeout")
 
     async def _send_message_and_start_streaming(self, message_text: str):
         """Send message and prepare for streaming."""
@@ -177,7 +186,7 @@ class GeminiReverse(ReverseBase):
                         "(el, val) => el.setAttribute('data-value', val)", message_text
                     )
             except Exception as e:
-                print(f"[gemini_reverse] Warning: Could not set data-value: {e}")
+                logger.warning("[gemini_reverse] Could not set data-value: %s", e)
 
             # Wait briefly for UI to update
             await asyncio.sleep(1)
@@ -198,27 +207,27 @@ class GeminiReverse(ReverseBase):
                     }
                 """)
                 if submit_result:
-                    print("[gemini_reverse] Message submitted successfully via JS (aria-disabled)")
+                    logger.info("[gemini_reverse] Message submitted successfully via JS (aria-disabled)")
                     return True
                 else:
-                    print("[gemini_reverse] Submit button not found or aria-disabled != false")
+                    logger.warning("[gemini_reverse] Submit button not found or aria-disabled != false")
             except Exception as e:
-                print(f"[gemini_reverse] JS submit failed: {e}")
+                logger.warning("[gemini_reverse] JS submit failed: %s", e)
 
             # ---- fallback: Playwright locator 点击 aria-disabled="false" 的按钮 ----
             try:
                 submit_button = self.page.locator('button[type="submit"][aria-disabled="false"]')
                 if await submit_button.is_visible():
                     await submit_button.click()
-                    print("[gemini_reverse] Message submitted via locator (aria-disabled check)")
+                    logger.info("[gemini_reverse] Message submitted via locator (aria-disabled check)")
                     return True
             except Exception as e:
-                print(f"[gemini_reverse] Direct click submit failed: {e}")
+                logger.warning("[gemini_reverse] Direct click submit failed: %s", e)
 
             return False
 
         except Exception as e:
-            print(f"[gemini_reverse] Error sending message: {e}")
+            logger.error("[gemini_reverse] Error sending message: %s", e)
             return False
 
 
@@ -235,11 +244,12 @@ class GeminiReverse(ReverseBase):
 
                     # 请求头
                     headers = request.headers
-                    print("[gemini_reverse] Request headers:", headers)
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("[gemini_reverse] Request headers: %s", LazyJson(headers))
                     self.headers=headers
                     # Cookie（Playwright 会把 Cookie 放在 header 中或者用 cookies API）
                     cookies = await self.page.context.cookies(request.url)
-                    print("[gemini_reverse] Cookies:", cookies)
+                    logger.debug("[gemini_reverse] Captured %d cookies", len(cookies))
                     self.cookies = cookies
                     # 获取响应内容
                     body = await response.text()
@@ -266,10 +276,10 @@ class GeminiReverse(ReverseBase):
                         if self.answer_event:
                             self.answer_event.set()
 
-                        print(f"[gemini_reverse] Response received: {answer_text[:100]}...")
+                        logger.debug("[gemini_reverse] Response received: %s", LazyText(answer_text, 100))
 
                 except Exception as e:
-                    print(f"[gemini_reverse] Error processing response: {e}")
+                    logger.warning("[gemini_reverse] Error processing response: %s", e)
 
         # Attach response listener
         self.page.on("response", handle_response)
@@ -378,8 +388,16 @@ class GeminiReverse(ReverseBase):
     async def close_client(self):
         """Clean up resources."""
         try:
-            # Clear references without closing shared browser
-            self.page = None
+            # Close our own page but not the shared browser (lifecycle closes it)
+            page, self.page = self.page, None
+            if page is not None:
+                lock = getattr(self, "lock", None)
+                if lock is not None:
+                    # wait for an in-flight checksum evaluate to finish before closing the page
+                    async with lock:
+                        await page.close()
+                else:
+                    await page.close()
             self._browser_manager = None
             self._initialized = False
 
@@ -390,7 +408,7 @@ class GeminiReverse(ReverseBase):
                 self._stream_queue = None
 
         except Exception as e:
-            print(f"[gemini_reverse] Error during cleanup: {e}")
+            logger.warning("[gemini_reverse] Error during cleanup: %s", e)
 
 
 # Test/demo code
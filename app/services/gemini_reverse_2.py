@@ -1,15 +1,97 @@
 import hashlib
 import json
+import logging
+import time
 
 import aiohttp
-import httpx
 import sys
 import asyncio
 from app.services.browser_manager import BrowserManager
 from app.services.gemini_reverse import GeminiReverse
+from app.services.reverse_base import UpstreamError
 from typing import List, Optional, Union
 
 from app.utils.JSObfuscatedProcessor import JSObfuscatedProcessor
+from app.config.settings import get_setting
+from app.services import gemini_snapshot, model_router
+from app.utils.compaction import Compactor, system_tokens
+from app.utils.metrics import COMPACTION, UPSTREAM_LATENCY, UPSTREAM_RESPONSES, WAIT_TIME, WARM_STARTS
+from app.utils import deadline, fixtures, tracing
+from app.utils.log import LazyJson, LazyText, sampled as log_sampled
+
+_LOCK_WAIT = WAIT_TIME.labels("lock:gemini")
+
+logger = logging.getLogger(__name__)
+
+# 需要改写的 m=_b 包所在的路由
+_BUNDLE_ROUTE = "**://www.gstatic.com/**"
+
+# 生成配置数组（GenerationConfig 的 JSPB 表示，下标 = 字段号 - 1）中各参数的位置
+_STOP_INDEX = 1
+_MAX_TOKENS_INDEX = 3
+_TEMPERATURE_INDEX = 4
+_TOP_P_INDEX = 5
+_TOP_K_INDEX = 6
+_THINKING_INDEX = 16
+
+# AI Studio 网页默认值；请求与 model_routes 的 defaults 都未指定时使用
+DEFAULT_GENERATION = {"max_tokens": 65536, "temperature": 1, "top_p": 0.95, "top_k": 64, "thinking": True}
+MAX_STOP_SEQUENCES = 5
+# OpenAI reasoning_effort -> thinking（False 关闭，整数为思考 token 上限，True 为动态）
+REASONING_EFFORT = {"none": False, "minimal": False, "low": 1024, "medium": 8192, "high": True}
+
+
+def _number(value, low, high, integer=False):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    value = min(high, max(low, value))
+    return int(value) if integer else value
+
+
+def generation_params(payload: Optional[dict], model: str) -> dict:
+    """合并生成参数：请求体 > model_routes 中该模型的 defaults > DEFAULT_GENERATION。
+
+    支持 max_tokens（或 max_completion_tokens）、temperature、top_p、stop，以及 thinking
+    （true 动态、false 关闭、整数为思考 token 上限）或 OpenAI 的 reasoning_effort。
+    类型不合法的值被忽略，超出范围的值被截断到合法范围。
+    """
+    payload = payload or {}
+    merged = dict(DEFAULT_GENERATION)
+    merged.update(model_router.resolve(model).defaults)
+    requested = {key: payload.get(key) for key in ("max_tokens", "temperature", "top_p", "stop", "thinking")}
+    if requested["max_tokens"] is None:
+        requested["max_tokens"] = payload.get("max_completion_tokens")
+    if requested["thinking"] is None and payload.get("reasoning_effort") in REASONING_EFFORT:
+        requested["thinking"] = REASONING_EFFORT[payload["reasoning_effort"]]
+    merged.update({key: value for key, value in requested.items() if value is not None})
+
+    params = {
+        "max_tokens": _number(merged["max_tokens"], 1, DEFAULT_GENERATION["max_tokens"], integer=True),
+        "temperature": _number(merged["temperature"], 0, 2),
+        "top_p": _number(merged["top_p"], 0, 1),
+        "top_k": merged["top_k"],
+        "stop": None,
+        "thinking": merged["thinking"] if isinstance(merged["thinking"], (bool, int)) else True,
+    }
+    for key in ("max_tokens", "temperature", "top_p"):
+        if params[key] is None:
+            logger.debug("ignoring invalid %s=%r", key, merged[key])
+            params[key] = DEFAULT_GENERATION[key]
+    stop = merged.get("stop")
+    if isinstance(stop, str):
+        stop = [stop]
+    if isinstance(stop, list):
+        params["stop"] = [s for s in stop if isinstance(s, str) and s][:MAX_STOP_SEQUENCES] or None
+    return params
+
+
+def _thinking_config(thinking) -> list:
+    """[include_thoughts, thinking_budget]：-1 为动态预算，0 为关闭思考。"""
+    if thinking is True:
+        return [1, -1]
+    if thinking is False or thinking == 0:
+        return [0, 0]
+    return [1, max(-1, int(thinking))]
 
 
 class ConversationBuilder:
@@ -18,7 +100,8 @@ class ConversationBuilder:
             model: str,
             conversations: List[dict],
             system_prompt: str,
-            checksum: Optional[Union[str, int]] = None
+            checksum: Optional[Union[str, int]] = None,
+            generation: Optional[dict] = None
     ):
         """
         :param model: 模型名，比如 "models/gemini-2.5-pro"
@@ -30,11 +113,25 @@ class ConversationBuilder:
             ]
         :param system_prompt: 系统提示词，例如 "系统prompt"
         :param checksum: 对话list的校验值，可以是 None / str / int
+        :param generation: generation_params() 的结果；None 时使用 DEFAULT_GENERATION
         """
         self.model = model
         self.conversations = conversations
         self.system_prompt = system_prompt
         self.checksum = checksum
+        self.generation = generation or dict(DEFAULT_GENERATION, stop=None)
+
+    def generation_config(self) -> list:
+        g = self.generation
+        config = [None] * (_THINKING_INDEX + 1)
+        config[_STOP_INDEX] = g.get("stop")
+        config[_MAX_TOKENS_INDEX] = g["max_tokens"]
+        config[_TEMPERATURE_INDEX] = g["temperature"]
+        config[_TOP_P_INDEX] = g["top_p"]
+        config[_TOP_K_INDEX] = g["top_k"]
+        config[13] = 1  # 未知（固定值）
+        config[_THINKING_INDEX] = _thinking_config(g["thinking"])
+        return config
 
     def build(self):
         """构造最终的 data 结构"""
@@ -52,25 +149,7 @@ class ConversationBuilder:
                 [None, None, 9, 5],
                 [None, None, 10, 5]
             ],
-            [  # ai 生成的配置 list（固定值）
-                None,
-                None,
-                None,
-                65536,
-                1,
-                0.95,
-                64,
-                None,
-                None,
-                None,
-                None,
-                None,
-                None,
-                1,
-                None,
-                None,
-                [1, -1]
-            ],
+            self.generation_config(),  # 生成配置：stop / max_tokens / temperature / top_p / top_k / thinking
             self.checksum,  # 对话 list 的校验值
 
             [  # 系统提示词
@@ -90,6 +169,12 @@ class ConversationBuilder:
         ]
 
 
+def _log_bootstrap_failure(task: asyncio.Task):
+    # 所有等待者都已超时时，引导任务的异常只在这里取出并记录
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("gemini bootstrap failed: %s", task.exception())
+
+
 class GeminiReverse2(GeminiReverse):
     """Complete Gemini reverse implementation following the same pattern as CopilotReverse."""
 
@@ -103,11 +188,31 @@ class GeminiReverse2(GeminiReverse):
         self.digest = None
         self.captured_js_vars = None
         self.lock= asyncio.Lock()
+        # 长对话按模型的 token 预算压缩（切点缓存在实例上，跨请求复用）
+        self._compactor = Compactor(family="gemini")
+        # 上游 HTTP 客户端（离线回放时替换为 fixtures.ReplaySession）
+        self._http_session = aiohttp.ClientSession
+        # 本页面加载的改写后 m=_b 包 (URL, 代码)，用于保存热启动快照
+        self._bundle = None
+        self._route_handler = None
+        self._bootstrap_task: Optional[asyncio.Task] = None
 
     async def init(self):
+        # 引导（包括凭据失效后的重新引导）只运行一个任务，由 lifecycle 预热与并发请求共享；
+        # shield：等待者超时或断开不会中断引导，下一个请求直接复用其结果
+        if not self._initialized:
+            if self._bootstrap_task is None or self._bootstrap_task.done():
+                self._bootstrap_task = asyncio.ensure_future(self._bootstrap())
+                self._bootstrap_task.add_done_callback(_log_bootstrap_failure)
+            await asyncio.shield(self._bootstrap_task)
+
+    async def _bootstrap(self):
         if not self._initialized:
             self._browser_manager = await BrowserManager.get_instance()
             context = await self._browser_manager.new_context()
+            # 有效的热启动快照：直接提供改写好的 m=_b 包，并跳过 "你好" 引导对话
+            snapshot = gemini_snapshot.load()
+            bundle_served = asyncio.Event()
 
             # ******************* 核心修改部分 *******************
             async def handle_route(route, request):
@@ -116,12 +221,20 @@ class GeminiReverse2(GeminiReverse):
                 try:
                     # 我们只关心目标JS文件
                     if "gstatic.com/_/mss/boq-makersuite/_/js" in url and url.endswith("m=_b"):
-                        print(f"[DEBUG] Matched target JS for modification: {url}")
+                        logger.debug("Matched target JS for modification: %s", url)
+
+                        if snapshot is not None and snapshot.matches_bundle(url):
+                            self.captured_js_vars = snapshot.captured_js_vars
+                            self._bundle = (url, snapshot.bundle_code())
+                            bundle_served.set()
+                            await route.fulfill(status=200, content_type="text/javascript; charset=utf-8",
+                                                body=self._bundle[1])
+                            return
 
                         # 1. 继续原始请求，获取真实的响应
                         response = await route.fetch()
                         original_js_code = await response.text()
-                        print(f"[DEBUG] Fetched original JS, size: {len(original_js_code)} bytes.")
+                        logger.debug("Fetched original JS, size: %d bytes", len(original_js_code))
 
                         # 2. 使用处理器在内存中修改JS代码
                         js_processor = JSObfuscatedProcessor()
@@ -130,9 +243,12 @@ class GeminiReverse2(GeminiReverse):
 
                         # 3. 如果修改成功...
                         if modified_code and captured_data:
-                            print(f"[SUCCESS] JS code modified. Captured vars: {captured_data}")
+                            logger.info("JS code modified. Captured vars: %s", captured_data)
+                            fixtures.record_bundle(url, original_js_code, captured_data)
                             # 将捕获的变量名存储在类实例中，供后续使用
                             self.captured_js_vars = captured_data
+                            self._bundle = (url, modified_code)
+                            bundle_served.set()
 
                             # 用修改后的代码完成请求
                             await route.fulfill(
@@ -144,8 +260,7 @@ class GeminiReverse2(GeminiReverse):
 
                         # 4. 如果修改失败...
                         else:
-                            print(
-                                "[WARNING] JS processing failed. Serving original content to avoid breaking the page.")
+                            logger.warning("JS processing failed. Serving original content to avoid breaking the page.")
                             # 仍然用原始代码完成请求，确保页面能加载
                             await route.fulfill(
                                 status=response.status,
@@ -155,35 +270,81 @@ class GeminiReverse2(GeminiReverse):
                             return
 
                 except Exception as e:
-                    print(f"[ERROR] handle_route exception: {e}")
+                    logger.error("handle_route exception: %s", e)
 
                 # 对于所有其他不匹配的请求，正常继续
                 await route.continue_()
 
             # ******************* 修改结束 *******************
 
-            await context.route("**://www.gstatic.com/**", handle_route)
+            # 重新引导（凭据失效后）时替换上一次注册的路由并关闭旧页面
+            if self._route_handler is not None:
+                await context.unroute(_BUNDLE_ROUTE, self._route_handler)
+            self._route_handler = handle_route
+            await context.route(_BUNDLE_ROUTE, handle_route)
+            if self.page is not None:
+                old_page, self.page = self.page, None
+                try:
+                    await old_page.close()
+                except Exception as e:
+                    logger.debug("closing previous gemini page failed: %s", e)
+
+            if snapshot is not None:
+                try:
+                    await context.add_cookies(snapshot.cookies)
+                except Exception as e:
+                    logger.warning("failed to restore snapshot cookies: %s", e)
 
             self.page = await context.new_page()
+            await self._browser_manager.track_page(self.page, "gemini")
             await self.page.goto(self.TARGET_URL)
 
             await self._setup_response_monitoring()
-            await super().send_conversation('你好')
+            if snapshot is not None and await self._warm_start(snapshot, bundle_served):
+                WARM_STARTS.labels("gemini", "hit").inc()
+                logger.info("gemini warm-started from snapshot saved at %s",
+                            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(snapshot.saved_at)))
+            else:
+                await super().send_conversation('你好')
+                await self._save_snapshot()
             self._initialized = True
 
-            # 示例：检查捕获到的变量
+            # 检查捕获到的变量
             if self.captured_js_vars:
-                print("\n--- 动态捕获的JS变量可供使用 ---")
-                print(self.captured_js_vars)
-                # 在这里，您可以构建并执行您的eval脚本
+                logger.info("动态捕获的JS变量可供使用: %s", self.captured_js_vars)
             else:
-                print("\n--- 未能捕获JS变量 ---")
+                logger.warning("未能捕获JS变量")
+
+    async def _warm_start(self, snapshot: "gemini_snapshot.Snapshot", bundle_served: asyncio.Event) -> bool:
+        """页面加载了快照中的包且校验函数就绪时，使用快照的请求头与 cookie；否则返回 False（走完整引导）。"""
+        timeout = gemini_snapshot.ready_timeout()
+        try:
+            await asyncio.wait_for(bundle_served.wait(), timeout)
+            if not snapshot.matches_bundle(self._bundle[0]):
+                raise ValueError(f"page loaded a different bundle {self._bundle[0]}")
+            func = f"MY_{snapshot.captured_js_vars['func_name'].upper()}"
+            await self.page.wait_for_function(f"typeof window.{func} === 'function'", timeout=timeout * 1000)
+        except Exception as e:
+            logger.info("gemini snapshot not usable, running full bootstrap: %s", str(e) or e.__class__.__name__)
+            WARM_STARTS.labels("gemini", "stale").inc()
+            return False
+        self.headers = dict(snapshot.headers)
+        self.cookies = list(snapshot.cookies)
+        return True
+
+    async def _save_snapshot(self):
+        if not (gemini_snapshot.enabled() and self.captured_js_vars and self._bundle and self.headers and self.cookies):
+            return
+        await asyncio.get_running_loop().run_in_executor(
+            None, gemini_snapshot.save, self.captured_js_vars, self._bundle[0], self._bundle[1],
+            dict(self.headers), list(self.cookies))
 
     async def set_dynamic_data(self, data: dict):
         self.data = data or {}
         await self.set_model()
         if not self._initialized:
-            await self.init()
+            with tracing.span("gemini.bootstrap"):
+                await deadline.wait(self.init(), deadline.LEASE)
 
 
     async def set_model(self):
@@ -223,51 +384,113 @@ class GeminiReverse2(GeminiReverse):
             #         "user"
             #     ])
 
-        self.conversations = conversations
+        self.conversations = self._compact(conversations, system_prompt)
         self.system_prompt = system_prompt
 
         await self.crypto_conversation()
 
+    def _compact(self, conversations: List[dict], system_prompt: Optional[str]) -> List[dict]:
+        """按 gemini_token_budgets[model] 压缩历史；未配置预算或关闭 gemini_compaction 时原样返回。"""
+        budget = (get_setting("gemini_token_budgets", {}) or {}).get(self.model)
+        if not budget or not get_setting("gemini_compaction", True):
+            return conversations
+        budget = int(budget) - system_tokens(system_prompt, "gemini")
+        with tracing.span("gemini.compact", messages=len(conversations)) as sp:
+            compacted, info = self._compactor.compact(conversations, budget)
+            sp.set(**info)
+        for action in ("dropped", "truncated", "deduplicated"):
+            if info.get(action):
+                COMPACTION.labels("gemini", action).inc(info[action])
+        if info.get("tokens_after") != info.get("tokens_before"):
+            logger.info("compacted gemini prompt", extra={"fields": info})
+        return compacted
+
     async def send_conversation(self, text: Optional[any] = None,payload:Optional[dict] = None):
-        print(f'send_conversation| payload:{json.dumps(payload,indent=2)}')
-        async with self.lock:
+        if logger.isEnabledFor(logging.DEBUG) and log_sampled():
+            logger.debug("send_conversation payload=%s", LazyJson(payload))
+        wait_started = time.perf_counter()
+        with tracing.span("gemini.lock_wait"):
+            await deadline.wait(self.lock.acquire(), deadline.LEASE)
+        try:
+            _LOCK_WAIT.observe(time.perf_counter() - wait_started)
             await self.set_dynamic_data(payload)
-            await self.prepare_send_conversation()
-            body = ConversationBuilder(self.model, self.conversations, self.system_prompt, self.digest).build()
+            with tracing.span("gemini.prepare"):
+                await deadline.wait(self.prepare_send_conversation(), deadline.SEND)
+            body = ConversationBuilder(self.model, self.conversations, self.system_prompt, self.digest,
+                                       generation_params(self.data, self.model)).build()
             stream=bool(self.data.get("stream", False))
-        print(json.dumps(body, indent=4))
-        cookie_dict = {c["name"]: c["value"] for c in self.cookies}
-        self.headers.update({
-            "x-browser-channel": "stable",
-            "x-browser-year": "2025",
-            "x-browser-validation": "XPdmRdCCj2OkELQ2uovjJFk6aKA=",
-            "x-browser-copyright": "Copyright 2025 Google LLC. All rights reserved."
-        })
-        async with aiohttp.ClientSession(headers=self.headers) as session:
-            async with session.post(
-                    self.request_url,
-                    json=body,  # 把 list/dict 转成 JSON 字符串
-                    headers=self.headers,
-
-                    timeout=aiohttp.ClientTimeout(total=30)
-            ) as response:
-                text = await response.text()
-                print(text)
+            # 在锁内复制凭据：锁外的上游请求期间，重新引导可能替换 self.headers / self.cookies
+            cookie_dict = {c["name"]: c["value"] for c in self.cookies}
+            headers = dict(self.headers, **{
+                "x-browser-channel": "stable",
+                "x-browser-year": "2025",
+                "x-browser-validation": "XPdmRdCCj2OkELQ2uovjJFk6aKA=",
+                "x-browser-copyright": "Copyright 2025 Google LLC. All rights reserved."
+            })
+        finally:
+            self.lock.release()
+        if logger.isEnabledFor(logging.DEBUG) and log_sampled():
+            logger.debug("upstream body=%s", LazyJson(body))
+        upstream_started = time.perf_counter()
+        async with self._http_session(headers=headers) as session:
+            try:
+                with tracing.span("gemini.upstream_post"):
+                    # 有请求 deadline 时以它为准；直接调用（无 deadline）时保留 30 秒上限
+                    response = await deadline.wait(session.post(
+                        self.request_url,
+                        json=body,  # 把 list/dict 转成 JSON 字符串
+                        headers=headers,
+
+                        timeout=aiohttp.ClientTimeout(total=None if deadline.current() else 30)
+                    ), deadline.FIRST_TOKEN)
+            except asyncio.CancelledError:
+                # 客户端断开：取消会中止 aiohttp 请求并关闭连接
+                UPSTREAM_RESPONSES.labels("gemini", "cancelled").inc()
+                raise
+            except asyncio.TimeoutError:
+                UPSTREAM_RESPONSES.labels("gemini", "timeout").inc()
+                raise
+            except aiohttp.ClientError:
+                UPSTREAM_RESPONSES.labels("gemini", "error").inc()
+                raise
+            UPSTREAM_RESPONSES.labels("gemini", str(response.status)).inc()
+            if response.status in (401, 403):
+                # 凭据已失效：删除快照，并让下一个请求重新引导（本进程中的请求头与 cookie 同样不可再用）；
+                # 本次请求随后以 UpstreamError 失败
+                gemini_snapshot.invalidate(f"upstream returned {response.status}")
+                self._initialized = False
+            async with response:
+                with tracing.span("gemini.read_body", status=response.status):
+                    text = await deadline.wait(response.text(), deadline.COMPLETION)
+                UPSTREAM_LATENCY.labels("gemini").observe(time.perf_counter() - upstream_started)
+                logger.debug("upstream response status=%s body=%s", response.status, LazyText(text))
+                if fixtures.enabled():
+                    fixtures.record_exchange(
+                        "gemini",
+                        {"payload": payload, "body": body, "digest": self.digest,
+                         "captured_js_vars": self.captured_js_vars},
+                        {"status": response.status, "text": text,
+                         "elapsed": round(time.perf_counter() - upstream_started, 3)},
+                        model=self.model,
+                    )
+                if response.status >= 400:
+                    raise UpstreamError("gemini", response.status, text[:200])
                 try:
-                    json_result= await response.json()
-                    str_result= self.extract_final_answer(json_result)
-
-                    if stream==False:
-                        return {
-                            "id":'1',
-                            "question": '',
-                            "answer": str_result
-                        }
-                    else:
-                        return self.mock_stream(str_result)
+                    with tracing.span("gemini.extract"):
+                        json_result= await response.json()
+                        str_result= self.extract_final_answer(json_result)
                 except Exception as e:
-                    print(e)
-                    return None
+                    logger.warning("failed to parse upstream response (status=%s): %s", response.status, e)
+                    raise UpstreamError("gemini", response.status, f"unparseable response: {e}") from e
+
+                if stream==False:
+                    return {
+                        "id":'1',
+                        "question": '',
+                        "answer": str_result
+                    }
+                else:
+                    return self.mock_stream(str_result)
 
     async def mock_stream(self,text):
         for chunk in self._split_into_chunks(text):
@@ -284,7 +507,7 @@ class GeminiReverse2(GeminiReverse):
             chat_text.append(conv['content'])
         conversation_text = " ".join(chat_text)
         sha256_hash = hashlib.sha256(conversation_text.encode("utf-8")).hexdigest()
-        print("计算后的 SHA-256:", sha256_hash)
+        logger.debug("计算后的 SHA-256: %s", sha256_hash)
 
         # 放入 evaluate 的 JS 脚本中
         js_script = f"""
@@ -294,8 +517,9 @@ class GeminiReverse2(GeminiReverse):
             }}
         """
 
-        result = await self.page.evaluate(js_script)
-        print("Python拿到的结果:", result)
+        with tracing.span("gemini.checksum_evaluate"):
+            result = await self.page.evaluate(js_script)
+        logger.debug("checksum 结果: %s", result)
         self.digest = result
         return result
 
@@ -0,0 +1,169 @@
+"""Gemini 热启动快照：保存启动引导的结果，重启后跳过通过页面发送 "你好" 的引导对话。
+
+快照内容：捕获的 JS 变量名（captured_js_vars）、改写后的 m=_b 包（按 sha256 存放的文件与原始 URL）、
+GenerateContent 请求头与 cookie（含各自的过期时间）。
+
+- 加载时校验版本、必需字段、包文件的 sha256 与有效期；任一项不通过即视为过期，走完整引导
+- 有效期：保存后 max_age 秒（默认 12 小时），且不晚于最早过期的持久 cookie（会话 cookie 不参与）
+- 页面请求的 m=_b 包 URL 与快照不同（上游发布了新版本）时快照失效，本次按原流程改写
+- 上游返回 401/403 时删除快照，并让下一个请求重新引导（不必等到重启）
+- 快照包含登录凭据：文件权限为 0600，目录应与浏览器用户数据目录同等对待
+
+config.json 的 gemini_snapshot：{"enabled": true, "dir": "state", "max_age": 43200, "ready_timeout": 30}
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from app.config.settings import ROOT, get_setting
+from app.utils.metrics import WARM_STARTS
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+DEFAULT_MAX_AGE = 12 * 3600
+DEFAULT_READY_TIMEOUT = 30.0
+SNAPSHOT_FILE = "gemini_snapshot.json"
+_REQUIRED = ("captured_js_vars", "bundle", "headers", "cookies", "saved_at")
+
+
+def _config() -> dict:
+    return get_setting("gemini_snapshot", {}) or {}
+
+
+def enabled() -> bool:
+    return bool(_config().get("enabled", True))
+
+
+def snapshot_dir() -> Path:
+    path = Path(_config().get("dir") or "state")
+    return path if path.is_absolute() else ROOT / path
+
+
+def max_age() -> float:
+    return float(_config().get("max_age", DEFAULT_MAX_AGE))
+
+
+def ready_timeout() -> float:
+    """热启动时等待页面加载快照中的包并就绪的秒数，超时则走完整引导。"""
+    return float(_config().get("ready_timeout", DEFAULT_READY_TIMEOUT))
+
+
+class Snapshot:
+    __slots__ = ("captured_js_vars", "bundle", "headers", "cookies", "saved_at", "_code")
+
+    def __init__(self, data: dict):
+        self.captured_js_vars: dict = data["captured_js_vars"]
+        # {"url": 原始 URL, "file": 文件名, "sha256": 改写后代码的哈希}
+        self.bundle: dict = data["bundle"]
+        self.headers: dict = data["headers"]
+        self.cookies: List[dict] = data["cookies"]
+        self.saved_at: float = float(data["saved_at"])
+        self._code: Optional[str] = None
+
+    def expires_at(self) -> float:
+        expiry = self.saved_at + max_age()
+        for cookie in self.cookies:
+            # Playwright 中会话 cookie 的 expires 为 -1
+            expires = cookie.get("expires") or -1
+            if expires > 0:
+                expiry = min(expiry, float(expires))
+        return expiry
+
+    def fresh(self, now: Optional[float] = None) -> bool:
+        return (now or time.time()) < self.expires_at()
+
+    def matches_bundle(self, url: str) -> bool:
+        return url == self.bundle.get("url")
+
+    def bundle_code(self) -> str:
+        if self._code is None:
+            self._code = (snapshot_dir() / self.bundle["file"]).read_text(encoding="utf-8")
+        return self._code
+
+
+def load() -> Optional[Snapshot]:
+    """返回可用的快照；没有快照、校验失败或已过期时返回 None（原因记录在日志与指标中）。"""
+    if not enabled():
+        return None
+    path = snapshot_dir() / SNAPSHOT_FILE
+    if not path.exists():
+        WARM_STARTS.labels("gemini", "miss").inc()
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"unsupported snapshot version {data.get('version')!r}")
+        missing = [key for key in _REQUIRED if not data.get(key)]
+        if missing:
+            raise ValueError(f"missing fields {missing}")
+        snapshot = Snapshot(data)
+        code = snapshot.bundle_code()
+        if hashlib.sha256(code.encode("utf-8")).hexdigest() != snapshot.bundle.get("sha256"):
+            raise ValueError("bundle checksum mismatch")
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning("[gemini_snapshot] rejected %s: %s", path, e)
+        WARM_STARTS.labels("gemini", "rejected").inc()
+        return None
+    if not snapshot.fresh():
+        logger.info("[gemini_snapshot] snapshot expired at %s", time.strftime("%Y-%m-%d %H:%M:%S",
+                                                                             time.localtime(snapshot.expires_at())))
+        WARM_STARTS.labels("gemini", "stale").inc()
+        return None
+    return snapshot
+
+
+def _write_private(path: Path, text: str):
+    # 先写临时文件再替换，进程中途退出不会留下半个快照
+    tmp = path.with_name(path.name + ".tmp")
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def save(captured_js_vars: dict, bundle_url: str, bundle_code: str, headers: dict, cookies: List[dict]):
+    """写出快照（同步，调用方在线程池中执行）；失败只记录日志。"""
+    if not enabled():
+        return
+    try:
+        directory = snapshot_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha256(bundle_code.encode("utf-8")).hexdigest()
+        bundle_file = f"gemini_bundle-{digest[:16]}.js"
+        if not (directory / bundle_file).exists():
+            _write_private(directory / bundle_file, bundle_code)
+        _write_private(directory / SNAPSHOT_FILE, json.dumps({
+            "version": SNAPSHOT_VERSION,
+            "saved_at": time.time(),
+            "captured_js_vars": captured_js_vars,
+            "bundle": {"url": bundle_url, "file": bundle_file, "sha256": digest},
+            "headers": dict(headers),
+            "cookies": list(cookies),
+        }, ensure_ascii=False))
+        # 旧版本的包文件不再被引用
+        for old in directory.glob("gemini_bundle-*.js"):
+            if old.name != bundle_file:
+                old.unlink()
+    except Exception as e:
+        logger.warning("[gemini_snapshot] save failed: %s", e)
+        return
+    WARM_STARTS.labels("gemini", "saved").inc()
+    logger.info("[gemini_snapshot] saved warm-start snapshot to %s", directory / SNAPSHOT_FILE)
+
+
+def invalidate(reason: str):
+    path = snapshot_dir() / SNAPSHOT_FILE
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        return
+    except OSError as e:
+        logger.warning("[gemini_snapshot] could not remove %s: %s", path, e)
+        return
+    logger.info("[gemini_snapshot] snapshot invalidated: %s", reason)
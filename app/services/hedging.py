@@ -0,0 +1,277 @@
+"""对冲请求：首 token 迟迟不来时，把同一个请求再发给另一个页面或备用后端，先出 token 的一方胜出，另一方被取消。
+
+- 触发阈值：按 (后端, 模型, 是否流式) 统计最近的首 token 时间（非流式为完成时间），取 p95；
+  样本不足 min_samples 时使用 default_delay；阈值不低于 min_delay
+- 对冲目标：同一后端的另一个页面（仅当其页面池有空闲页面时），否则按 alternates 配置的备用后端
+- 预算：每个请求累积 budget_percent/100 个令牌，每次对冲消耗 1 个，额外负载不超过约 budget_percent%
+- 失败转移：一方出错而另一方仍在进行时继续等待另一方；两方都失败时抛出主请求的异常
+
+config.json 的 hedging（默认关闭；请求体 "hedge": true/false 可逐个请求开启或关闭）：
+    {"enabled": false, "models": [], "budget_percent": 5, "min_delay": 1.0, "default_delay": 8.0,
+     "min_samples": 20, "window": 200, "same_backend": true,
+     "alternates": {"copilot": [{"backend": "gemini", "model": "gemini-2.5-pro"}]}}
+models 为空表示 enabled 时对所有模型生效。alternates 的每一项是 (backend, model)：发往备用后端的请求
+改写 model（省略 model 则保留原值），原始 model 保存在 requested_model 中。
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.config.settings import get_setting
+from app.utils import tracing
+from app.utils.metrics import HEDGES
+from . import backend_registry
+from .reverse_base import ReverseBase
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUDGET_PERCENT = 5.0
+DEFAULT_MIN_DELAY = 1.0
+DEFAULT_DELAY = 8.0
+DEFAULT_MIN_SAMPLES = 20
+DEFAULT_WINDOW = 200
+# 预算令牌上限：空闲一段时间后允许的突发对冲数
+BUDGET_BURST = 10.0
+
+
+def _config() -> dict:
+    return get_setting("hedging", {}) or {}
+
+
+def enabled_for(data: dict) -> bool:
+    """请求是否启用对冲：请求体 hedge 字段优先，其次 config.json。"""
+    explicit = data.get("hedge")
+    if explicit is not None:
+        return bool(explicit)
+    config = _config()
+    if not config.get("enabled"):
+        return False
+    models = config.get("models") or ()
+    return not models or data.get("model") in models
+
+
+class LatencyWindow:
+    """最近 window 个样本的滑动窗口，p95 每新增若干样本重算一次。"""
+
+    def __init__(self, window: int):
+        self.samples: deque = deque(maxlen=window)
+        self._p95: Optional[float] = None
+        self._stale = 0
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+        self._stale += 1
+        if self._stale >= 10:
+            self._p95 = None
+
+    def p95(self) -> Optional[float]:
+        if not self.samples:
+            return None
+        if self._p95 is None:
+            ordered = sorted(self.samples)
+            self._p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+            self._stale = 0
+        return self._p95
+
+
+class HedgeBudget:
+    def __init__(self):
+        self.tokens = 1.0
+
+    def deposit(self, percent: float):
+        self.tokens = min(BUDGET_BURST, self.tokens + percent / 100.0)
+
+    def withdraw(self) -> bool:
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
+
+
+_windows: Dict[Tuple[str, str, bool], LatencyWindow] = {}
+_budgets: Dict[str, HedgeBudget] = {}
+
+
+def _window(key: Tuple[str, str, bool]) -> LatencyWindow:
+    window = _windows.get(key)
+    if window is None:
+        window = _windows[key] = LatencyWindow(int(_config().get("window", DEFAULT_WINDOW)))
+    return window
+
+
+def threshold(backend: str, model: str, stream: bool) -> float:
+    config = _config()
+    window = _window((backend, model, stream))
+    p95 = window.p95()
+    if p95 is None or len(window.samples) < int(config.get("min_samples", DEFAULT_MIN_SAMPLES)):
+        p95 = float(config.get("default_delay", DEFAULT_DELAY))
+    return max(float(config.get("min_delay", DEFAULT_MIN_DELAY)), p95)
+
+
+def stats() -> dict:
+    return {
+        "thresholds": {f"{b}/{m}/{'stream' if s else 'sync'}": {"p95": w.p95(), "samples": len(w.samples)}
+                       for (b, m, s), w in _windows.items()},
+        "budget_tokens": {b: round(budget.tokens, 3) for b, budget in _budgets.items()},
+    }
+
+
+def _has_content(chunk: str) -> bool:
+    if not chunk.startswith("data: {"):
+        return False
+    try:
+        obj = json.loads(chunk[6:])
+    except ValueError:
+        return False
+    return any((c.get("delta") or {}).get("content") for c in obj.get("choices") or ())
+
+
+class _Attempt:
+    """一次尝试：非流式为完整结果；流式为 (流, 首个内容块及之前已读出的块)。"""
+
+    def __init__(self, reverser: ReverseBase, payload: dict, stream: bool):
+        self.started = time.perf_counter()
+        self.stream = None
+        self.task = asyncio.ensure_future(self._run(reverser, payload, stream))
+
+    async def _run(self, reverser: ReverseBase, payload: dict, stream: bool):
+        result = await reverser.send_conversation(payload=payload)
+        if not stream:
+            return result
+        self.stream = result
+        buffered: List[str] = []
+        async for chunk in result:
+            buffered.append(chunk)
+            if _has_content(chunk) or chunk.startswith("data: [DONE]"):
+                break
+        return buffered
+
+    async def cancel(self):
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        if self.stream is not None:
+            # 取消只中断了读取，显式关闭流让后端立即停止生成并归还页面
+            try:
+                await self.stream.aclose()
+            except Exception:
+                pass
+
+
+def _hedge_payload(payload: dict, backend: str, model: Optional[str]) -> dict:
+    """对冲请求的 payload：指向目标后端，备用后端的模型名与主请求不同时一并改写。"""
+    hedged = dict(payload, backend=backend)
+    if model and model != payload.get("model"):
+        hedged.setdefault("requested_model", payload.get("model"))
+        hedged["model"] = model
+    return hedged
+
+
+class HedgedReverse(ReverseBase):
+    """包装一个共享后端实例：send_conversation 在超过阈值时发起对冲请求。"""
+
+    def __init__(self, backend: str, reverser: ReverseBase,
+                 get_reverser: Callable[[str], Awaitable[ReverseBase]]):
+        self.backend = backend
+        self.reverser = reverser
+        self._get_reverser = get_reverser
+
+    async def set_dynamic_data(self, data: dict):
+        return
+
+    async def prepare_send_conversation(self):
+        return
+
+    async def close_client(self):
+        return
+
+    def stats(self) -> dict:
+        return self.reverser.stats()
+
+    async def _hedge_target(self) -> Optional[Tuple[str, Optional[str], ReverseBase]]:
+        """(后端, 改写后的模型（None 表示不改写）, 实例)；没有可用目标时返回 None。"""
+        config = _config()
+        if config.get("same_backend", True):
+            pool = (self.reverser.stats() or {}).get("pool") or {}
+            if pool.get("idle", 0) > 0:
+                return self.backend, None, self.reverser
+        for alternate in (config.get("alternates") or {}).get(self.backend) or ():
+            if not isinstance(alternate, dict) or not alternate.get("backend"):
+                continue
+            name = alternate["backend"]
+            try:
+                return name, alternate.get("model"), await self._get_reverser(name)
+            except Exception as e:
+                logger.warning("hedge alternate %s unavailable: %s", name, e)
+        return None
+
+    async def send_conversation(self, text=None, payload=None):
+        payload = payload or {}
+        stream = bool(payload.get("stream"))
+        # 未声明的模型共用一个窗口，避免客户端随意传入的 model 让统计表无限增长
+        model = payload.get("model") if backend_registry.is_declared_model(payload.get("model")) else "other"
+        budget = _budgets.setdefault(self.backend, HedgeBudget())
+        budget.deposit(float(_config().get("budget_percent", DEFAULT_BUDGET_PERCENT)))
+        window = _window((self.backend, model, stream))
+        delay = threshold(self.backend, model, stream)
+
+        primary = _Attempt(self.reverser, payload, stream)
+        attempts = [primary]
+        try:
+            done, _ = await asyncio.wait({primary.task}, timeout=delay)
+            if not done:
+                target = await self._hedge_target()
+                if target is None:
+                    HEDGES.labels(self.backend, "no_target").inc()
+                elif not budget.withdraw():
+                    HEDGES.labels(self.backend, "budget").inc()
+                else:
+                    name, hedge_model, reverser = target
+                    HEDGES.labels(self.backend, "issued").inc()
+                    tracing.instant("hedge.issued", target=name, after=round(delay, 3))
+                    attempts.append(_Attempt(reverser, _hedge_payload(payload, name, hedge_model), stream))
+            winner = await self._first_success(attempts)
+        except BaseException:
+            for attempt in attempts:
+                await attempt.cancel()
+            raise
+
+        losers = [a for a in attempts if a is not winner]
+        for attempt in losers:
+            await attempt.cancel()
+        # 主请求胜出时这就是它的首 token 时间；被取消时只知道它至少需要这么久，
+        # 按下限记入样本，避免 p95 被对冲结果拉低、对冲越来越频繁
+        window.add(time.perf_counter() - primary.started)
+        if len(attempts) > 1:
+            HEDGES.labels(self.backend, "won" if winner is not primary else "lost").inc()
+
+        if not stream:
+            return winner.task.result()
+        return self._relay(winner)
+
+    async def _first_success(self, attempts: List[_Attempt]) -> _Attempt:
+        pending = {a.task: a for a in attempts}
+        first_error: Optional[BaseException] = None
+        while True:
+            done, _ = await asyncio.wait(set(pending), return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                attempt = pending.pop(task)
+                if task.exception() is None:
+                    return attempt
+                if attempt is attempts[0] or first_error is None:
+                    first_error = task.exception()
+            if not pending:
+                raise first_error
+            logger.info("hedge attempt failed, waiting for the other: %s", first_error)
+
+    async def _relay(self, winner: _Attempt):
+        stream = winner.stream
+        try:
+            for chunk in winner.task.result():
+                yield chunk
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
@@ -0,0 +1,262 @@
+"""异步补全任务：提交后立即返回任务 id，生成在后台进行，客户端轮询、长轮询或按偏移量续读流。
+
+- 每个任务在后台以流式运行，SSE 事件依次追加到 events；流式读取可从任意偏移量开始（断线后续读不丢块）
+- 任务结束后合并各块得到完整的 chat.completion（n > 1 时每个 choice 一个），保留 jobs_ttl_seconds 秒
+- 存储有界（jobs_max）：满时先淘汰最早结束的任务；全部仍在运行时拒绝新任务
+- 任务只存在于处理提交的进程中：多 worker 部署时需要让同一任务的请求落到同一个 worker（或只用一个 worker）
+
+config.json：jobs_max（默认 1000）、jobs_ttl_seconds（默认 600）、jobs_max_wait（长轮询上限，默认 60）
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+from app.config.settings import get_setting
+from app.utils import deadline
+from .circuit_breaker import CircuitOpenError
+from .fanout import ChoicesRejected
+from .reverse_base import UpstreamError
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+DEFAULT_MAX_JOBS = 1000
+DEFAULT_TTL = 600.0
+
+
+class JobStoreFull(RuntimeError):
+    """存储已满且所有任务都在运行。"""
+
+
+class Job:
+    def __init__(self, payload: dict):
+        self.job_id = f"job-{uuid.uuid4().hex}"
+        self.payload = payload
+        self.created = int(time.time())
+        self.status = QUEUED
+        # SSE 事件的 data 部分（不含 "data: " 前缀与结尾空行），按到达顺序
+        self.events: List[str] = []
+        self.result: Optional[dict] = None
+        self.error: Optional[dict] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def _notify(self):
+        # 唤醒当前所有等待者，之后的等待者使用新的 Event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def append(self, data: str):
+        self.events.append(data)
+        self._notify()
+
+    def finish(self, status: str, result: Optional[dict] = None, error: Optional[dict] = None):
+        self.status = status
+        self.result = result
+        self.error = error
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    async def wait_changed(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(asyncio.shield(self._changed.wait()), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def wait_finished(self, timeout: float):
+        until = time.monotonic() + timeout
+        while not self.finished:
+            remaining = until - time.monotonic()
+            if remaining <= 0:
+                return
+            await self.wait_changed(remaining)
+
+    async def follow(self, offset: int = 0) -> AsyncIterator[tuple]:
+        """从 offset 开始依次产出 (偏移量, 事件)，直到任务结束且事件读完。"""
+        while True:
+            while offset < len(self.events):
+                yield offset, self.events[offset]
+                offset += 1
+            if self.finished:
+                return
+            await self.wait_changed(30.0)
+
+    def as_dict(self) -> dict:
+        info = {
+            "id": self.job_id,
+            "object": "chat.completion.job",
+            "created": self.created,
+            "model": self.payload.get("model"),
+            "status": self.status,
+            "events": len(self.events),
+        }
+        if self.result is not None:
+            info["result"] = self.result
+        if self.error is not None:
+            info["error"] = self.error
+        return info
+
+
+def assemble(job: Job) -> dict:
+    """把流式块合并为 chat.completion。"""
+    contents: Dict[int, List[str]] = {}
+    finish_reasons: Dict[int, Optional[str]] = {}
+    chat_id, usage = None, None
+    for data in job.events:
+        if data == "[DONE]":
+            continue
+        try:
+            obj = json.loads(data)
+        except ValueError:
+            continue
+        chat_id = chat_id or obj.get("id")
+        usage = obj.get("usage") or usage
+        for choice in obj.get("choices") or ():
+            index = choice.get("index", 0)
+            contents.setdefault(index, [])
+            content = (choice.get("delta") or {}).get("content")
+            if content:
+                contents[index].append(content)
+            if choice.get("finish_reason"):
+                finish_reasons[index] = choice["finish_reason"]
+    return {
+        "id": chat_id or "chatcmpl-unknown",
+        "object": "chat.completion",
+        "created": job.created,
+        "model": job.payload.get("model", "copilot-chat"),
+        "choices": [
+            {"index": i, "message": {"role": "assistant", "content": "".join(contents[i])},
+             "finish_reason": finish_reasons.get(i, "stop")}
+            for i in sorted(contents)
+        ],
+        "usage": usage,
+    }
+
+
+def _error_of(job: Job) -> Optional[dict]:
+    """流中的 error 块（超时、熔断等在流内报告的错误）。"""
+    for data in reversed(job.events[-3:]):
+        if data.startswith('{"error"'):
+            try:
+                return json.loads(data)["error"]
+            except (ValueError, KeyError):
+                return None
+    return None
+
+
+def _exception_error(e: Exception) -> dict:
+    # 与同步接口的错误类型一致
+    if isinstance(e, ChoicesRejected):
+        return {"message": str(e), "type": "invalid_request_error", "param": "n"}
+    if isinstance(e, CircuitOpenError):
+        return {"message": str(e), "type": "unavailable", "code": "circuit_open"}
+    if isinstance(e, deadline.DeadlineExceeded):
+        return {"message": str(e), "type": "timeout", "code": "deadline_exceeded", "stage": e.stage}
+    if isinstance(e, UpstreamError):
+        return {"message": str(e), "type": "upstream_error", "upstream_status": e.status}
+    return {"message": f"{e.__class__.__name__}: {e}", "type": "upstream_error"}
+
+
+class JobStore:
+    def __init__(self):
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+
+    def _max_jobs(self) -> int:
+        return int(get_setting("jobs_max", DEFAULT_MAX_JOBS))
+
+    def _ttl(self) -> float:
+        return float(get_setting("jobs_ttl_seconds", DEFAULT_TTL))
+
+    def _evict(self):
+        now = time.monotonic()
+        ttl = self._ttl()
+        for job_id in [j.job_id for j in self._jobs.values() if j.finished and now - j.finished_at > ttl]:
+            del self._jobs[job_id]
+        if len(self._jobs) < self._max_jobs():
+            return
+        finished = sorted((j for j in self._jobs.values() if j.finished), key=lambda j: j.finished_at)
+        for job in finished[:len(self._jobs) - self._max_jobs() + 1]:
+            del self._jobs[job.job_id]
+        if len(self._jobs) >= self._max_jobs():
+            raise JobStoreFull(f"{len(self._jobs)} jobs are still running")
+
+    def submit(self, payload: dict, open_stream: Callable[[dict], AsyncIterator[str]]) -> Job:
+        """登记任务并在后台运行；open_stream(payload) 返回该请求的 SSE 流。"""
+        self._evict()
+        job = Job(payload)
+        self._jobs[job.job_id] = job
+        job.task = asyncio.ensure_future(self._run(job, open_stream))
+        return job
+
+    async def _run(self, job: Job, open_stream):
+        job.status = RUNNING
+        job._notify()
+        stream = None
+        try:
+            stream = open_stream(job.payload)
+            async for chunk in stream:
+                if chunk.startswith("data: "):
+                    job.append(chunk[6:].rstrip("\n"))
+        except asyncio.CancelledError:
+            job.finish(CANCELLED, error={"message": "job cancelled", "type": "cancelled"})
+            raise
+        except Exception as e:
+            logger.warning("job %s failed: %s", job.job_id, e)
+            job.finish(FAILED, error=_exception_error(e))
+        else:
+            error = _error_of(job)
+            if error is not None:
+                job.finish(FAILED, error=error)
+            else:
+                job.finish(SUCCEEDED, result=assemble(job))
+        finally:
+            if stream is not None:
+                await stream.aclose()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is not None and job.finished and time.monotonic() - job.finished_at > self._ttl():
+            del self._jobs[job_id]
+            return None
+        return job
+
+    async def cancel(self, job_id: str) -> Optional[Job]:
+        job = self.get(job_id)
+        if job is not None and job.task is not None and not job.finished:
+            job.task.cancel()
+            await asyncio.gather(job.task, return_exceptions=True)
+            if not job.finished:
+                # 任务在开始运行之前被取消
+                job.finish(CANCELLED, error={"message": "job cancelled", "type": "cancelled"})
+        return job
+
+    def stats(self) -> dict:
+        counts: Dict[str, int] = {}
+        for job in self._jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {"jobs": len(self._jobs), "max": self._max_jobs(), "by_status": counts}
+
+    async def close(self):
+        tasks = [j.task for j in self._jobs.values() if j.task is not None and not j.task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+store = JobStore()
@@ -0,0 +1,177 @@
+"""后端生命周期管理：统一持有所有共享后端实例（及其页面池），负责预热、状态与关闭。
+
+- get(name): 返回共享实例，首次调用时创建并执行 init()（失败会记录状态，下次调用重试）
+- warm_up(): 启动时并发预热配置中的后端，每个后端独立超时
+- health()/readiness(): 供 /healthz 与 /readyz 使用的按后端状态
+- shutdown(): 停止接受新请求，等待页面归还，关闭页面、浏览器与 Playwright
+"""
+import asyncio
+import sys
+import time
+from typing import Dict, Iterable, Optional
+
+from app.config.settings import get_setting
+from . import backend_registry
+from .reverse_base import ReverseBase
+
+# 后端状态
+IDLE = "idle"
+STARTING = "starting"
+READY = "ready"
+FAILED = "failed"
+CLOSING = "closing"
+CLOSED = "closed"
+
+DEFAULT_WARMUP_TIMEOUT = 60.0
+DEFAULT_DRAIN_TIMEOUT = 10.0
+
+
+class BackendState:
+    def __init__(self, name: str):
+        self.name = name
+        self.status = IDLE
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.ready_at: Optional[float] = None
+
+    def as_dict(self, instance: Optional[ReverseBase] = None) -> dict:
+        info = {"status": self.status, "error": self.error}
+        if self.started_at and self.ready_at:
+            info["init_seconds"] = round(self.ready_at - self.started_at, 3)
+        if instance is not None:
+            try:
+                info.update(instance.stats())
+            except Exception:
+                pass
+        return info
+
+
+class LifecycleManager:
+    def __init__(self):
+        self._instances: Dict[str, ReverseBase] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._states: Dict[str, BackendState] = {}
+        self._warmup_task: Optional[asyncio.Task] = None
+        self._warmup_names: tuple = ()
+        self._closing = False
+        self._started_at = time.time()
+
+    def _state(self, name: str) -> BackendState:
+        state = self._states.get(name)
+        if state is None:
+            state = self._states[name] = BackendState(name)
+        return state
+
+    async def get(self, name: str) -> ReverseBase:
+        """返回共享后端实例（异步安全）；init 失败时抛出异常，下次调用会重新尝试。"""
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        if self._closing:
+            raise RuntimeError("service is shutting down")
+
+        spec = backend_registry.get_backend(name)
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        async with lock:
+            instance = self._instances.get(name)
+            if instance is not None:
+                return instance
+            state = self._state(name)
+            state.status = STARTING
+            state.error = None
+            state.started_at = time.time()
+            try:
+                instance = spec.load_class()()
+                await instance.init()
+            except BaseException as e:
+                state.status = FAILED
+                state.error = f"{e.__class__.__name__}: {e}"
+                raise
+            state.status = READY
+            state.ready_at = time.time()
+            self._instances[name] = instance
+            return instance
+
+    def peek(self, name: str) -> Optional[ReverseBase]:
+        """返回已创建的实例（不会触发创建）。"""
+        return self._instances.get(name)
+
+    async def warm_up(self, names: Optional[Iterable[str]] = None, timeout: Optional[float] = None) -> dict:
+        """并发预热后端，每个后端单独 timeout 秒；返回 {name: 状态}。失败不会抛出。"""
+        if names is None:
+            names = get_setting("warmup_backends", ["copilot", "gemini"])
+        if timeout is None:
+            timeout = float(get_setting("warmup_timeout", DEFAULT_WARMUP_TIMEOUT))
+        names = tuple(n for n in names if n in {s.name for s in backend_registry.list_backends()})
+        self._warmup_names = names
+
+        async def _one(name):
+            try:
+                await asyncio.wait_for(self.get(name), timeout)
+            except asyncio.TimeoutError:
+                state = self._state(name)
+                state.status = FAILED
+                state.error = f"warm-up timed out after {timeout}s"
+            except Exception:
+                # get() 已记录错误，运行时会按需重试
+                pass
+
+        await asyncio.gather(*(_one(n) for n in names))
+        return {n: self._state(n).status for n in names}
+
+    def start_warm_up(self, names: Optional[Iterable[str]] = None, timeout: Optional[float] = None) -> asyncio.Task:
+        """在后台启动预热，使服务可以立即接收 /healthz 请求。"""
+        if names is None:
+            names = get_setting("warmup_backends", ["copilot", "gemini"])
+        self._warmup_names = tuple(names)
+        for n in self._warmup_names:
+            self._state(n)
+        self._warmup_task = asyncio.create_task(self.warm_up(self._warmup_names, timeout))
+        return self._warmup_task
+
+    def backends(self) -> dict:
+        names = set(self._states) | set(self._warmup_names)
+        return {n: self._state(n).as_dict(self._instances.get(n)) for n in sorted(names)}
+
+    def health(self) -> dict:
+        return {
+            "status": "closing" if self._closing else "ok",
+            "uptime_seconds": round(time.time() - self._started_at, 3),
+            "backends": self.backends(),
+        }
+
+    def readiness(self) -> tuple:
+        """返回 (ready, body)：所有需要预热的后端都 ready 且未处于关闭中才算就绪。"""
+        required = self._warmup_names
+        ready = not self._closing and all(self._state(n).status == READY for n in required)
+        body = {"ready": ready, "required": list(required), "backends": self.backends()}
+        return ready, body
+
+    async def shutdown(self, drain_timeout: Optional[float] = None):
+        """停止接受新请求，关闭所有后端（后端内部等待页面归还），最后关闭共享浏览器。"""
+        if drain_timeout is None:
+            drain_timeout = float(get_setting("drain_timeout", DEFAULT_DRAIN_TIMEOUT))
+        self._closing = True
+        if self._warmup_task and not self._warmup_task.done():
+            self._warmup_task.cancel()
+            await asyncio.gather(self._warmup_task, return_exceptions=True)
+
+        async def _close(name, instance):
+            state = self._state(name)
+            state.status = CLOSING
+            try:
+                await asyncio.wait_for(instance.close_client(), drain_timeout + 5)
+            except Exception as e:
+                state.error = f"close failed: {e.__class__.__name__}: {e}"
+            state.status = CLOSED
+
+        instances, self._instances = self._instances, {}
+        await asyncio.gather(*(_close(n, i) for n, i in instances.items()))
+
+        # 仅在浏览器模块已经加载过时才关闭，避免为了关闭而导入 Playwright
+        bm = sys.modules.get("app.services.browser_manager")
+        if bm is not None and bm.BrowserManager._instance is not None:
+            await bm.BrowserManager.shutdown()
+
+
+lifecycle = LifecycleManager()
@@ -34,7 +34,11 @@ class MockCopilotProxy(ReverseBase):
             self.question = user
         return self.question
 
-    async def send_conversation(self):
+    async def send_conversation(self, text=None, payload=None):
+        # 与其它 reverser 保持相同签名：路由直接传入 payload
+        if payload is not None:
+            await self.set_dynamic_data(payload)
+            await self.prepare_send_conversation()
         stream = bool(self.data.get("stream", False))
         if stream:
             async def gen():
@@ -0,0 +1,238 @@
+"""模型路由：把请求中的 model 名解析为 (后端, Copilot 模式, 生成参数默认值)。
+
+规则来源（按优先级）：
+1. config.json 的 model_routes（可热更新，无需重启）：
+       "model_routes": {
+         "exact": {"my-model": {"backend": "copilot", "mode": "Think Deeper", "defaults": {"temperature": 0.7}}},
+         "patterns": [{"match": "(?i)^claude", "backend": "copilot", "mode": "Smart (GPT-5)"}]
+       }
+2. 内置规则：backend_registry 中声明的 models（精确）与 match 子串、model_mode_map 中的模式表
+
+解析顺序：先查全部精确规则，再按顺序匹配预编译的模式规则。每个字段取第一个提供该字段的规则
+（例如一条只设置 defaults 的规则不会改变后端），defaults 按键合并，靠前的规则优先；
+未命中任何后端规则时使用默认后端。
+
+- 规则在加载时校验（正则可编译、后端已注册、defaults 键与类型合法），启动时校验失败直接报错；
+  热更新时校验失败则记录错误并继续使用旧规则
+- 解析结果按 model 名缓存在有界 LRU 中，规则变化（热更新、注册后端/映射）时整体失效
+"""
+import logging
+import re
+import threading
+import time
+from types import MappingProxyType
+from functools import lru_cache
+from typing import Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+from app.config import settings
+from app.config.settings import get_setting
+from app.services import backend_registry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 1024
+# 检查 config.json 是否修改的最小间隔（秒），避免每个请求都 stat 文件
+RELOAD_INTERVAL = 1.0
+
+# 允许在 defaults 中设置的生成参数及其类型
+GENERATION_PARAMS = {
+    "max_tokens": (int,),
+    "temperature": (int, float),
+    "top_p": (int, float),
+    "stop": (str, list),
+    "thinking": (bool, int),
+}
+
+_RULE_KEYS = {"match", "backend", "mode", "defaults"}
+
+
+class RouterConfigError(ValueError):
+    """路由规则无效。"""
+
+
+class Route(NamedTuple):
+    backend: str
+    mode: Optional[str]
+    # 只读映射：同一个 Route 会被缓存并在请求间共享
+    defaults: Mapping[str, object]
+
+
+class _Rule(NamedTuple):
+    source: str
+    backend: Optional[str]
+    mode: Optional[str]
+    defaults: Dict[str, object]
+
+
+def _check_defaults(defaults, where: str) -> Dict[str, object]:
+    if defaults is None:
+        return {}
+    if not isinstance(defaults, dict):
+        raise RouterConfigError(f"{where}: defaults must be an object")
+    for key, value in defaults.items():
+        types = GENERATION_PARAMS.get(key)
+        if types is None:
+            raise RouterConfigError(f"{where}: unknown generation param {key!r}")
+        # bool 是 int 的子类，只有 thinking 允许布尔值
+        if not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+            raise RouterConfigError(f"{where}: {key} has invalid value {value!r}")
+        if key == "stop" and isinstance(value, list) and not all(isinstance(s, str) for s in value):
+            raise RouterConfigError(f"{where}: stop must be a string or a list of strings")
+    return dict(defaults)
+
+
+def _check_rule(rule, where: str) -> _Rule:
+    if not isinstance(rule, dict):
+        raise RouterConfigError(f"{where}: rule must be an object")
+    unknown = set(rule) - _RULE_KEYS
+    if unknown:
+        raise RouterConfigError(f"{where}: unknown keys {sorted(unknown)}")
+    backend = rule.get("backend")
+    if backend is not None:
+        try:
+            backend_registry.get_backend(backend)
+        except KeyError:
+            raise RouterConfigError(f"{where}: unknown backend {backend!r}") from None
+    mode = rule.get("mode")
+    if mode is not None and not isinstance(mode, str):
+        raise RouterConfigError(f"{where}: mode must be a string")
+    return _Rule(where, backend, mode, _check_defaults(rule.get("defaults"), where))
+
+
+def _compile(pattern, where: str):
+    if not isinstance(pattern, str) or not pattern:
+        raise RouterConfigError(f"{where}: match must be a non-empty regex")
+    try:
+        compiled = re.compile(pattern)
+    except re.error as e:
+        raise RouterConfigError(f"{where}: invalid regex {pattern!r}: {e}") from None
+    # 能匹配空串的模式（如末尾多一个 "|"）会命中所有模型
+    if compiled.search(""):
+        raise RouterConfigError(f"{where}: regex {pattern!r} matches every model name")
+    return compiled
+
+
+def _builtin_rules() -> Tuple[Dict[str, List[_Rule]], List[Tuple[re.Pattern, _Rule]]]:
+    from app.config.model_mode_map import EXACT_MAP, PATTERN_MAP
+
+    exact: Dict[str, List[_Rule]] = {}
+    patterns: List[Tuple[re.Pattern, _Rule]] = []
+    for spec in backend_registry.list_backends():
+        for model in spec.models:
+            exact.setdefault(model, []).append(_Rule(f"backend:{spec.name}", spec.name, None, {}))
+    for model, title in EXACT_MAP.items():
+        exact.setdefault(model, []).append(_Rule("model_mode_map", None, title, {}))
+    for spec in backend_registry.list_backends():
+        for sub in spec.match:
+            patterns.append((re.compile(re.escape(sub), re.IGNORECASE), _Rule(f"backend:{spec.name}", spec.name, None, {})))
+    for i, (pattern, title) in enumerate(PATTERN_MAP):
+        where = f"model_mode_map.PATTERN_MAP[{i}]"
+        patterns.append((_compile(pattern, where), _Rule(where, None, title, {})))
+    return exact, patterns
+
+
+def _config_rules(config) -> Tuple[Dict[str, List[_Rule]], List[Tuple[re.Pattern, _Rule]]]:
+    exact: Dict[str, List[_Rule]] = {}
+    patterns: List[Tuple[re.Pattern, _Rule]] = []
+    if not config:
+        return exact, patterns
+    if not isinstance(config, dict) or set(config) - {"exact", "patterns"}:
+        raise RouterConfigError("model_routes must be an object with 'exact' and/or 'patterns'")
+    for model, rule in (config.get("exact") or {}).items():
+        where = f"model_routes.exact[{model!r}]"
+        if isinstance(rule, dict) and "match" in rule:
+            raise RouterConfigError(f"{where}: exact rules do not take 'match'")
+        exact[model.strip()] = [_check_rule(rule, where)]
+    for i, rule in enumerate(config.get("patterns") or ()):
+        where = f"model_routes.patterns[{i}]"
+        checked = _check_rule(rule, where)
+        patterns.append((_compile(rule.get("match"), where), checked))
+    return exact, patterns
+
+
+class _Table:
+    """一组已校验、已编译的规则及其解析缓存。"""
+
+    def __init__(self, config, default_backend: str, cache_size: int):
+        cfg_exact, cfg_patterns = _config_rules(config)
+        exact, patterns = _builtin_rules()
+        for model, rules in exact.items():
+            cfg_exact.setdefault(model, []).extend(rules)
+        self.exact = cfg_exact
+        self.patterns = cfg_patterns + patterns
+        self.default_backend = default_backend
+        self.resolve = lru_cache(maxsize=cache_size)(self._resolve)
+
+    def _resolve(self, model: str) -> Route:
+        rules = list(self.exact.get(model, ()))
+        if model:
+            rules.extend(rule for pattern, rule in self.patterns if pattern.search(model))
+        backend = mode = None
+        defaults: Dict[str, object] = {}
+        for rule in rules:
+            if backend is None and rule.backend is not None:
+                backend = rule.backend
+            if mode is None and rule.mode is not None:
+                mode = rule.mode
+            for key, value in rule.defaults.items():
+                defaults.setdefault(key, value)
+        return Route(backend or self.default_backend, mode, MappingProxyType(defaults))
+
+
+class ModelRouter:
+    def __init__(self):
+        self._table: Optional[_Table] = None
+        self._generation = -1
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def _build(self) -> _Table:
+        return _Table(
+            get_setting("model_routes", None),
+            backend_registry.default_backend_name(),
+            int(get_setting("model_route_cache_size", DEFAULT_CACHE_SIZE)),
+        )
+
+    def load(self):
+        """编译并校验当前规则；规则无效时抛出 RouterConfigError（启动时调用，让错误配置尽早暴露）。"""
+        with self._lock:
+            self._table = self._build()
+            self._generation = settings.generation()
+
+    def invalidate(self):
+        """注册新后端或映射后调用：下次解析时重建规则表。"""
+        with self._lock:
+            self._table = None
+
+    def _current(self) -> _Table:
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + RELOAD_INTERVAL
+            settings.reload_if_changed()
+        table = self._table
+        if table is not None and self._generation == settings.generation():
+            return table
+        with self._lock:
+            if self._table is None:
+                self._table = self._build()
+            elif self._generation != settings.generation():
+                try:
+                    self._table = self._build()
+                    logger.info("model routes reloaded from config.json")
+                except RouterConfigError as e:
+                    logger.error("invalid model_routes in config.json, keeping previous rules: %s", e)
+            self._generation = settings.generation()
+            return self._table
+
+    def resolve(self, model: Optional[str]) -> Route:
+        return self._current().resolve((model or "").strip())
+
+    def cache_info(self):
+        return self._current().resolve.cache_info()
+
+
+router = ModelRouter()
+
+
+def resolve(model: Optional[str]) -> Route:
+    return router.resolve(model)
@@ -0,0 +1,230 @@
+"""页面池：管理一组可复用的浏览器页面（槽位），按请求租用、用完归还。
+
+设计要点：
+- 每个槽位同一时间只服务一个请求，避免多个请求在同一页面上互相覆盖输入/帧
+- acquire 支持超时与“优先槽位”，release 是同步的，便于在 finally/取消路径中调用
+- drain/close 等待在途请求归还后再关闭页面
+- 每个槽位有自己的熔断器：后端在 release 时报告结果，连续失败的页面暂停租用，冷却后放行探测请求；
+  所有页面都熔断时 acquire 立即抛出 CircuitOpenError，而不是等到超时
+"""
+import asyncio
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, List, Optional
+
+from app.utils.metrics import GaugeCallback, WAIT_TIME
+from .circuit_breaker import CircuitBreaker, CircuitOpenError, get as get_breaker, outcome_of
+
+# 所有存活的页面池，供 /metrics 抓取时计算利用率
+_POOLS: "weakref.WeakSet[PagePool]" = weakref.WeakSet()
+
+
+class PoolClosedError(RuntimeError):
+    pass
+
+
+class PageSlot:
+    """池中的一个页面槽位；state 留给具体后端存放与页面绑定的状态。"""
+
+    def __init__(self, slot_id: int, page: Any = None, breaker: Optional[CircuitBreaker] = None):
+        self.slot_id = slot_id
+        self.page = page
+        self.breaker = breaker
+        self.state: Any = None
+        self.busy = False
+        self.uses = 0
+        self.leased_at: Optional[float] = None
+        self.created_at = time.monotonic()
+
+
+class PagePool:
+    def __init__(
+        self,
+        name: str,
+        size: int,
+        page_factory: Callable[[PageSlot], Awaitable[Any]],
+        page_closer: Optional[Callable[[Any], Awaitable[None]]] = None,
+    ):
+        """
+        :param name: 池名称（用于日志/状态）
+        :param size: 页面数量
+        :param page_factory: async (slot) -> page，创建并准备好一个页面（可同时设置 slot.state）
+        :param page_closer: async (page) -> None，关闭页面；默认调用 page.close()
+        """
+        self.name = name
+        self.size = max(1, int(size))
+        self._page_factory = page_factory
+        self._page_closer = page_closer
+        self._slots: List[PageSlot] = []
+        self._waiters: List[asyncio.Future] = []
+        self._closed = False
+        self._wait_metric = WAIT_TIME.labels(f"pool:{name}")
+        _POOLS.add(self)
+
+    async def start(self):
+        """并发创建全部页面。任一页面创建失败时关闭已创建的页面并抛出异常。"""
+        slots = [PageSlot(i, breaker=get_breaker(f"page:{self.name}:{i}")) for i in range(self.size)]
+        pages = await asyncio.gather(*(self._page_factory(s) for s in slots), return_exceptions=True)
+        errors = [p for p in pages if isinstance(p, BaseException)]
+        if errors:
+            for p in pages:
+                if not isinstance(p, BaseException):
+                    await self._close_page(p)
+            raise errors[0]
+        for slot, page in zip(slots, pages):
+            slot.page = page
+        self._slots = slots
+
+    @property
+    def slots(self) -> List[PageSlot]:
+        return list(self._slots)
+
+    @staticmethod
+    def _usable(slot: PageSlot) -> bool:
+        return not slot.busy and (slot.breaker is None or slot.breaker.available())
+
+    def _pick(self, prefer: Optional[PageSlot] = None, rank: Optional[Callable[[PageSlot], Any]] = None) -> Optional[PageSlot]:
+        if prefer is not None and self._usable(prefer) and prefer in self._slots:
+            return prefer
+        if rank is not None:
+            idle = [slot for slot in self._slots if self._usable(slot)]
+            return min(idle, key=rank) if idle else None
+        for slot in self._slots:
+            if self._usable(slot):
+                return slot
+        return None
+
+    def _all_open(self) -> Optional[CircuitBreaker]:
+        """所有页面的熔断器都不放行时，返回最早恢复的那个。"""
+        breakers = [s.breaker for s in self._slots if s.breaker is not None]
+        if not breakers or len(breakers) < len(self._slots) or any(b.available() for b in breakers):
+            return None
+        return min(breakers, key=lambda b: b.retry_after())
+
+    def _wake(self):
+        for fut in self._waiters:
+            if not fut.done():
+                fut.set_result(None)
+
+    async def acquire(
+        self,
+        timeout: Optional[float] = None,
+        prefer: Optional[PageSlot] = None,
+        rank: Optional[Callable[[PageSlot], Any]] = None,
+    ) -> PageSlot:
+        """租用一个空闲槽位；timeout 秒内没有空闲槽位时抛出 asyncio.TimeoutError。
+
+        prefer 空闲时优先返回它；否则 rank 给定时返回 rank 最小的空闲槽位。
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = None if timeout is None else started + timeout
+        while True:
+            if self._closed:
+                raise PoolClosedError(f"page pool {self.name} is closed")
+            slot = self._pick(prefer, rank)
+            if slot is not None:
+                if slot.breaker is not None:
+                    slot.breaker.before()
+                slot.busy = True
+                slot.uses += 1
+                slot.leased_at = time.monotonic()
+                self._wait_metric.observe(loop.time() - started)
+                return slot
+
+            breaker = self._all_open()
+            if breaker is not None:
+                raise CircuitOpenError(f"pool:{self.name}", breaker.retry_after())
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                raise asyncio.TimeoutError(f"timed out waiting for a page in pool {self.name}")
+            fut = loop.create_future()
+            self._waiters.append(fut)
+            try:
+                await asyncio.wait_for(fut, remaining)
+            finally:
+                self._waiters.remove(fut)
+
+    def release(self, slot: PageSlot, ok: Optional[bool] = None):
+        """归还槽位（同步调用，可安全地放在 finally / 取消路径中）。
+
+        ok 为本次请求在该页面上的结果（记入页面熔断器）；None 表示没有结果（取消）。
+        """
+        if slot.breaker is not None:
+            if ok is None:
+                slot.breaker.release()
+            else:
+                slot.breaker.record(ok, None if slot.leased_at is None else time.monotonic() - slot.leased_at)
+        slot.busy = False
+        slot.leased_at = None
+        self._wake()
+
+    @asynccontextmanager
+    async def lease(self, timeout: Optional[float] = None, prefer: Optional[PageSlot] = None):
+        slot = await self.acquire(timeout=timeout, prefer=prefer)
+        ok = None
+        try:
+            yield slot
+            ok = True
+        except Exception as e:
+            ok = outcome_of(e)
+            raise
+        finally:
+            self.release(slot, ok)
+
+    def stats(self) -> dict:
+        in_use = sum(1 for s in self._slots if s.busy)
+        return {
+            "size": len(self._slots),
+            "in_use": in_use,
+            "idle": len(self._slots) - in_use,
+            "waiting": len(self._waiters),
+            "closed": self._closed,
+        }
+
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        """等待所有槽位归还；返回 True 表示已全部归还，False 表示超时。"""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while any(s.busy for s in self._slots):
+            if deadline is not None and loop.time() >= deadline:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+    async def close(self, drain_timeout: Optional[float] = 10.0):
+        """停止接受新租用，等待在途请求归还（最多 drain_timeout 秒）后关闭全部页面。"""
+        self._closed = True
+        self._wake()
+        await self.drain(drain_timeout)
+        slots, self._slots = self._slots, []
+        await asyncio.gather(*(self._close_page(s.page) for s in slots), return_exceptions=True)
+
+    async def _close_page(self, page):
+        if page is None:
+            return
+        try:
+            if self._page_closer is not None:
+                await self._page_closer(page)
+            else:
+                await page.close()
+        except Exception:
+            pass
+
+
+def _pool_samples():
+    for pool in list(_POOLS):
+        st = pool.stats()
+        for key in ("size", "in_use", "idle", "waiting"):
+            yield (pool.name, key), st[key]
+
+
+def _pool_utilization():
+    for pool in list(_POOLS):
+        st = pool.stats()
+        yield (pool.name,), (st["in_use"] / st["size"]) if st["size"] else 0.0
+
+
+GaugeCallback("chat2api_pool_pages", "Page pool slots by state.", ("pool", "state"), _pool_samples)
+GaugeCallback("chat2api_pool_utilization", "Fraction of page pool slots currently leased.", ("pool",), _pool_utilization)
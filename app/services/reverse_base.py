@@ -1,16 +1,38 @@
 from typing import Optional
 
 
+class UpstreamError(RuntimeError):
+    """上游返回错误状态（HTTP ≥ 400）或无法解析的响应；status 为 None 表示没有可用的 HTTP 状态。
+
+    路由映射为 502；上游限流或暂不可用（429 / 503）映射为 503。
+    """
+
+    def __init__(self, backend: str, status: Optional[int] = None, message: str = ""):
+        detail = f"{backend} upstream returned {status}" if status is not None else f"{backend} upstream error"
+        super().__init__(f"{detail}: {message}" if message else detail)
+        self.backend = backend
+        self.status = status
+
+    @property
+    def http_status(self) -> int:
+        return 503 if self.status in (429, 503) else 502
+
+
 class ReverseBase:
     """抽象基类：逆向模块的统一接口。
 
     实现类需提供异步方法：
+    - init()（可选：共享实例创建后由 lifecycle 调用一次，用于预热）
     - set_dynamic_data(data: dict)
     - prepare_send_conversation()
     - send_conversation()
     - close_client()
+    以及可选的同步方法 stats()，返回页面池等运行状态。
     """
 
+    async def init(self):
+        return
+
     async def set_dynamic_data(self, data: dict):
         raise NotImplementedError()
 
@@ -22,3 +44,6 @@ class ReverseBase:
 
     async def close_client(self):
         raise NotImplementedError()
+
+    def stats(self) -> dict:
+        return {}
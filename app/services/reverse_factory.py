@@ -1,58 +1,61 @@
-import asyncio
-from typing import Optional
-
-from aiohttp import payload
-
-from .gemini_reverse_2 import GeminiReverse2
 from .reverse_base import ReverseBase
-from . import mock_copilot
-from app.services import copilot_reverse
-# Shared singletons for Copilot and Gemini
-_shared_copilot: Optional[copilot_reverse.CopilotReverse] = None
-_shared_gemini: Optional[GeminiReverse2] = None
-
-# separate locks to avoid contention
-_shared_copilot_lock = asyncio.Lock()
-_shared_gemini_lock = asyncio.Lock()
-
-async def _get_shared_copilot() -> ReverseBase:
-    """Return a shared CopilotReverse singleton (async-safe)."""
-    global _shared_copilot
-    if _shared_copilot is None:
-        async with _shared_copilot_lock:
-            if _shared_copilot is None:
-                _shared_copilot = copilot_reverse.CopilotReverse()
-    return _shared_copilot
-
-async def _get_shared_gemini() -> ReverseBase:
-    """Return a shared GeminiReverse singleton (async-safe)."""
-    global _shared_gemini
-    if _shared_gemini is None:
-        async with _shared_gemini_lock:
-            if _shared_gemini is None:
-                _shared_gemini = GeminiReverse2()
-                await _shared_gemini.init()
-    return _shared_gemini
+from . import backend_registry, broker_client, circuit_breaker, hedging
+from .lifecycle import lifecycle
 
 
 async def get_reverser(data: dict) -> ReverseBase:
     """根据请求数据选择并返回合适的逆向实现实例。
 
-    选择逻辑（优先级）:
+    选择逻辑由 backend_registry 决定（优先级）:
+    - 显式 backend 字段 -> 对应已注册后端
     - 如果 data 中显式 use_mock 为 True -> 返回 MockCopilotProxy
-    - 如果 data 中显式 use_gemini 为 True 或 model 名含 gemini -> 返回 GeminiReverse
-    - 否则返回共享的 CopilotProxy 实例
+    - 如果 data 中显式 use_gemini 为 True 或 model 名命中 Gemini 的模型声明 -> 返回共享 GeminiReverse2
+    - 否则返回默认后端（共享 CopilotReverse）
+
+    实现模块在首次命中时才导入，避免启动时加载 Playwright/aiohttp。
+    配置了 broker_address 时，共享后端转发给 broker 进程，本进程不启动浏览器。
+    共享后端经熔断器包装：后端熔断时转移到 failover 备用后端（并改写 data 的 backend 与 model），
+    都不可用时立即抛出 CircuitOpenError。
+    启用对冲的请求返回 HedgedReverse 包装（见 hedging 模块）。
     """
     if not isinstance(data, dict):
         data = {}
 
-    if data.get("use_mock"):
-        return mock_copilot.MockCopilotProxy()
-
-    model = (data.get("model") or "").lower()
-    # If Gemini is requested, return the shared Gemini singleton
-    if data.get("use_gemini") or "gemini"  in model:
-        return await _get_shared_gemini()
-
-    # 默认使用共享 Copilot core
-    return await _get_shared_copilot()
+    name = backend_registry.resolve_backend_name(data)
+    spec = backend_registry.get_backend(name)
+    if not spec.shared:
+        return spec.load_class()()
+    name = circuit_breaker.select_backend(name, data)
+    reverser = await _shared_reverser(name)
+    # 对冲（可选）：首 token 超过近期 p95 时再向另一个页面或备用后端发起同一请求
+    if hedging.enabled_for(data):
+        return hedging.HedgedReverse(name, reverser, _shared_reverser)
+    return reverser
+
+
+async def _shared_reverser(name: str) -> ReverseBase:
+    if broker_client.enabled():
+        reverser = broker_client.get_reverser(name)
+    else:
+        # 共享实例由 lifecycle 统一持有（与启动预热、/readyz、关闭流程使用同一个实例）
+        try:
+            reverser = await lifecycle.get(name)
+        except Exception:
+            # 初始化失败（如凭据失效、JS 锚点缺失）同样计入后端熔断器
+            circuit_breaker.get(f"backend:{name}").record(False)
+            raise
+    return circuit_breaker.GuardedReverse(name, reverser)
+
+
+async def get_local_reverser(data: dict) -> ReverseBase:
+    """返回本进程中的原始后端实例（不经熔断器与对冲包装）。
+
+    broker 进程使用：熔断、失败转移与对冲已经在 worker 侧的调用上生效，broker 再包装一次会重复计数。
+    """
+    if not isinstance(data, dict):
+        data = {}
+    name = backend_registry.resolve_backend_name(data)
+    spec = backend_registry.get_backend(name)
+    if not spec.shared:
+        return spec.load_class()()
+    return await lifecycle.get(name)
@@ -0,0 +1,221 @@
+"""容量规划用的模拟后端：按可配置的分布模拟排队、首 token 时间、生成速度与错误/超时，不启动浏览器。
+
+与 MockCopilotProxy（固定每 10ms 一个字符）不同，它复现真实后端对调度有影响的特性：
+- 有限的页面（账号）容量：请求经真实的 PagePool 租用槽位，池满时排队等待（计入 pool:sim 等待指标）
+- 上游排队延迟、首 token 时间、每秒 token 数、回答长度均从分布中采样
+- 按比例注入上游错误与超时（超时请求一直挂起，直到请求 deadline 或 timeout_seconds）
+- 可复现：第 n 个请求的全部采样值只由 (seed, n) 决定，与并发交错无关
+
+config.json 的 sim_backend（分布写法：数字表示常量，或 {"dist": "lognormal", "median": 1.2, "sigma": 0.4}、
+{"dist": "normal", "mean": .., "stddev": ..}、{"dist": "uniform", "low": .., "high": ..}、
+{"dist": "exponential", "mean": ..}）：
+    {"seed": 0, "pages": 4, "queue_delay": 0.05, "ttft": {...}, "tokens_per_second": {...},
+     "answer_tokens": {...}, "chunk_tokens": 4, "error_rate": 0.01, "timeout_rate": 0.005, "timeout_seconds": 60}
+
+请求中 model 为 sim-chat 或 backend 为 "sim" 时路由到这里（其它模型名可在 model_routes 中指向 sim）；请求体的 sim 字段可覆盖单个请求的配置。
+"""
+import asyncio
+import itertools
+import json
+import math
+import random
+import string
+import time
+from typing import Optional
+
+from app.config.settings import get_setting
+from app.services import model_router
+from app.services.circuit_breaker import outcome_of
+from app.services.page_pool import PagePool, PageSlot
+from app.utils import deadline
+from app.utils.metrics import UPSTREAM_RESPONSES
+from .reverse_base import ReverseBase
+
+DEFAULTS = {
+    "seed": 0,
+    "pages": 4,
+    "queue_delay": {"dist": "exponential", "mean": 0.05},
+    "ttft": {"dist": "lognormal", "median": 1.2, "sigma": 0.4},
+    "tokens_per_second": {"dist": "normal", "mean": 40, "stddev": 8},
+    "answer_tokens": {"dist": "lognormal", "median": 200, "sigma": 0.6},
+    "chunk_tokens": 4,
+    "error_rate": 0.0,
+    "timeout_rate": 0.0,
+    "timeout_seconds": 60,
+}
+
+_WORDS = ("simulated", "answer", "token", "page", "queue", "latency", "capacity", "model", "stream", "result")
+
+
+class SimulatedError(RuntimeError):
+    """注入的上游错误。"""
+
+
+def sample(spec, rng: random.Random) -> float:
+    """从分布描述中采样一个非负值。"""
+    if isinstance(spec, (int, float)):
+        return max(0.0, float(spec))
+    dist = spec.get("dist", "constant")
+    if dist == "constant":
+        value = spec["value"]
+    elif dist == "lognormal":
+        value = rng.lognormvariate(math.log(spec["median"]), spec.get("sigma", 0.5))
+    elif dist == "normal":
+        value = rng.gauss(spec["mean"], spec.get("stddev", 0.0))
+    elif dist == "uniform":
+        value = rng.uniform(spec["low"], spec["high"])
+    elif dist == "exponential":
+        value = rng.expovariate(1.0 / spec["mean"]) if spec["mean"] > 0 else 0.0
+    else:
+        raise ValueError(f"unknown distribution: {dist}")
+    return max(0.0, float(value))
+
+
+class _Plan:
+    """一个请求的全部采样结果（在请求到达时一次性生成）。"""
+
+    __slots__ = ("request_no", "queue_delay", "ttft", "tokens_per_second", "answer_tokens", "outcome", "rng",
+                 "chunk_tokens", "timeout_seconds")
+
+    def __init__(self, config: dict, request_no: int, max_tokens: Optional[int]):
+        # 字符串种子在不同进程间也稳定（不受 PYTHONHASHSEED 影响）
+        rng = random.Random(f"{config['seed']}:{request_no}")
+        self.request_no = request_no
+        self.rng = rng
+        self.chunk_tokens = max(1, int(config["chunk_tokens"]))
+        self.timeout_seconds = float(config["timeout_seconds"])
+        self.queue_delay = sample(config["queue_delay"], rng)
+        self.ttft = sample(config["ttft"], rng)
+        self.tokens_per_second = max(0.1, sample(config["tokens_per_second"], rng))
+        self.answer_tokens = max(1, int(round(sample(config["answer_tokens"], rng))))
+        if max_tokens:
+            self.answer_tokens = min(self.answer_tokens, int(max_tokens))
+        roll = rng.random()
+        if roll < config["error_rate"]:
+            self.outcome = "error"
+        elif roll < config["error_rate"] + config["timeout_rate"]:
+            self.outcome = "timeout"
+        else:
+            self.outcome = "ok"
+
+
+class SimulatedBackend(ReverseBase):
+    def __init__(self, *args, **kwargs):
+        self.config = {**DEFAULTS, **(get_setting("sim_backend", {}) or {})}
+        self._counter = itertools.count()
+        self.pool: Optional[PagePool] = None
+        self._outcomes = {"ok": 0, "error": 0, "timeout": 0}
+
+    async def init(self):
+        # 分布配置有误时在预热/首次使用时报错，而不是在请求中途
+        rng = random.Random(0)
+        for key in ("queue_delay", "ttft", "tokens_per_second", "answer_tokens"):
+            try:
+                sample(self.config[key], rng)
+            except (KeyError, TypeError, ValueError) as e:
+                raise ValueError(f"invalid sim_backend.{key}: {e}") from None
+
+        async def make_page(slot: PageSlot):
+            return f"sim-page-{slot.slot_id}"
+
+        async def close_page(page):
+            return
+
+        self.pool = PagePool("sim", int(self.config["pages"]), make_page, page_closer=close_page)
+        await self.pool.start()
+
+    async def set_dynamic_data(self, data: dict):
+        return
+
+    async def prepare_send_conversation(self):
+        return
+
+    def _plan(self, data: dict) -> _Plan:
+        config = self.config
+        if isinstance(data.get("sim"), dict):
+            config = {**config, **data["sim"]}
+        # 与 gemini 一致：请求未指定 max_tokens 时使用 model_routes 中该模型的 defaults
+        max_tokens = data.get("max_tokens") or model_router.resolve(data.get("model", "sim-chat")).defaults.get("max_tokens")
+        return _Plan(config, next(self._counter), max_tokens)
+
+    def _tokens(self, plan: _Plan, n: int) -> str:
+        return "".join(" " + plan.rng.choice(_WORDS) for _ in range(n))
+
+    async def _upstream(self, plan: _Plan):
+        """模拟上游排队与首 token 之前的等待；错误与超时在这里注入。"""
+        await deadline.wait(asyncio.sleep(plan.queue_delay), deadline.SEND)
+        if plan.outcome == "error":
+            self._outcomes["error"] += 1
+            UPSTREAM_RESPONSES.labels("sim", "500").inc()
+            raise SimulatedError(f"simulated upstream error (request {plan.request_no})")
+        if plan.outcome == "timeout":
+            self._outcomes["timeout"] += 1
+            UPSTREAM_RESPONSES.labels("sim", "timeout").inc()
+            await deadline.wait(asyncio.sleep(plan.timeout_seconds), deadline.FIRST_TOKEN)
+            raise asyncio.TimeoutError(f"simulated upstream timeout (request {plan.request_no})")
+        await deadline.wait(asyncio.sleep(plan.ttft), deadline.FIRST_TOKEN)
+        UPSTREAM_RESPONSES.labels("sim", "200").inc()
+
+    async def send_conversation(self, text=None, payload=None):
+        data = payload or {}
+        model = data.get("model", "sim-chat")
+        plan = self._plan(data)
+        chat_id = "chatcmpl-" + "".join(plan.rng.choices(string.ascii_letters + string.digits, k=29))
+
+        if not data.get("stream"):
+            slot = await deadline.wait(self.pool.acquire(), deadline.LEASE)
+            ok = None
+            try:
+                await self._upstream(plan)
+                await deadline.wait(asyncio.sleep(plan.answer_tokens / plan.tokens_per_second), deadline.COMPLETION)
+                ok = True
+            except Exception as e:
+                ok = outcome_of(e)
+                raise
+            finally:
+                self.pool.release(slot, ok)
+            self._outcomes["ok"] += 1
+            return {"question": "", "answer": self._tokens(plan, plan.answer_tokens).strip(), "id": chat_id,
+                    "completion_tokens": plan.answer_tokens}
+
+        def chunk(delta: dict, finish_reason=None) -> str:
+            body = {
+                "id": chat_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "logprobs": None, "finish_reason": finish_reason}],
+            }
+            return f"data: {json.dumps(body)}\n\n"
+
+        async def gen():
+            slot = await deadline.wait(self.pool.acquire(), deadline.LEASE)
+            ok = None
+            try:
+                await self._upstream(plan)
+                yield chunk({"role": "assistant", "content": ""})
+                remaining = plan.answer_tokens
+                while remaining > 0:
+                    n = min(plan.chunk_tokens, remaining)
+                    remaining -= n
+                    yield chunk({"content": self._tokens(plan, n)})
+                    if remaining:
+                        await deadline.wait(asyncio.sleep(n / plan.tokens_per_second), deadline.COMPLETION)
+                yield chunk({}, "stop")
+                yield "data: [DONE]\n\n"
+                self._outcomes["ok"] += 1
+                ok = True
+            except Exception as e:
+                ok = outcome_of(e)
+                raise
+            finally:
+                self.pool.release(slot, ok)
+
+        return gen()
+
+    async def close_client(self):
+        if self.pool is not None:
+            await self.pool.close(float(get_setting("drain_timeout", 10.0)))
+
+    def stats(self) -> dict:
+        return {"pool": self.pool.stats() if self.pool else None, "outcomes": dict(self._outcomes)}
@@ -1,6 +1,9 @@
+import logging
 import re
 import os
 
+logger = logging.getLogger(__name__)
+
 class JSObfuscatedProcessor:
     def __init__(self):
         self.target_pattern = r'\.responseModalities&&\(\('
@@ -19,11 +22,11 @@ class JSObfuscatedProcessor:
 
         # 2. 检查是否有至少两个匹配项，并选择第二个
         if len(all_anchor_matches) < 2:
-            print(f"[Processor] 错误: 只找到了 {len(all_anchor_matches)} 个锚点，需要至少 2 个。")
+            logger.error("[Processor] 只找到了 %d 个锚点，需要至少 2 个。", len(all_anchor_matches))
             return None, None
 
         second_anchor_match = all_anchor_matches[1]
-        print(f"[Processor] 找到了 {len(all_anchor_matches)} 个锚点。使用第二个，位置 at {second_anchor_match.start()}")
+        logger.debug("[Processor] 找到了 %d 个锚点。使用第二个，位置 at %d", len(all_anchor_matches), second_anchor_match.start())
 
         # 3. 从第二个锚点的结束位置开始查找
         search_start_pos = second_anchor_match.end()
@@ -31,15 +34,15 @@ class JSObfuscatedProcessor:
         yield_match = re.search(self.yield_pattern, substring_to_search)
 
         if not yield_match:
-            print(f"[Processor] 在第二个特征字符串之后未找到匹配的双参数 yield 模式")
+            logger.error("[Processor] 在第二个特征字符串之后未找到匹配的双参数 yield 模式")
             return None, None
 
         actual_pos = search_start_pos + yield_match.start()
-        print(f"[Processor] 找到第一个双参数 yield 匹配 at position {actual_pos}")
+        logger.debug("[Processor] 找到第一个双参数 yield 匹配 at position %d", actual_pos)
 
         # 4. 从匹配中动态捕获所有随机变量名
         var_name, func_name, obj_name, prop_name = yield_match.groups()
-        print(f"[Processor] 捕获成功: {func_name} 和 {prop_name}")
+        logger.info("[Processor] 捕获成功: %s 和 %s", func_name, prop_name)
 
         # 5. 准备要插入的代码
         insert_code = f"window.MY_{func_name.upper()}=_.{func_name};\nwindow.MY_{prop_name.upper()}={obj_name}.{prop_name};\n"
@@ -52,7 +55,7 @@ class JSObfuscatedProcessor:
 
         modified_code = js_code[:actual_pos] + indented_code + js_code[actual_pos:]
 
-        print(f"[Processor] 调试代码已准备好注入。")
+        logger.debug("[Processor] 调试代码已准备好注入。")
 
         # 7. 准备返回的数据
         captured_data = {
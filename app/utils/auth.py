@@ -0,0 +1,20 @@
+"""管理令牌校验：config.json 的 admin_token，请求头 Authorization: Bearer <token> 或 X-Admin-Token。
+
+未配置 admin_token 时任何请求都不是管理请求。
+"""
+import hmac
+
+from app.config.settings import get_setting
+
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+
+
+def is_admin(headers) -> bool:
+    token = get_setting("admin_token")
+    if not token or headers is None:
+        return False
+    supplied = headers.get(ADMIN_TOKEN_HEADER)
+    if supplied is None:
+        scheme, _, value = (headers.get("Authorization") or "").partition(" ")
+        supplied = value.strip() if scheme.lower() == "bearer" else None
+    return supplied is not None and hmac.compare_digest(supplied.encode(), str(token).encode())
@@ -0,0 +1,191 @@
+"""按 token 预算压缩多轮对话：超出预算时丢弃/截断最旧的轮次，并去重重复的大段内容（如工具输出）。
+
+- 系统提示词不在对话列表中，调用方从预算中扣除它的 token 数，始终保留
+- 最新一条消息始终完整保留
+- 每个对话的前缀链式哈希与各消息 token 数按对话缓存：新请求先与缓存的对话逐条比较
+  （字符串比较，不再哈希），只对新增的消息计算哈希与 token 数
+- 切点按 (对话前缀哈希, 预算) 缓存：对话每增加一轮，切点只会向后移动，
+  从上一轮的切点继续推进即可，无需重新遍历全部历史
+- 只有超出预算时才改写内容（丢弃、截断、去重）；预算内的对话原样发送
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from app.utils.tokens import count_message, count_text
+
+TRUNCATED_MARKER = "[...earlier content truncated]\n"
+DUPLICATE_MARKER = "[duplicate of an earlier message omitted]"
+
+# 截断边界消息时至少保留的 token 数，太少的残片没有意义
+MIN_PARTIAL_TOKENS = 256
+# 只对足够长的内容去重（短消息重复很正常，如“继续”）
+DEDUP_MIN_CHARS = 512
+
+
+# 同一首条消息下缓存的对话数（相同开场白的不同对话）
+_CONVERSATIONS_PER_KEY = 8
+
+
+def _chain(digest: bytes, message: dict) -> bytes:
+    """在前缀哈希 digest 之后追加一条消息的链式哈希。"""
+    h = hashlib.blake2b(digest, digest_size=16)
+    h.update(str(message.get("role", "")).encode("utf-8"))
+    h.update(b"\x00")
+    h.update(str(message.get("content", "")).encode("utf-8"))
+    return h.digest()
+
+
+class _Conversation:
+    """一个对话已计算过的前缀：各消息的 (role, content)、链式哈希与 token 数。"""
+
+    __slots__ = ("messages", "hashes", "tokens")
+
+    def __init__(self, messages: list, hashes: List[bytes], tokens: List[int]):
+        self.messages = messages
+        self.hashes = hashes
+        self.tokens = tokens
+
+    def common_prefix(self, messages: List[dict]) -> int:
+        n = 0
+        for (role, content), m in zip(self.messages, messages):
+            if role != m.get("role") or content != m.get("content"):
+                break
+            n += 1
+        return n
+
+
+class Compactor:
+    def __init__(self, family: str = "gpt", max_entries: int = 4096, max_conversations: int = 256):
+        self.family = family
+        self.max_entries = max_entries
+        self.max_conversations = max_conversations
+        self._cuts: "OrderedDict[tuple, int]" = OrderedDict()
+        # 首条消息的哈希 -> 以它开头的对话（最近使用的在后）
+        self._conversations: "OrderedDict[bytes, List[_Conversation]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def prefix_state(self, messages: List[dict]) -> Tuple[List[bytes], List[int]]:
+        """返回 (hashes, tokens)：与缓存中最长的相同前缀复用结果，只计算新增消息。"""
+        if not messages:
+            return [], []
+        first = _chain(b"", messages[0])
+        with self._lock:
+            candidates = list(self._conversations.get(first, ()))
+        best, common = None, 0
+        for conversation in candidates:
+            n = conversation.common_prefix(messages)
+            if n > common:
+                best, common = conversation, n
+        hashes = best.hashes[:common] if best is not None else []
+        tokens = best.tokens[:common] if best is not None else []
+        digest = hashes[-1] if hashes else b""
+        for m in messages[common:]:
+            digest = _chain(digest, m)
+            hashes.append(digest)
+            tokens.append(count_message(m, self.family))
+        if common < len(messages):
+            # 缓存的对话是本次请求的前缀（同一对话的上一轮）时替换它
+            replaces = best if best is not None and common == len(best.messages) else None
+            self._store_conversation(first, replaces, messages, hashes, tokens)
+        return hashes, tokens
+
+    def _store_conversation(self, first: bytes, replaces: Optional[_Conversation], messages: List[dict],
+                            hashes: List[bytes], tokens: List[int]):
+        conversation = _Conversation([(m.get("role"), m.get("content")) for m in messages], hashes, tokens)
+        with self._lock:
+            entries = self._conversations.setdefault(first, [])
+            self._conversations.move_to_end(first)
+            if replaces is not None and replaces in entries:
+                entries.remove(replaces)
+            entries.append(conversation)
+            del entries[:-_CONVERSATIONS_PER_KEY]
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+
+    def _cached_cut(self, hashes: List[bytes], budget: int) -> int:
+        with self._lock:
+            for k in range(len(hashes), 0, -1):
+                cut = self._cuts.get((hashes[k - 1], budget))
+                if cut is not None:
+                    self._cuts.move_to_end((hashes[k - 1], budget))
+                    return cut
+        return 0
+
+    def _store_cut(self, key: tuple, cut: int):
+        with self._lock:
+            self._cuts[key] = cut
+            self._cuts.move_to_end(key)
+            while len(self._cuts) > self.max_entries:
+                self._cuts.popitem(last=False)
+
+    def find_cut(self, messages: List[dict], budget: int) -> Tuple[int, List[int]]:
+        """返回 (cut, tokens)：保留 messages[cut:] 时不超过 budget（最后一条消息始终保留）。"""
+        hashes, tokens = self.prefix_state(messages)
+        total = sum(tokens)
+        if total <= budget or len(messages) <= 1:
+            return 0, tokens
+        cut = min(self._cached_cut(hashes, budget), len(messages) - 1)
+        kept = total - sum(tokens[:cut])
+        while cut < len(messages) - 1 and kept > budget:
+            kept -= tokens[cut]
+            cut += 1
+        self._store_cut((hashes[-1], budget), cut)
+        return cut, tokens
+
+    def compact(self, messages: List[dict], budget: int) -> Tuple[List[dict], dict]:
+        """返回 (压缩后的消息列表, 统计)。messages 元素形如 {"role": ..., "content": ...}，不会被原地修改。"""
+        if budget <= 0 or not messages:
+            return messages, {}
+        cut, tokens = self.find_cut(messages, budget)
+        info = {"tokens_before": sum(tokens), "dropped": 0, "truncated": 0, "deduplicated": 0}
+        if info["tokens_before"] <= budget:
+            # 预算内：不改写模型看到的内容
+            info["tokens_after"] = info["tokens_before"]
+            return messages, info
+        kept = list(messages[cut:])
+        info["dropped"] = cut
+
+        # 边界消息：预算还有富余时保留它的尾部而不是整条丢弃
+        if cut > 0:
+            room = budget - sum(tokens[cut:])
+            boundary = messages[cut - 1]
+            text = boundary.get("content")
+            # 只截断用户消息：以 model 开头的残片随后也会被丢弃
+            if room >= MIN_PARTIAL_TOKENS and isinstance(text, str) and text \
+                    and boundary.get("role") in ("user", None):
+                chars = int(len(text) * room / max(tokens[cut - 1], 1))
+                kept.insert(0, {**boundary, "content": TRUNCATED_MARKER + text[-chars:]})
+                info["dropped"] -= 1
+                info["truncated"] = 1
+
+        # 对话需要从用户消息开始
+        while len(kept) > 1 and kept[0].get("role") not in ("user", None):
+            kept.pop(0)
+            info["dropped"] += 1
+
+        # 窗口内去重：保留首次出现，后续相同的大段内容替换为占位符（最新一条除外）
+        seen = set()
+        for i, m in enumerate(kept[:-1]):
+            text = m.get("content")
+            if not isinstance(text, str) or len(text) < DEDUP_MIN_CHARS:
+                continue
+            digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+            if digest in seen:
+                kept[i] = {**m, "content": DUPLICATE_MARKER}
+                info["deduplicated"] += 1
+            else:
+                seen.add(digest)
+
+        if info["dropped"] or info["truncated"] or info["deduplicated"]:
+            # 未改写的消息沿用已知的 token 数，只对截断、去重后的消息重新计数
+            known = {id(m): t for m, t in zip(messages[cut:], tokens[cut:])}
+            info["tokens_after"] = sum(known.get(id(m)) or count_message(m, self.family) for m in kept)
+        else:
+            info["tokens_after"] = info["tokens_before"]
+        return kept, info
+
+
+def system_tokens(system_prompt: Optional[str], family: str = "gpt") -> int:
+    return count_text(system_prompt or "", family)
@@ -0,0 +1,122 @@
+"""端到端请求截止时间：每个请求一个 deadline，贯穿租用页面、模式切换、发送、首 token 与完成的每一次等待。
+
+- 来源（优先级）：请求头 X-Request-Timeout（秒）> 请求体 timeout 字段 > config.json 的 request_timeouts[model]
+  > request_timeout（默认 120 秒）；上限为 max_request_timeout
+- 通过 contextvar 传递，后端在各阶段调用 wait(aw, stage) / remaining()，无需修改方法签名
+- 超时抛出 DeadlineExceeded（asyncio.TimeoutError 的子类），stage 标明卡在哪个阶段
+"""
+import asyncio
+import contextvars
+import time
+from typing import Mapping, Optional
+
+from app.config.settings import get_setting
+
+TIMEOUT_HEADER = "X-Request-Timeout"
+
+DEFAULT_TIMEOUT = 120.0
+DEFAULT_MAX_TIMEOUT = 600.0
+
+# 请求的阶段（用于错误信息与指标标签）
+LEASE = "lease"
+MODE_SWITCH = "mode_switch"
+SEND = "send"
+FIRST_TOKEN = "first_token"
+COMPLETION = "completion"
+
+_current: contextvars.ContextVar[Optional["Deadline"]] = contextvars.ContextVar("chat2api_deadline", default=None)
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    def __init__(self, stage: str, timeout: float):
+        super().__init__(f"request deadline of {timeout:g}s exceeded during {stage}")
+        self.stage = stage
+        self.timeout = timeout
+
+
+class Deadline:
+    __slots__ = ("timeout", "expires_at")
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def check(self, stage: str):
+        if self.expired:
+            raise DeadlineExceeded(stage, self.timeout)
+
+    async def wait(self, aw, stage: str):
+        """等待 aw，最多到截止时间；超时取消 aw 并抛出 DeadlineExceeded。"""
+        try:
+            return await asyncio.wait_for(aw, self.remaining())
+        except asyncio.TimeoutError as e:
+            # aw 自身抛出的超时（未到截止时间）原样传播
+            if isinstance(e, DeadlineExceeded) or not self.expired:
+                raise
+            raise DeadlineExceeded(stage, self.timeout) from None
+
+
+def _parse_seconds(value) -> Optional[float]:
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        return None
+    return seconds if seconds > 0 else None
+
+
+def timeout_for_model(model: Optional[str]) -> float:
+    per_model = get_setting("request_timeouts", {}) or {}
+    if model and model in per_model:
+        return float(per_model[model])
+    return float(get_setting("request_timeout", DEFAULT_TIMEOUT))
+
+
+def from_request(headers: Mapping, payload: Optional[dict]) -> Deadline:
+    payload = payload if isinstance(payload, dict) else {}
+    timeout = _parse_seconds(headers.get(TIMEOUT_HEADER)) or _parse_seconds(payload.get("timeout"))
+    if timeout is None:
+        timeout = timeout_for_model(payload.get("model"))
+    return Deadline(min(timeout, float(get_setting("max_request_timeout", DEFAULT_MAX_TIMEOUT))))
+
+
+def current() -> Optional[Deadline]:
+    return _current.get()
+
+
+def activate(deadline: Optional[Deadline]):
+    """在当前上下文绑定 deadline（响应体在另一个任务中迭代时需要重新绑定）。"""
+    _current.set(deadline)
+
+
+def remaining(default: Optional[float] = None) -> Optional[float]:
+    """当前请求剩余的秒数；没有 deadline 时返回 default（如启动预热阶段）。"""
+    deadline = _current.get()
+    return default if deadline is None else deadline.remaining()
+
+
+def cap_ms(step_ms: float) -> float:
+    """单步 UI 等待的 Playwright timeout（毫秒）：不超过 step_ms，也不超过剩余时间。
+
+    Playwright 把 0 视为不限时，因此至少返回 1ms。
+    """
+    deadline = _current.get()
+    if deadline is None:
+        return step_ms
+    return max(1.0, min(step_ms, deadline.remaining() * 1000.0))
+
+
+async def wait(aw, stage: str, default: Optional[float] = None):
+    """在当前 deadline 下等待 aw；没有 deadline 时按 default 秒超时（None 表示不限）。"""
+    deadline = _current.get()
+    if deadline is not None:
+        return await deadline.wait(aw, stage)
+    if default is None:
+        return await aw
+    return await asyncio.wait_for(aw, default)
@@ -0,0 +1,263 @@
+"""上游交互的录制与回放（带版本号的 JSON fixture），用于离线复现与基准测试。
+
+录制（config.json 的 fixture_recording：{"enabled": false, "dir": "fixtures"}）：
+- copilot：每个请求在页面 websocket 上收到的帧（含相对时间），收到 done 帧时写出
+- gemini：GenerateContent 的请求体（含 checksum）与响应状态、响应文本
+- bundle：被改写的 m=_b JS 包原文（按 sha256 去重存放在 bundles/ 下）与捕获的变量名
+文件写在 <dir>/<kind>/<id>.json，写文件在线程池中完成；不记录请求头与 cookie。
+
+回放（不需要网络与浏览器）：
+- replay_frames：把 copilot 帧逐个送入 CopilotReverse 的帧处理函数
+- replay_gemini：返回一个 GeminiReverse2，HTTP 请求由 ReplaySession 按请求体匹配录制的响应，checksum 使用录制值
+"""
+import asyncio
+import hashlib
+import itertools
+import json
+import logging
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from app.config.settings import ROOT, get_setting
+
+logger = logging.getLogger(__name__)
+
+FIXTURE_VERSION = 1
+KINDS = ("copilot", "gemini", "bundle")
+
+
+class FixtureError(ValueError):
+    pass
+
+
+def _config() -> dict:
+    return get_setting("fixture_recording", {}) or {}
+
+
+def enabled() -> bool:
+    return bool(_config().get("enabled"))
+
+
+def fixture_dir() -> Path:
+    path = Path(_config().get("dir") or "fixtures")
+    return path if path.is_absolute() else ROOT / path
+
+
+class Recording:
+    """一次请求的录制；events 为 [相对秒数, 数据]。"""
+
+    __slots__ = ("kind", "fixture_id", "request", "events", "response", "meta", "_started")
+
+    def __init__(self, kind: str, request: Optional[dict] = None, **meta):
+        self.kind = kind
+        self.fixture_id = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+        self.request = request or {}
+        self.events: List[list] = []
+        self.response: Optional[dict] = None
+        self.meta = meta
+        self._started = time.perf_counter()
+
+    def add(self, data):
+        self.events.append([round(time.perf_counter() - self._started, 6), data])
+
+    def to_dict(self) -> dict:
+        fixture = {
+            "version": FIXTURE_VERSION,
+            "kind": self.kind,
+            "id": self.fixture_id,
+            "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "meta": self.meta,
+            "request": self.request,
+        }
+        if self.events:
+            fixture["events"] = self.events
+        if self.response is not None:
+            fixture["response"] = self.response
+        return fixture
+
+    def save(self):
+        """在线程池中写出（没有运行中的事件循环时直接写）。"""
+        fixture = self.to_dict()
+        try:
+            asyncio.get_running_loop().run_in_executor(None, _write, fixture)
+        except RuntimeError:
+            _write(fixture)
+
+
+def start(kind: str, request: Optional[dict] = None, **meta) -> Optional[Recording]:
+    """未开启录制时返回 None（调用方只需检查 None）。"""
+    if not enabled():
+        return None
+    return Recording(kind, request, **meta)
+
+
+def record_exchange(kind: str, request: dict, response: dict, **meta):
+    recording = start(kind, request, **meta)
+    if recording is not None:
+        recording.response = response
+        recording.save()
+
+
+def record_bundle(url: str, code: str, captured: Optional[dict] = None):
+    if not enabled():
+        return
+    digest = hashlib.sha256(code.encode("utf-8")).hexdigest()
+    recording = Recording("bundle", {"url": url}, captured_js_vars=captured)
+    recording.response = {"file": f"bundles/{digest}.js", "sha256": digest, "bytes": len(code)}
+    try:
+        asyncio.get_running_loop().run_in_executor(None, _write_bundle, digest, code, recording.to_dict())
+    except RuntimeError:
+        _write_bundle(digest, code, recording.to_dict())
+
+
+def _write(fixture: dict):
+    try:
+        directory = fixture_dir() / fixture["kind"]
+        directory.mkdir(parents=True, exist_ok=True)
+        with open(directory / f"{fixture['id']}.json", "w", encoding="utf-8") as f:
+            json.dump(fixture, f, ensure_ascii=False, indent=1)
+    except Exception as e:
+        logger.warning("[fixtures] write failed for %s/%s: %s", fixture["kind"], fixture["id"], e)
+
+
+def _write_bundle(digest: str, code: str, fixture: dict):
+    try:
+        path = fixture_dir() / "bundle" / "bundles" / f"{digest}.js"
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(code, encoding="utf-8")
+    except Exception as e:
+        logger.warning("[fixtures] bundle write failed for %s: %s", digest, e)
+        return
+    _write(fixture)
+
+
+def load(path) -> dict:
+    path = Path(path)
+    with open(path, encoding="utf-8") as f:
+        fixture = json.load(f)
+    version = fixture.get("version")
+    if version != FIXTURE_VERSION:
+        raise FixtureError(f"{path}: unsupported fixture version {version!r} (expected {FIXTURE_VERSION})")
+    if fixture.get("kind") not in KINDS:
+        raise FixtureError(f"{path}: unknown fixture kind {fixture.get('kind')!r}")
+    fixture["_path"] = str(path)
+    return fixture
+
+
+def iter_fixtures(directory, kind: str) -> Iterator[dict]:
+    """按文件名顺序读取 <directory>/<kind>/*.json。"""
+    for path in sorted((Path(directory) / kind).glob("*.json")):
+        yield load(path)
+
+
+def bundle_code(fixture: dict) -> str:
+    path = Path(fixture["_path"]).parent / fixture["response"]["file"]
+    return path.read_text(encoding="utf-8")
+
+
+def _body_key(body) -> str:
+    return json.dumps(body, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+
+# ------------------------------ 回放 ------------------------------
+
+class _ReplayResponse:
+    def __init__(self, response: dict):
+        self.status = int(response.get("status", 200))
+        self._text = response.get("text", "")
+
+    async def text(self) -> str:
+        return self._text
+
+    async def json(self):
+        return json.loads(self._text)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class ReplaySession:
+    """代替 aiohttp.ClientSession：按请求体匹配录制的 gemini 响应。
+
+    strict=False 时未匹配的请求按录制顺序轮流返回响应（用于修改过请求的基准测试）。
+    """
+
+    def __init__(self, fixtures: List[dict], strict: bool = True):
+        self._by_body = {_body_key(f["request"].get("body")): f["response"] for f in fixtures}
+        self._cycle = itertools.cycle([f["response"] for f in fixtures])
+        self.strict = strict
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def post(self, url, json=None, **kwargs):
+        response = self._by_body.get(_body_key(json))
+        if response is None:
+            if self.strict:
+                raise FixtureError("no recorded response for request body")
+            response = next(self._cycle)
+        return _ReplayResponse(response)
+
+
+def _conversation_sha(body) -> Optional[str]:
+    """与 GeminiReverse2.crypto_conversation 相同：对话内容以空格拼接后的 SHA-256。"""
+    try:
+        text = " ".join(turn[0][0][1] for turn in body[1])
+    except (IndexError, KeyError, TypeError):
+        return None
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ReplayPage:
+    """代替页面：checksum 的 evaluate 按脚本中的对话哈希返回录制的 checksum。"""
+
+    def __init__(self, fixtures: List[dict]):
+        self._digests = {_conversation_sha(f["request"].get("body")): f["request"].get("digest") for f in fixtures}
+
+    async def evaluate(self, script, *args):
+        for sha, digest in self._digests.items():
+            if sha and sha in script:
+                return digest
+        return None
+
+    def on(self, *args):
+        return None
+
+
+def replay_gemini(fixtures: List[dict], strict: bool = True):
+    """返回一个已“初始化”的 GeminiReverse2，send_conversation 完全离线执行。"""
+    from app.services.gemini_reverse_2 import GeminiReverse2
+
+    if not fixtures:
+        raise FixtureError("no gemini fixtures to replay")
+    reverser = GeminiReverse2()
+    reverser._initialized = True
+    reverser.page = ReplayPage(fixtures)
+    reverser.captured_js_vars = fixtures[0]["request"].get("captured_js_vars") or {"func_name": "f", "prop_name": "p"}
+    reverser.headers = {}
+    reverser.cookies = []
+    reverser._http_session = ReplaySession(fixtures, strict)
+    return reverser
+
+
+async def replay_frames(reverser, state, fixture: dict, speed: float = 0.0):
+    """把录制的 copilot 帧送入 reverser._handle_frame；speed > 0 时按录制间隔（除以 speed）回放。"""
+    previous = 0.0
+    for offset, frame in fixture.get("events", ()):
+        if speed > 0 and offset > previous:
+            await asyncio.sleep((offset - previous) / speed)
+        previous = offset
+        reverser._handle_frame(state, frame)
@@ -0,0 +1,171 @@
+"""结构化、分级、非阻塞的日志管线。
+
+- 业务代码只把 LogRecord 放进队列（QueueHandler），格式化与写出在后台线程（QueueListener）中完成
+- 大对象用 LazyJson 包装：只有日志级别启用时才会被序列化，且序列化发生在后台线程，并按长度截断
+- 敏感字段（Authorization / Cookie / token 等请求头与 cookie 值）在序列化时脱敏
+- 按模块控制级别：config.json 的 log_level（全局）与 log_levels（{"logger 名": "DEBUG"}）
+- 输出格式：log_format 为 "text"（默认）或 "json"（每行一个 JSON 对象）
+
+用法：
+    logger = logging.getLogger(__name__)
+    logger.debug("payload %s", LazyJson(payload))
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+from typing import Any, Optional
+
+from app.config.settings import get_setting
+
+DEFAULT_MAX_CHARS = 2000
+REDACTED = "***"
+
+# 请求头 / 字段名中出现这些片段时脱敏
+_SECRET_KEY = re.compile(
+    r"(?i)(authorization|cookie|token|secret|password|passwd|api[-_]?key|sapisid|x-goog-api|x-browser-validation|session)"
+)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _redact(obj: Any, depth: int = 0) -> Any:
+    if depth > 20:
+        return obj
+    if isinstance(obj, dict):
+        # cookie 列表形如 {"name": ..., "value": ...}
+        if "name" in obj and "value" in obj and isinstance(obj.get("value"), str):
+            return {k: (REDACTED if k == "value" else _redact(v, depth + 1)) for k, v in obj.items()}
+        return {
+            k: (REDACTED if isinstance(k, str) and _SECRET_KEY.search(k) else _redact(v, depth + 1))
+            for k, v in obj.items()
+        }
+    if isinstance(obj, (list, tuple)):
+        return [_redact(v, depth + 1) for v in obj]
+    return obj
+
+
+def truncate(text: str, max_chars: Optional[int] = None) -> str:
+    if max_chars is None:
+        max_chars = int(get_setting("log_max_chars", DEFAULT_MAX_CHARS))
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}...(+{len(text) - max_chars} chars)"
+
+
+class LazyJson:
+    """延迟序列化的日志参数：脱敏 + 紧凑 JSON + 截断，只在真正写出时（后台线程）计算。
+
+    :param obj: 要记录的对象；dict 会做一次浅拷贝，避免后台线程序列化时调用方仍在修改它
+    :param max_chars: 截断长度，默认取 config.json 的 log_max_chars
+    """
+
+    __slots__ = ("obj", "max_chars")
+
+    def __init__(self, obj: Any, max_chars: Optional[int] = None):
+        self.obj = dict(obj) if isinstance(obj, dict) else obj
+        self.max_chars = max_chars
+
+    def __str__(self):
+        try:
+            text = json.dumps(_redact(self.obj), ensure_ascii=False, separators=(",", ":"), default=str)
+        except Exception as e:
+            text = f"<unserializable {type(self.obj).__name__}: {e}>"
+        return truncate(text, self.max_chars)
+
+
+class LazyText:
+    """延迟截断的长文本（如上游响应体）。"""
+
+    __slots__ = ("text", "max_chars")
+
+    def __init__(self, text: Any, max_chars: Optional[int] = None):
+        self.text = text
+        self.max_chars = max_chars
+
+    def __str__(self):
+        return truncate(str(self.text), self.max_chars)
+
+
+def sampled(rate: Optional[float] = None) -> bool:
+    """按 log_payload_sample_rate 抽样大负载日志（默认 1.0 即全部记录）。"""
+    if rate is None:
+        rate = float(get_setting("log_payload_sample_rate", 1.0))
+    return rate >= 1.0 or random.random() < rate
+
+
+class _InProcessQueueHandler(logging.handlers.QueueHandler):
+    """标准 QueueHandler 会在调用线程里先格式化消息；同进程内无需序列化，直接入队交给后台线程。"""
+
+    def prepare(self, record):
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        extra = getattr(record, "fields", None)
+        if extra:
+            entry.update(_redact(extra))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        extra = getattr(record, "fields", None)
+        if extra:
+            line += " " + " ".join(f"{k}={v}" for k, v in _redact(extra).items())
+        return line
+
+
+def setup_logging(force: bool = False):
+    """配置 app.* 日志：队列 + 后台线程写出，按模块设置级别。可重复调用（force=True 时重新配置）。"""
+    global _listener
+    if _listener is not None and not force:
+        return
+    shutdown_logging()
+
+    formatter = JsonFormatter() if get_setting("log_format", "text") == "json" else TextFormatter()
+    sink = logging.StreamHandler()
+    sink.setFormatter(formatter)
+
+    log_queue: "queue.SimpleQueue" = queue.SimpleQueue()
+    root = logging.getLogger("app")
+    for h in list(root.handlers):
+        if isinstance(h, _InProcessQueueHandler):
+            root.removeHandler(h)
+    root.addHandler(_InProcessQueueHandler(log_queue))
+    root.setLevel(str(get_setting("log_level", "INFO")).upper())
+    root.propagate = False
+
+    for name, level in (get_setting("log_levels", {}) or {}).items():
+        logging.getLogger(name).setLevel(str(level).upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, sink, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """停止后台线程并写出队列中剩余的日志。"""
+    global _listener
+    listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+atexit.register(shutdown_logging)
+
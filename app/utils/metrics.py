@@ -0,0 +1,252 @@
+"""轻量 Prometheus 指标：Counter / Gauge / Histogram 与文本暴露格式。
+
+不依赖 prometheus_client。热路径只做一次字典查找和一次加法（Histogram 额外一次 bisect），
+每个事件开销在 1µs 量级；渲染只在 /metrics 被抓取时发生。
+
+用法：
+    REQUESTS = Counter("chat2api_requests_total", "...", ("model", "backend"))
+    REQUESTS.labels("gpt-5", "copilot").inc()
+"""
+import math
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+# 默认延迟桶（秒）：覆盖毫秒级锁等待到分钟级 Think Deeper 生成
+DEFAULT_BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0,
+)
+
+_REGISTRY: List["_Metric"] = []
+_REGISTRY_LOCK = threading.Lock()
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        # 原始标签值 -> 子指标，跳过 str() 转换
+        self._lookup: Dict[tuple, object] = {}
+        with _REGISTRY_LOCK:
+            _REGISTRY.append(self)
+
+    def labels(self, *values):
+        """返回（并缓存）某组标签对应的子指标；热路径可以持有返回值避免重复查找。"""
+        child = self._lookup.get(values)
+        if child is None:
+            key = tuple(str(v) for v in values)
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+            child = self._children.setdefault(key, self._new_child())
+            self._lookup[values] = child
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in list(self._children.items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+    def _render_child(self, key, child) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"]
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+
+class GaugeCallback(_Metric):
+    """抓取时才计算的 Gauge：callback 返回 [(label_values, value), ...]。"""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames, callback: Callable[[], Iterable[Tuple[Sequence[str], float]]]):
+        super().__init__(name, documentation, labelnames)
+        self._callback = callback
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            samples = list(self._callback())
+        except Exception:
+            samples = []
+        for values, value in samples:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}")
+        return lines
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _render_child(self, key, child) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), child.counts):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+def render_latest() -> str:
+    """生成 Prometheus 文本暴露格式（text/plain; version=0.0.4）。"""
+    with _REGISTRY_LOCK:
+        metrics = list(_REGISTRY)
+    lines: List[str] = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# ---- 服务级指标 ----
+REQUESTS = Counter(
+    "chat2api_requests_total", "Chat completion requests by model, backend, stream flag and outcome.",
+    ("model", "backend", "stream", "status"),
+)
+REQUEST_LATENCY = Histogram(
+    "chat2api_request_duration_seconds", "End-to-end chat completion latency.",
+    ("model", "backend", "stream"),
+)
+STREAM_TTFT = Histogram(
+    "chat2api_stream_ttft_seconds", "Time from request start to the first streamed content chunk.",
+    ("model", "backend"),
+)
+STREAM_INTER_TOKEN = Histogram(
+    "chat2api_stream_inter_token_seconds", "Gap between consecutive streamed content chunks.",
+    ("model", "backend"),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+TOKENS = Counter(
+    "chat2api_tokens_total", "Prompt and completion tokens by model and backend.",
+    ("model", "backend", "kind"),
+)
+UPSTREAM_RESPONSES = Counter(
+    "chat2api_upstream_responses_total", "Upstream HTTP responses by backend and status code.",
+    ("backend", "status"),
+)
+UPSTREAM_LATENCY = Histogram(
+    "chat2api_upstream_duration_seconds", "Upstream HTTP request latency.",
+    ("backend",),
+)
+MODE_SWITCH = Histogram(
+    "chat2api_mode_switch_seconds", "Time spent switching the Copilot chat mode.",
+    ("mode", "result"),
+)
+DEADLINE_EXCEEDED = Counter(
+    "chat2api_deadline_exceeded_total", "Requests that hit their end-to-end deadline, by stage.",
+    ("backend", "stage"),
+)
+COMPACTION = Counter(
+    "chat2api_compaction_messages_total", "Messages dropped, truncated or deduplicated by prompt compaction.",
+    ("backend", "action"),
+)
+BATCH_ITEMS = Counter(
+    "chat2api_batch_items_total", "Batch items by outcome (ok, error, timeout, skipped).",
+    ("status",),
+)
+HEDGES = Counter(
+    "chat2api_hedges_total", "Hedged requests by primary backend and outcome (issued, won, lost, budget, no_target).",
+    ("backend", "outcome"),
+)
+CIRCUIT_REJECTED = Counter(
+    "chat2api_circuit_rejected_total", "Requests rejected because a circuit breaker was open.",
+    ("breaker",),
+)
+WAIT_TIME = Histogram(
+    "chat2api_wait_seconds", "Time spent waiting on locks and queues.",
+    ("resource",),
+)
+WARM_STARTS = Counter(
+    "chat2api_warm_start_total", "Backend start-ups by warm-start snapshot outcome (hit, miss, stale, rejected, saved).",
+    ("backend", "outcome"),
+)
@@ -0,0 +1,251 @@
+"""采样 CPU 剖析：后台线程定期读取事件循环线程的调用栈，汇总为火焰图可直接使用的格式。
+
+- 全局剖析：GET /admin/profile?seconds=N（见 app/routes/admin.py），采样 N 秒内事件循环线程（threads=all 时包含所有线程）
+- 单请求剖析：请求头 X-Profile: 1（需同时带管理员令牌）只统计该请求的任务（及其创建的子任务）正在运行时的样本；
+  响应头 X-Profile-Id 给出 id，请求结束后用 GET /admin/profile/{id} 取回
+- 输出：collapsed（flamegraph.pl / inferno / speedscope 可导入的 "栈;帧 次数" 文本）或 speedscope JSON
+- 关闭时没有任何开销：没有剖析进行时采样线程与任务工厂都不存在
+
+使用 broker 时 Playwright 的 IPC 在 broker 进程中执行，这里只能看到 worker 进程与 broker 之间的通信。
+"""
+import asyncio
+import contextvars
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from app.config.settings import ROOT
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+DEFAULT_INTERVAL = 0.005
+MAX_STORED = 32
+
+_ROOT_PREFIX = str(ROOT) + os.sep
+
+
+class Profile:
+    def __init__(self, name: str, interval: float, all_threads: bool = False):
+        self.profile_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.interval = interval
+        self.all_threads = all_threads
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started = time.time()
+        self.duration = 0.0
+
+    def add(self, stack: Tuple[str, ...]):
+        self.stacks[stack] += 1
+        self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def speedscope(self) -> dict:
+        frames: List[dict] = []
+        index: Dict[str, int] = {}
+        samples, weights = [], []
+        for stack, count in self.stacks.items():
+            ids = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    name, _, location = frame.partition(" (")
+                    file, _, line = location.rstrip(")").rpartition(":")
+                    frames.append({"name": name, "file": file, "line": int(line)} if line.isdigit() else {"name": frame})
+                ids.append(index[frame])
+            samples.append(ids)
+            weights.append(count * self.interval)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled", "name": self.name, "unit": "seconds",
+                "startValue": 0, "endValue": round(sum(weights), 6),
+                "samples": samples, "weights": weights,
+            }],
+            "name": self.name,
+            "exporter": "chat2api",
+        }
+
+    def summary(self) -> dict:
+        return {"id": self.profile_id, "name": self.name, "samples": self.samples,
+                "interval_seconds": self.interval, "duration_seconds": round(self.duration, 3)}
+
+
+def _frame_label(code) -> str:
+    filename = code.co_filename
+    if filename.startswith(_ROOT_PREFIX):
+        filename = filename[len(_ROOT_PREFIX):]
+    else:
+        # 标准库 / site-packages：只保留包内路径
+        marker = filename.rfind("site-packages" + os.sep)
+        if marker >= 0:
+            filename = filename[marker + len("site-packages") + 1:]
+        else:
+            filename = os.path.basename(filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def _stack(frame) -> Tuple[str, ...]:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return tuple(labels)
+
+
+class _Sampler:
+    """采样线程：只在有剖析进行时运行。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._global: List[Profile] = []
+        # 任务 -> 单请求剖析；由事件循环线程写入，采样线程只读
+        self._tasks: Dict[asyncio.Task, Profile] = {}
+        self._requests = 0
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id = 0
+        self._interval = DEFAULT_INTERVAL
+
+    def _ensure_running(self, interval: float):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._interval = min(self._interval, interval) if self._thread is not None else interval
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="chat2api-profiler", daemon=True)
+            self._thread.start()
+
+    def _idle(self) -> bool:
+        return not self._global and not self._requests
+
+    def _run(self):
+        current_tasks = asyncio.tasks._current_tasks
+        while True:
+            time.sleep(self._interval)
+            with self._lock:
+                if self._idle():
+                    self._thread = None
+                    self._interval = DEFAULT_INTERVAL
+                    return
+                frames = sys._current_frames()
+                loop_frame = frames.get(self._loop_thread_id)
+                loop_stack = _stack(loop_frame) if loop_frame is not None else None
+                for profile in self._global:
+                    if profile.all_threads:
+                        for ident, frame in frames.items():
+                            if ident == threading.get_ident():
+                                continue
+                            stack = loop_stack if ident == self._loop_thread_id else _stack(frame)
+                            if stack is not None:
+                                profile.add((_thread_name(ident),) + stack)
+                    elif loop_stack is not None:
+                        profile.add(loop_stack)
+                if self._tasks and loop_stack is not None:
+                    profile = self._tasks.get(current_tasks.get(self._loop))
+                    if profile is not None:
+                        profile.add(loop_stack)
+
+    def start_global(self, profile: Profile):
+        with self._lock:
+            self._global.append(profile)
+            self._ensure_running(profile.interval)
+
+    def stop_global(self, profile: Profile):
+        with self._lock:
+            self._global.remove(profile)
+        profile.duration = time.time() - profile.started
+
+    def start_request(self, profile: Profile):
+        """在请求任务中调用：当前任务及之后在该上下文中创建的任务计入 profile。"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if not self._requests:
+                _install_task_factory(loop)
+            self._requests += 1
+            self._tasks[asyncio.current_task()] = profile
+            self._ensure_running(profile.interval)
+        _request_profile.set(profile)
+
+    def stop_request(self, profile: Profile):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            for task in [t for t, p in self._tasks.items() if p is profile]:
+                del self._tasks[task]
+            self._requests -= 1
+            if not self._requests:
+                _uninstall_task_factory(loop)
+        profile.duration = time.time() - profile.started
+        _request_profile.set(None)
+
+
+def _thread_name(ident: int) -> str:
+    for thread in threading.enumerate():
+        if thread.ident == ident:
+            return f"thread:{thread.name}"
+    return f"thread:{ident}"
+
+
+_request_profile: contextvars.ContextVar[Optional[Profile]] = contextvars.ContextVar("chat2api_profile", default=None)
+_previous_factory = None
+
+
+def _task_factory(loop, coro, **kwargs):
+    task = _previous_factory(loop, coro, **kwargs) if _previous_factory else asyncio.Task(coro, loop=loop, **kwargs)
+    # 任务工厂在创建方的上下文中调用，子任务继承请求的剖析
+    profile = _request_profile.get()
+    if profile is not None:
+        sampler._tasks[task] = profile
+    return task
+
+
+def _install_task_factory(loop):
+    global _previous_factory
+    _previous_factory = loop.get_task_factory()
+    loop.set_task_factory(_task_factory)
+
+
+def _uninstall_task_factory(loop):
+    global _previous_factory
+    if loop.get_task_factory() is _task_factory:
+        loop.set_task_factory(_previous_factory)
+    _previous_factory = None
+
+
+sampler = _Sampler()
+
+# 单请求剖析结果（有界，最旧的先淘汰）
+_stored: "OrderedDict[str, Profile]" = OrderedDict()
+
+
+def store(profile: Profile):
+    _stored[profile.profile_id] = profile
+    while len(_stored) > MAX_STORED:
+        _stored.popitem(last=False)
+
+
+def stored(profile_id: str) -> Optional[Profile]:
+    return _stored.get(profile_id)
+
+
+def list_stored() -> List[dict]:
+    return [p.summary() for p in reversed(_stored.values())]
+
+
+async def profile_for(seconds: float, interval: float = DEFAULT_INTERVAL, all_threads: bool = False) -> Profile:
+    """剖析整个进程 seconds 秒。"""
+    profile = Profile(f"process {os.getpid()} for {seconds:g}s", interval, all_threads)
+    sampler.start_global(profile)
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        sampler.stop_global(profile)
+    return profile
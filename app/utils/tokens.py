@@ -0,0 +1,182 @@
+"""离线 token 计数：按模型族选择分词器，prompt 计数放到线程池并按消息哈希缓存，流式补全增量计数。
+
+- gpt 族（Copilot / mock）：优先使用 tiktoken 的 o200k_base（需已安装且编码文件已缓存），否则退回估算
+- gemini 族：没有可离线使用的官方分词器，使用估算器
+- estimate_tokens：CJK 字符按 1 token、其它字符按约 4 字符 1 token 估算，足够用于成本/容量统计
+"""
+import asyncio
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Optional
+
+from app.config.settings import get_setting
+
+logger = logging.getLogger(__name__)
+
+# 与 OpenAI 的 chat 计数方式一致：每条消息约 3 个格式 token，回复起始 3 个
+TOKENS_PER_MESSAGE = 3
+TOKENS_REPLY_PRIMER = 3
+
+_CJK = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+
+_FAMILY_ENCODINGS = {"gpt": "o200k_base"}
+_encoders: Dict[str, Callable[[str], int]] = {}
+_encoders_lock = threading.Lock()
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+# 消息哈希 -> token 数（按模型族区分）
+_message_cache: "OrderedDict[tuple, int]" = OrderedDict()
+_message_cache_lock = threading.Lock()
+_MESSAGE_CACHE_SIZE = 8192
+
+
+def estimate_tokens(text: str) -> int:
+    """快速估算 token 数（无需分词器）。"""
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def family_for(backend: Optional[str], model: Optional[str] = None) -> str:
+    """根据后端/模型名返回模型族。"""
+    name = f"{backend or ''} {model or ''}".lower()
+    if "gemini" in name:
+        return "gemini"
+    return "gpt"
+
+
+def _load_encoder(family: str) -> Callable[[str], int]:
+    encoding_name = _FAMILY_ENCODINGS.get(family)
+    if encoding_name:
+        try:
+            import tiktoken
+
+            encoding = tiktoken.get_encoding(encoding_name)
+            return lambda text: len(encoding.encode(text, disallowed_special=()))
+        except Exception as e:
+            logger.info("tokenizer %s unavailable for %s, using estimator: %s", encoding_name, family, e)
+    return estimate_tokens
+
+
+def encoder_for(family: str) -> Callable[[str], int]:
+    encoder = _encoders.get(family)
+    if encoder is None:
+        with _encoders_lock:
+            encoder = _encoders.get(family)
+            if encoder is None:
+                encoder = _encoders[family] = _load_encoder(family)
+    return encoder
+
+
+def count_text(text: str, family: str = "gpt") -> int:
+    return encoder_for(family)(text or "")
+
+
+def _content_text(content) -> str:
+    # OpenAI 多模态消息：[{type: "text", text: ...}, ...]
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(p.get("text", "") for p in content if isinstance(p, dict))
+    return "" if content is None else str(content)
+
+
+def _count_message(family: str, message: dict) -> int:
+    role = str(message.get("role", ""))
+    text = _content_text(message.get("content"))
+    key = (family, hashlib.blake2b(f"{role}\x00{text}".encode("utf-8"), digest_size=16).digest())
+    with _message_cache_lock:
+        cached = _message_cache.get(key)
+        if cached is not None:
+            _message_cache.move_to_end(key)
+            return cached
+    count = TOKENS_PER_MESSAGE + count_text(role, family) + count_text(text, family)
+    with _message_cache_lock:
+        _message_cache[key] = count
+        if len(_message_cache) > _MESSAGE_CACHE_SIZE:
+            _message_cache.popitem(last=False)
+    return count
+
+
+def count_message(message: dict, family: str = "gpt") -> int:
+    """单条消息的 token 数（含格式开销），按内容哈希缓存。"""
+    return _count_message(family, message)
+
+
+def count_messages(messages: Iterable[dict], family: str = "gpt") -> int:
+    """同步计算 prompt token 数；已见过的消息直接命中缓存，多轮对话只需计算新增消息。"""
+    total = TOKENS_REPLY_PRIMER
+    for message in messages or ():
+        if isinstance(message, dict):
+            total += _count_message(family, message)
+    return total
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = int(get_setting("token_count_workers", 2))
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="token-count")
+    return _executor
+
+
+async def count_prompt_tokens(messages, family: str = "gpt") -> int:
+    """在线程池中计算 prompt token 数，不占用事件循环。"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), count_messages, list(messages or ()), family)
+
+
+async def count_completion_tokens(text: str, family: str = "gpt") -> int:
+    if len(text or "") < 2048:
+        return (_encoders.get(family) or estimate_tokens)(text or "")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), count_text, text, family)
+
+
+class StreamUsage:
+    """流式补全的增量计数：每个 delta 到达时累加，无需在结束时重新分词整段文本。
+
+    使用估算器时按字符类别累加后再换算，避免逐字符的 delta 被逐个向上取整而高估。
+    """
+
+    __slots__ = ("family", "_encode", "_tokens", "_cjk", "_other")
+
+    def __init__(self, family: str = "gpt"):
+        self.family = family
+        # 不在事件循环上加载分词器（可能需要读取/下载编码文件）；尚未加载时先用估算器
+        encode = _encoders.get(family)
+        self._encode = None if encode in (None, estimate_tokens) else encode
+        self._tokens = 0
+        self._cjk = 0
+        self._other = 0
+
+    def feed(self, delta: str):
+        if not delta:
+            return
+        if self._encode is not None:
+            self._tokens += self._encode(delta)
+        else:
+            cjk = len(_CJK.findall(delta))
+            self._cjk += cjk
+            self._other += len(delta) - cjk
+
+    @property
+    def completion_tokens(self) -> int:
+        return self._tokens + self._cjk + (self._other + 3) // 4
+
+
+def usage_dict(prompt_tokens: int, completion_tokens: int) -> dict:
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
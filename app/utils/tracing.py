@@ -0,0 +1,221 @@
+"""按请求的阶段追踪（span），导出为 Chrome trace-event JSON（可用 chrome://tracing / Perfetto 离线打开）。
+
+- 采样：config.json 的 trace_sample_rate（0~1，默认 0）；请求头 X-Trace: 0 强制关闭；
+  带管理令牌（admin_token，见 app/utils/auth）的请求可用 X-Trace: 1 强制采样，其它非空值同时作为 trace id 使用。
+  没有管理令牌时强制采样被忽略，按采样率决定（避免任意客户端让每个请求都写 trace 文件）
+- 导出：采样的请求结束后写入 trace_dir（默认 traces/）下的 trace-<id>.json，写文件在线程池中完成；
+  目录中最多保留 trace_max_files（默认 1000）个文件，每次写出后删除最旧的
+- 关闭或未采样时，span() 只做一次 contextvar 读取并返回共享的空上下文
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import List, Optional
+
+from app.config.settings import ROOT, get_setting
+from app.utils.auth import is_admin
+
+logger = logging.getLogger(__name__)
+
+TRACE_HEADER = "X-Trace"
+TRACE_ID_HEADER = "X-Trace-Id"
+DEFAULT_MAX_FILES = 1000
+
+_current: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("chat2api_trace", default=None)
+_tid_counter = 0
+_tid_lock = threading.Lock()
+
+
+def _next_tid() -> int:
+    # 每个 trace 占用 Chrome trace 中的一行（tid），并发请求互不重叠
+    global _tid_counter
+    with _tid_lock:
+        _tid_counter += 1
+        return _tid_counter
+
+
+def _now_us() -> float:
+    return time.perf_counter_ns() / 1000.0
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **kwargs):
+        return None
+
+
+_NOOP = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("trace", "name", "args", "start")
+
+    def __init__(self, trace: "Trace", name: str, args: dict):
+        self.trace = trace
+        self.name = name
+        self.args = args
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = _now_us()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.trace.add_complete(self.name, self.start, _now_us() - self.start, self.args)
+        return False
+
+    def set(self, **kwargs):
+        """在 span 结束前补充参数（如结果状态、字节数）。"""
+        self.args.update(kwargs)
+
+
+class Trace:
+    def __init__(self, trace_id: str, name: str = "request"):
+        self.trace_id = trace_id
+        self.name = name
+        self.tid = _next_tid()
+        self.pid = os.getpid()
+        self.start = _now_us()
+        self.events: List[dict] = []
+        self.finished = False
+
+    def span(self, name: str, **args) -> Span:
+        return Span(self, name, args)
+
+    def add_complete(self, name: str, start_us: float, dur_us: float, args: Optional[dict] = None):
+        self.events.append({
+            "name": name, "cat": "chat2api", "ph": "X",
+            "ts": start_us, "dur": dur_us,
+            "pid": self.pid, "tid": self.tid,
+            "args": args or {},
+        })
+
+    def instant(self, name: str, **args):
+        """记录瞬时事件（例如收到首个 websocket 帧）。可在 Playwright 回调等无 contextvar 的地方直接调用。"""
+        self.events.append({
+            "name": name, "cat": "chat2api", "ph": "i", "s": "t",
+            "ts": _now_us(), "pid": self.pid, "tid": self.tid,
+            "args": args,
+        })
+
+    def to_chrome(self) -> dict:
+        meta = {
+            "name": "thread_name", "ph": "M", "pid": self.pid, "tid": self.tid,
+            "args": {"name": f"{self.name} {self.trace_id}"},
+        }
+        return {"traceEvents": [meta] + self.events, "displayTimeUnit": "ms",
+                "otherData": {"trace_id": self.trace_id}}
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+def span(name: str, **args):
+    """在当前请求的 trace 中开启一个 span；未采样时返回空上下文。"""
+    trace = _current.get()
+    if trace is None:
+        return _NOOP
+    return Span(trace, name, args)
+
+
+def instant(name: str, **args):
+    trace = _current.get()
+    if trace is not None:
+        trace.instant(name, **args)
+
+
+def activate(trace: Optional[Trace]):
+    """把 trace 设为当前上下文的 trace（流式响应在另一个任务中迭代时需要重新绑定）。"""
+    _current.set(trace)
+
+
+def start_trace(headers=None, name: str = "request") -> Optional[Trace]:
+    """按请求头与采样率决定是否追踪；返回已激活的 Trace 或 None。"""
+    header = (headers or {}).get(TRACE_HEADER) if headers is not None else None
+    trace_id = None
+    if header is not None:
+        value = header.strip()
+        if value.lower() in ("0", "false", "off", "no"):
+            _current.set(None)
+            return None
+        if not is_admin(headers):
+            header = None
+    if header is not None:
+        if value.lower() not in ("1", "true", "on", "yes", ""):
+            # 作为文件名的一部分，只保留安全字符
+            trace_id = re.sub(r"[^A-Za-z0-9_-]", "", value)[:64] or None
+        sampled = True
+    else:
+        rate = float(get_setting("trace_sample_rate", 0.0))
+        sampled = rate > 0 and random.random() < rate
+    if not sampled:
+        _current.set(None)
+        return None
+    trace = Trace(trace_id or uuid.uuid4().hex[:16], name)
+    _current.set(trace)
+    return trace
+
+
+def _trace_dir() -> Path:
+    path = Path(get_setting("trace_dir", "traces"))
+    return path if path.is_absolute() else ROOT / path
+
+
+def _prune(directory: Path):
+    """只保留最新的 trace_max_files 个 trace 文件。"""
+    limit = int(get_setting("trace_max_files", DEFAULT_MAX_FILES))
+    files = []
+    for path in directory.glob("trace-*.json"):
+        try:
+            files.append((path.stat().st_mtime, path))
+        except OSError:
+            continue
+    if len(files) <= limit:
+        return
+    files.sort()
+    for _, path in files[:len(files) - limit]:
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+
+def _write(trace: Trace):
+    try:
+        directory = _trace_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        with open(directory / f"trace-{trace.trace_id}.json", "w", encoding="utf-8") as f:
+            json.dump(trace.to_chrome(), f, ensure_ascii=False)
+        _prune(directory)
+    except Exception as e:
+        logger.warning("[trace] export failed for %s: %s", trace.trace_id, e)
+
+
+def finish_trace(trace: Optional[Trace], **args):
+    """结束 trace：补一个覆盖整个请求的 span，并在线程池中写出 JSON 文件。"""
+    if trace is None or trace.finished:
+        return
+    trace.finished = True
+    trace.add_complete(trace.name, trace.start, _now_us() - trace.start, args)
+    try:
+        asyncio.get_running_loop().run_in_executor(None, _write, trace)
+    except RuntimeError:
+        _write(trace)